@@ -0,0 +1,105 @@
+import random
+import threading
+import numpy as np
+from scan_order import ScanOrder, GridScan
+
+
+class AdaptiveScan:
+    """Scan sequence whose points are chosen while scanning, from measurement results.
+
+    Values lie on a fine grid of resolution points between start and end (all scanned
+    instructions move synchronously). The first samp_num points cover the range uniformly in
+    a random order, every following point is chosen when it's about to be loaded: it splits
+    the interval between neighboring points whose loss, the length of the measured curve
+    segment (normalized x and y), is largest. So points concentrate where the signal changes.
+    Results are read from a measurement feed (see measurement_feed.py), points chosen but not
+    measured yet count with interpolated values. The scan has samp_num*rep points in total.
+    """
+
+    def __init__(self, start, end, samp_num, rep, feed, resolution=1001, seed=None):
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.samp_num = samp_num
+        self.rep = rep
+        self.feed = feed
+        self.resolution = max(resolution, samp_num)
+        # values of the fine grid, sample i is the i-th grid point
+        self.grid = GridScan(start, end, [0]*len(start), [self.resolution], 1, seed)
+        self.num_samples = self.resolution
+        self.shape = (samp_num*rep, len(start))
+
+        # coarse uniform samples in a random order come first
+        initial_order = ScanOrder(samp_num, seed)
+        coarse = np.round(np.linspace(0, self.resolution-1, samp_num)).astype(np.int64)
+        self.initial = coarse[initial_order.permute(np.arange(samp_num))].tolist()
+
+        self.chosen = [] # sample of each scan point chosen so far
+        # per grid point, kept up to date as points are chosen and results come in, so choosing
+        # a point costs the same at any length of the scan
+        self.present = np.zeros(self.resolution, dtype=bool) # chosen at least once
+        self.result_sum = np.zeros(self.resolution)
+        self.result_num = np.zeros(self.resolution, dtype=np.int64)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def sample_values(self, samples):
+        return self.grid.sample_values(samples)
+
+    def read_feed(self):
+        for index, value in self.feed.poll():
+            if 0 <= index < len(self.chosen):
+                self.result_sum[self.chosen[index]] += value
+                self.result_num[self.chosen[index]] += 1
+
+    def choose(self):
+        x = np.flatnonzero(self.present)
+        mx = x[self.result_num[x] > 0]
+        if len(mx) < 2:
+            # not enough results yet, split the largest gap
+            loss = np.diff(x).astype(np.float64)
+        else:
+            my = self.result_sum[mx] / self.result_num[mx]
+            y = np.interp(x, mx, my)
+            y_scale = (my.max()-my.min()) or 1.0
+            loss = np.hypot(np.diff(x)/(self.resolution-1), np.diff(y)/y_scale)
+        # intervals between neighboring grid points can't be split
+        loss[np.diff(x) <= 1] = 0
+        if len(loss) == 0 or loss.max() <= 0:
+            # everything is resolved, repeat a random point
+            return int(random.choice(x.tolist()))
+        i = int(np.argmax(loss))
+        return int((x[i]+x[i+1]) // 2)
+
+    def sample(self, k):
+        with self.lock:
+            while len(self.chosen) <= k:
+                if len(self.chosen) < len(self.initial):
+                    sample = self.initial[len(self.chosen)]
+                else:
+                    self.read_feed()
+                    sample = self.choose()
+                self.chosen.append(sample)
+                self.present[sample] = True
+            return self.chosen[k]
+
+    def samples(self, start, stop):
+        return np.array([self.sample(k) for k in range(start, stop)], dtype=np.int64)
+
+    def rows(self, start, stop):
+        return self.sample_values(self.samples(start, stop))
+
+    def values(self, k):
+        return self.rows(k, k+1)[0]
+
+    # scan values at positions (array) chosen so far, one row per position
+    def rows_at(self, positions):
+        with self.lock:
+            chosen = np.array(self.chosen, dtype=np.int64)
+        return self.sample_values(chosen[np.asarray(positions, dtype=np.int64)])
+
+    def settings(self):
+        return {"seed": self.seed, "sample number": self.samp_num, "repetition": self.rep,
+                "adaptive resolution": self.resolution}
@@ -0,0 +1,81 @@
+# Measure how fast the scanner can run on an emulated PulseBlasterUSB with simulated triggers, no hardware needed.
+# e.g. python benchmark_scan.py --rate 200 --points 1000 --instr 50
+import os
+import argparse
+import time
+import numpy as np
+os.environ.setdefault("SPINAPI_BACKEND", "emulator")
+import spinapi
+from pulse_program import PulseProgram, opcodes
+from scan_plan import ScanPlan, UnrolledScanPlan
+from scan_order import LinearScan
+from board_loader import BoardLoader
+from scan_worker import ScanWorker
+from cycle_log import CycleLog
+from triggers import EmulatorTrigger
+
+
+def make_program(num_instr):
+    # CONTINUE ... WAIT, BRANCH 0: the structure used for scanning
+    program = PulseProgram(num_instr)
+    for i in range(num_instr):
+        program.set_output(i, i % 24, 1)
+        program.set_duration(i, 1, 1)
+    program.set_opcode(num_instr-2, opcodes.index("WAIT"))
+    program.set_opcode(num_instr-1, opcodes.index("BRANCH"))
+    return program
+
+
+def run(rate, num_points, num_instr, guard, jitter, realtime, unroll, repetition=1, csv_file=None):
+    emulator = spinapi.use_backend("emulator")
+    emulator.realtime = realtime
+
+    plan = ScanPlan(make_program(num_instr), [0], LinearScan([1000], [100000], num_points, repetition))
+    if unroll:
+        plan = UnrolledScanPlan(plan)
+    loader = BoardLoader(min_guard=guard)
+    worker = ScanWorker(loader, plan)
+    trigger = EmulatorTrigger(emulator, 1.0/rate, jitter)
+
+    spinapi.pb_stop()
+    spinapi.pb_reset()
+    worker.load_next()
+    spinapi.pb_start()
+    start = time.perf_counter()
+    worker.log = CycleLog(start)
+    worker.start()
+    trigger.start(worker.trigger)
+    while not worker.finished:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    trigger.stop()
+    worker.stop()
+
+    latency = worker.log.latency() * 1000
+    if csv_file:
+        worker.log.write_csv(csv_file)
+    print("scan points:       %d (%d instructions each, %d loads)" % (plan.num_points, num_instr, len(plan)))
+    print("trigger rate:      %.1f Hz" % rate)
+    print("sustained rate:    %.1f cycles/s" % (trigger.emitted/elapsed))
+    print("late triggers:     %d (%d missed, %d duplicate, %d unconfirmed gaps, %d points requeued)" % (worker.late, worker.missed, worker.duplicates, worker.gaps, worker.requeued))
+    print("unchanged loads:   %d skipped, cache %d hits, %d misses" % (loader.skipped, loader.cache.hits, loader.cache.misses))
+    print("written:           %d instructions in %d loads" % (loader.written, len(plan)))
+    if len(latency):
+        print("load latency (ms): min %.3f, median %.3f, p99 %.3f, max %.3f" % (latency.min(), np.median(latency),
+                                                                             np.percentile(latency, 99), latency.max()))
+    print("modeled USB time:  %.3f s in %d calls" % (emulator.elapsed, sum(emulator.calls.values())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scan loop on an emulated PulseBlasterUSB.")
+    parser.add_argument("--rate", type=float, default=100.0, help="trigger rate in Hz")
+    parser.add_argument("--points", type=int, default=500, help="number of scan samples")
+    parser.add_argument("--rep", type=int, default=1, help="repetitions of each sample")
+    parser.add_argument("--instr", type=int, default=20, help="number of instructions in the program")
+    parser.add_argument("--guard", type=float, default=0.001, help="minimal guard time in s")
+    parser.add_argument("--jitter", type=float, default=0.0, help="trigger jitter in s")
+    parser.add_argument("--realtime", action="store_true", help="spend the modeled USB latency of every call")
+    parser.add_argument("--unroll", action="store_true", help="load many scan points per program")
+    parser.add_argument("--csv", help="write timestamps of every cycle to this file")
+    args = parser.parse_args()
+    run(args.rate, args.points, args.instr, args.guard, args.jitter, args.realtime, args.unroll, args.rep, args.csv)
@@ -0,0 +1,140 @@
+import time
+import logging
+import spinapi
+from spinapi import PULSE_PROGRAM
+from program_cache import ProgramCache, program_key
+
+# PulseBlasterUSB can be reprogrammed when it's in one of these states
+safe_status = spinapi.STATUS_STOPPED | spinapi.STATUS_RESET | spinapi.STATUS_WAITING
+
+
+class BoardLoader:
+    """Load scan points into PulseBlasterUSB as soon as it's safe after a trigger.
+
+    Instead of sleeping a fixed time, the loader waits at least min_guard seconds after the
+    trigger and then polls board status until the board is stopped or waiting. With a
+    BoardSet of several boards, each load holds the instructions of every board (see
+    BoardSetPlan) and all boards have to be safe.
+
+    Programs are identified by a hash of their content: a program that's already on the board
+    isn't loaded again (counted in skipped), and programs are prepared for loading once and
+    then taken from an LRU cache. Programming always starts at address 0 and instructions
+    beyond the last one written stay in memory, so only the instructions up to the last one
+    that differs from what's on the board are written (counted in written).
+    """
+
+    def __init__(self, min_guard=0.001, timeout=0.1, poll_interval=0.0002, boards=None, cache_size=256):
+        self.min_guard = min_guard # minimal time between a trigger and programming, in s
+        self.timeout = timeout # give up if board isn't safe to program this long after a trigger, in s
+        self.poll_interval = poll_interval
+        self.boards = boards
+        self.cache = ProgramCache(cache_size)
+        self.reset()
+
+    def reset(self):
+        self.last_load_end = None
+        # margin: time between the end of a load and the next trigger, i.e. spare time in a cycle
+        self.last_margin = None
+        self.min_margin = None
+        self.last_latency = None # time from a trigger to the end of its load
+        self.last_program_start = None # when programming of the last load started, None if nothing was written
+        self.last_late = False # True if the board wasn't stopped or waiting any more when the last load ended
+        self.loaded_key = None # content hash of the program on the board
+        self.skipped = 0 # loads skipped because the program was already on the board
+        self.loaded_args = None # instructions on each board, as lists of argument tuples
+        self.written = 0 # number of instructions written
+        self.cache.clear()
+
+    # number of instructions to write so the board holds args, given it holds loaded
+    @staticmethod
+    def changed_length(args, loaded):
+        if loaded is None:
+            return len(args)
+        for j in range(len(args)-1, -1, -1):
+            if j >= len(loaded) or args[j] != loaded[j]:
+                return j + 1
+        return 0
+
+    def prepare(self, instr_args):
+        if self.boards is None or self.boards.num_boards == 1:
+            return spinapi.pb_prepare_pbonly(instr_args)
+        return [spinapi.pb_prepare_pbonly(args) for args in instr_args]
+
+    # with a BoardSet, board calls go through it and hold its lock, also with a single board,
+    # so the GUI's thread can't call in between a load
+    def is_safe(self):
+        if self.boards is None:
+            return spinapi.pb_read_status() & safe_status
+        return all(status & safe_status for status in self.boards.read_status())
+
+    def wait_until_safe(self, trigger_time):
+        guard_end = trigger_time + self.min_guard
+        deadline = trigger_time + self.timeout
+        while True:
+            now = time.perf_counter()
+            if now < guard_end:
+                time.sleep(min(guard_end-now, self.poll_interval))
+                continue
+            if self.is_safe():
+                return True
+            if now > deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+    def load(self, instr_args, trigger_time=None):
+        # instr_args: list of argument tuples of pb_inst_pbonly, e.g. one element of a ScanPlan
+        if trigger_time is None:
+            trigger_time = time.perf_counter()
+
+        if self.last_load_end is not None:
+            self.last_margin = trigger_time - self.last_load_end
+            if (self.min_margin is None) or (self.last_margin < self.min_margin):
+                self.min_margin = self.last_margin
+
+        key = program_key(instr_args)
+        if key == self.loaded_key:
+            # the board runs the same program again, nothing to do
+            self.skipped += 1
+            self.last_program_start = None
+            self.last_late = False
+            self.last_load_end = time.perf_counter()
+            self.last_latency = self.last_load_end - trigger_time
+            return True
+        prepared = self.cache.get(key, instr_args, self.prepare)
+
+        if not self.wait_until_safe(trigger_time):
+            logging.warning("(BoardLoader) PulseBlasterUSB isn't stopped or waiting, instructions not loaded.")
+            return False
+
+        single = self.boards is None or self.boards.num_boards == 1
+        board_args = [instr_args] if single else instr_args
+        board_args = [args.tolist() if hasattr(args, "tolist") else args for args in board_args]
+        board_prepared = [prepared] if single else prepared
+        loaded = self.loaded_args or [None]*len(board_args)
+        # only the changed prefix of each board, None if a board doesn't change
+        writes = []
+        for args, board_loaded, board_prepared_args in zip(board_args, loaded, board_prepared):
+            length = self.changed_length(args, board_loaded)
+            writes.append(board_prepared_args[:length] if length > 0 else None)
+            self.written += length
+
+        # a failed load may leave any program on the board
+        self.loaded_key = None
+        self.loaded_args = None
+        self.last_program_start = time.perf_counter()
+        if self.boards is None:
+            ret = spinapi.pb_program_pbonly(writes[0], PULSE_PROGRAM) if writes[0] is not None else 0
+        else:
+            ret = self.boards.program(writes, PULSE_PROGRAM)
+        self.last_load_end = time.perf_counter()
+        self.last_latency = self.last_load_end - trigger_time
+        if ret < 0:
+            logging.warning("(BoardLoader) Error programming PulseBlasterUSB: %s" % spinapi.pb_get_error())
+            return False
+        # the board may have been triggered while it was programmed, then the cycle ran with part of
+        # the old program; a trigger right after the load looks the same, it only costs a repeated point
+        self.last_late = not self.is_safe()
+        self.loaded_key = key
+        self.loaded_args = [args if board_loaded is None or len(args) >= len(board_loaded) else args + board_loaded[len(args):]
+                            for args, board_loaded in zip(board_args, loaded)]
+        return True
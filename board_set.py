@@ -0,0 +1,111 @@
+import threading
+import logging
+import spinapi
+from spinapi import PULSE_PROGRAM
+
+
+class BoardSet:
+    """All PulseBlasterUSB boards of the system, used together as one board with more channels.
+
+    SpinAPI functions act on the board chosen with pb_select_board, which is global to the
+    library, so every select + call sequence holds a lock. Boards are programmed one after
+    another, programming time adds up over boards; a scan's loader prepares and caches the
+    instructions of every board beforehand (see board_loader.py), so only the USB transfers
+    themselves are left. With a single board nothing is ever selected again, so the usual
+    case costs nothing extra.
+    """
+
+    def __init__(self, num_boards=None):
+        if num_boards is None:
+            num_boards = spinapi.pb_count_boards()
+        self.num_boards = max(1, num_boards)
+        self.lock = threading.Lock()
+        self.selected = None
+        self.clock = 100.0 # core clock in MHz, as set by init()
+
+    # call with lock held
+    def select(self, board):
+        if self.num_boards > 1 and self.selected != board:
+            spinapi.pb_select_board(board)
+            self.selected = board
+
+    # call func on every board in turn, return the list of return values
+    def call_all(self, func, boards=None):
+        with self.lock:
+            ret = []
+            for board in (range(self.num_boards) if boards is None else boards):
+                self.select(board)
+                ret.append(func())
+            return ret
+
+    # initialize every board, return None, or an error message
+    def init(self, clock=100.0):
+        self.clock = clock
+        with self.lock:
+            for board in range(self.num_boards):
+                spinapi.pb_select_board(board)
+                self.selected = board
+                # pb_init() function has to be called before any programming/start/stop instructions
+                if spinapi.pb_init() != 0:
+                    return "Error initializing board %d: %s" % (board, spinapi.pb_get_error())
+                # Configure the core clock, in MHz
+                spinapi.pb_core_clock(clock)
+        return None
+
+    def program_board(self, board, instr, target=PULSE_PROGRAM):
+        if hasattr(instr, "tolist"):
+            instr = instr.tolist()
+        with self.lock:
+            self.select(board)
+            ret = spinapi.pb_program_pbonly(instr, target)
+            if ret < 0:
+                logging.warning("(BoardSet) Error programming board %d: %s" % (board, spinapi.pb_get_error()))
+            return ret
+
+    def program(self, programs, target=PULSE_PROGRAM):
+        # programs: instructions of each board (arrays or lists of pb_inst_pbonly arguments), None for boards left as they are
+        # return 0, or a negative error code if programming a board failed
+        ret = [self.program_board(board, instr, target) for board, instr in enumerate(programs) if instr is not None]
+        return min(ret + [0])
+
+    # start all boards back to back; for start times closer than host calls allow, trigger the
+    # boards with one hardware signal (they wait at their first WAIT)
+    def start(self):
+        # other boards first, so board 0, whose outputs usually trigger the experiment, starts last
+        return min(self.call_all(spinapi.pb_start, reversed(range(self.num_boards))))
+
+    def stop(self):
+        return min(self.call_all(spinapi.pb_stop))
+
+    def reset(self):
+        return min(self.call_all(spinapi.pb_reset))
+
+    def read_status(self):
+        return self.call_all(spinapi.pb_read_status)
+
+    def close(self):
+        return min(self.call_all(spinapi.pb_close))
+
+
+class BoardSetPlan:
+    """Scan plans of all boards, element k holds the instructions of every board for load k."""
+
+    def __init__(self, plans):
+        # every board loads the same scan points with each load
+        assert all(len(plan) == len(plans[0]) and plan.load_size(0) == plans[0].load_size(0) for plan in plans)
+        self.plans = plans
+        self.instr_index = plans[0].instr_index
+        self.sequence = plans[0].sequence
+        self.num_points = plans[0].num_points
+
+    def __len__(self):
+        return len(self.plans[0])
+
+    def __getitem__(self, k):
+        return [plan[k] for plan in self.plans]
+
+    def load_size(self, k):
+        return self.plans[0].load_size(k)
+
+    def position(self, k):
+        return self.plans[0].position(k)
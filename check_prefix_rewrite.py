@@ -0,0 +1,90 @@
+# Check that BoardLoader's prefix rewrite leaves the board with the same instruction memory as
+# programming every program in full, on two emulated boards, with random sequences of programs.
+# e.g. python check_prefix_rewrite.py --sequences 200 --loads 100
+# Exit status is 0 if the memories always matched, 1 otherwise.
+import os
+import sys
+import random
+import argparse
+import numpy as np
+os.environ.setdefault("SPINAPI_BACKEND", "emulator")
+import spinapi
+from pulse_program import opcodes
+from pb_emulator import PulseBlasterEmulator
+from board_loader import BoardLoader
+
+max_length = 60 # longest random program
+
+
+def random_instr(rng):
+    opcode = rng.choice([opcodes.index("CONTINUE")]*6 + [opcodes.index("WAIT"), opcodes.index("BRANCH")])
+    return (rng.getrandbits(24), opcode, rng.randrange(4), float(rng.randrange(50, 100000)))
+
+
+def next_program(rng, program, history):
+    # the next program of a sequence: the same one, scanned durations, another length, an earlier one, or a new one
+    choice = rng.random()
+    if choice < 0.1:
+        return list(program)
+    if choice < 0.5:
+        program = list(program)
+        for i in rng.sample(range(len(program)), rng.randint(1, min(3, len(program)))):
+            flags, opcode, opdata, duration = program[i]
+            program[i] = (flags, opcode, opdata, float(rng.randrange(50, 100000)))
+        return program
+    if choice < 0.7:
+        length = rng.randint(1, max_length)
+        return program[:length] + [random_instr(rng) for i in range(length - len(program))]
+    if choice < 0.85:
+        return list(rng.choice(history))
+    return [random_instr(rng) for i in range(rng.randint(1, max_length))]
+
+
+def check_sequence(emulator, rng, num_loads):
+    # board 0 is loaded by a BoardLoader, board 1 gets every program in full; return the number of mismatches
+    loader = BoardLoader(min_guard=0.0)
+    program = [random_instr(rng) for i in range(rng.randint(1, max_length))]
+    history = [program]
+    mismatches = 0
+    for k in range(num_loads):
+        spinapi.pb_select_board(0)
+        if not loader.load(program):
+            raise RuntimeError("Load failed: %s" % spinapi.pb_get_error())
+        spinapi.pb_select_board(1)
+        if spinapi.pb_program_pbonly(program) < 0:
+            raise RuntimeError("Programming failed: %s" % spinapi.pb_get_error())
+        prefix, full = emulator.boards[0].memory, emulator.boards[1].memory
+        if not np.array_equal(prefix, full):
+            mismatches += 1
+            first = int(np.flatnonzero(prefix != full)[0])
+            print("load %d: memory differs from address %d (program of %d instructions)" % (k, first, len(program)))
+        program = next_program(rng, program, history)
+        history.append(program)
+    return mismatches, loader.written
+
+
+def run(num_sequences, num_loads, seed):
+    rng = random.Random(seed)
+    mismatches = 0
+    written = 0
+    full = 0
+    for i in range(num_sequences):
+        # fresh boards for every sequence, whatever an earlier one left in memory
+        emulator = spinapi.use_backend(PulseBlasterEmulator(num_boards=2))
+        sequence_mismatches, sequence_written = check_sequence(emulator, rng, num_loads)
+        mismatches += sequence_mismatches
+        written += sequence_written
+        full += emulator.calls.get("pb_inst_pbonly", 0) - sequence_written
+    print("sequences:    %d of %d loads (seed %d)" % (num_sequences, num_loads, seed))
+    print("written:      %d instructions with prefix rewrite, %d in full" % (written, full))
+    print("mismatches:   %d" % mismatches)
+    return 0 if mismatches == 0 else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare prefix rewrite with full programming on emulated boards.")
+    parser.add_argument("--sequences", type=int, default=100, help="number of random program sequences")
+    parser.add_argument("--loads", type=int, default=100, help="programs loaded in each sequence")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random programs")
+    args = parser.parse_args()
+    sys.exit(run(args.sequences, args.loads, args.seed))
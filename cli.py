@@ -0,0 +1,162 @@
+# Run a saved config without the GUI, e.g. for batch runs on a computer without a display:
+#   python cli.py saved_configs/my_config.json load
+#   python cli.py saved_configs/my_config.json scan --output scan_sequence/overnight --trigger DAQ
+#   python cli.py saved_configs/my_config.json serve --address 127.0.0.1:5006
+# Exit status is 0 if the board was loaded or the scan finished, 1 on errors, 2 if the scan was
+# interrupted (Ctrl+C) or timed out.
+import os
+import sys
+import time
+import argparse
+import logging
+import configparser
+from spinapi import pb_get_version
+from program_config import read_config
+from board_set import BoardSet
+from scan_engine import ScanEngine, load_program, make_trigger_source
+from control_server import ControlServer, ScanController, default_address
+from scan_ring import ScanRing, default_path as default_ring_path
+from sequence_file import file_ext as sequence_file_ext
+
+exit_ok = 0
+exit_error = 1
+exit_interrupted = 2
+poll_interval = 0.1 # in s, how often a running scan is checked
+
+
+def run_load(boards, program, args):
+    before, after = load_program(boards, program, not args.no_optimize, args.clock)
+    print("Loaded %d instructions (%d before optimizing)." % (after, before))
+    return exit_ok
+
+
+# scans publish every cycle to the shared-memory ring, unless --ring is empty
+def open_ring(args):
+    if not args.ring:
+        return []
+    return [ScanRing(args.ring)]
+
+
+def run_scan(boards, program, scanner_settings, args):
+    file_name = args.output
+    if not args.no_datetime:
+        file_name += "_" + time.strftime("%Y%m%d_%H%M%S")
+    if os.path.exists(file_name+sequence_file_ext) and not args.overwrite:
+        print("Sequence file %s exists, use --overwrite to replace it." % (file_name+sequence_file_ext))
+        return exit_error
+    if args.sample_number is not None:
+        scanner_settings["sample number"] = args.sample_number
+    if args.repetition is not None:
+        scanner_settings["repetition"] = args.repetition
+
+    engine = ScanEngine(boards, program, scanner_settings, file_name, seed=args.seed, guard=args.guard/1000.0,
+                        unroll=args.unroll, optimize=not args.no_optimize, feed=args.adaptive,
+                        legacy_ini=args.ini, camera_file=args.camera_file, observers=open_ring(args),
+                        clock=args.clock)
+    engine.prepare()
+    print("Scanning %d points into %s" % (engine.plan.num_points, file_name+sequence_file_ext))
+    engine.start(make_trigger_source(args.trigger, args.daq_channel, args.rate))
+    status = exit_ok
+    deadline = None if args.timeout is None else time.perf_counter() + args.timeout
+    try:
+        while not engine.finished:
+            if deadline is not None and time.perf_counter() > deadline:
+                print("Timed out.")
+                status = exit_interrupted
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Interrupted.")
+        status = exit_interrupted
+    engine.stop()
+
+    worker = engine.worker
+    print("Ran %d cycles: %d late, %d missed, %d duplicate triggers, %d unconfirmed gaps, %d points requeued."
+          % (len(worker.positions), worker.late, worker.missed, worker.duplicates, worker.gaps, worker.requeued))
+    summary = engine.cycle_log.summary()
+    if summary is not None:
+        print("Load latency: min %.3f ms, median %.3f ms, p99 %.3f ms" % tuple(t*1000 for t in summary))
+    return status
+
+
+def run_serve(boards, program, scanner_settings, args):
+    # the config is the program until a client uploads another one
+    controller = ScanController(boards, program, scanner_settings, open_ring(args))
+    server = ControlServer(controller, args.address)
+    controller.observers.append(server)
+    server.start()
+    print("Serving on %s, Ctrl+C to stop." % args.address)
+    try:
+        while True:
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Interrupted.")
+    finally:
+        try:
+            controller.stop()
+        except ValueError:
+            pass
+        server.stop()
+    return exit_ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load or scan a saved PulseBlasterUSB config without the GUI.")
+    parser.add_argument("config", help="config file saved by the GUI (.json, or a legacy .ini)")
+    parser.add_argument("--no-optimize", action="store_true", help="load the program as it is")
+    parser.add_argument("--clock", type=float, default=100.0, help="core clock in MHz")
+    parser.add_argument("--ring", default=default_ring_path, help="shared-memory ring buffer scans publish their cycles to, empty for none")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("load", help="load the program into the board(s) once")
+    scan = commands.add_parser("scan", help="run the scan saved in the config")
+    scan.add_argument("--output", default=os.path.join("scan_sequence", "Scan_sequence"), help="sequence file name, without extension")
+    scan.add_argument("--no-datetime", action="store_true", help="don't append date and time to the file name")
+    scan.add_argument("--overwrite", action="store_true", help="replace an existing sequence file")
+    scan.add_argument("--ini", action="store_true", help="also save the sequence as INI")
+    scan.add_argument("--camera-file", help="also copy the sequence file here (without extension), for programs that read it from a fixed place")
+    scan.add_argument("--sample-number", help="sample number, or one per axis separated by commas (default: from config)")
+    scan.add_argument("--repetition", help="repetitions of each sample (default: from config)")
+    scan.add_argument("--seed", type=int, help="seed of the random order (default: random)")
+    scan.add_argument("--guard", type=float, default=1.0, help="minimal time between a trigger and loading, in ms")
+    scan.add_argument("--unroll", action="store_true", help="load many scan points per program")
+    scan.add_argument("--adaptive", metavar="FEED", help="adaptive scan with results from this feed, a file name or udp:<port>")
+    scan.add_argument("--trigger", choices=["DAQ", "Simulated"], default="DAQ", help="trigger source")
+    scan.add_argument("--daq-channel", default="Dev3/port0/line0", help="DAQ DIO channel of the WAITING signal")
+    scan.add_argument("--rate", type=float, default=50.0, help="rate of simulated triggers in Hz")
+    scan.add_argument("--timeout", type=float, help="stop the scan after this many seconds")
+    serve = commands.add_parser("serve", help="run the control server, for clients that upload programs, run scans and follow them")
+    serve.add_argument("--address", default=default_address, help="host:port to listen on, or unix:<path> for a Unix socket")
+    args = parser.parse_args(argv)
+
+    try:
+        program, scanner_settings = read_config(args.config)
+    except (OSError, ValueError, KeyError, configparser.Error) as err:
+        print("Can't read config file: %s" % err)
+        return exit_error
+
+    try:
+        boards = BoardSet()
+        print("Using SpinAPI Library version %s, %d board(s) found." % (pb_get_version(), boards.num_boards))
+        error = boards.init(args.clock)
+    except OSError as err:
+        error = str(err)
+    if error is not None:
+        print(error)
+        return exit_error
+    try:
+        if args.command == "load":
+            return run_load(boards, program, args)
+        if args.command == "serve":
+            return run_serve(boards, program, scanner_settings, args)
+        return run_scan(boards, program, scanner_settings, args)
+    except (OSError, ValueError) as err:
+        print(err)
+        return exit_error
+    finally:
+        # pb_close function has to be called at the end of any programming/start/stop instructions
+        boards.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(levelname)s: %(message)s")
+    sys.exit(main())
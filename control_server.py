@@ -0,0 +1,338 @@
+import os
+import json
+import stat
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from program_config import config_from_dict
+from scan_engine import ScanEngine, load_program, make_trigger_source
+from sequence_file import file_ext as sequence_file_ext
+
+# Local control server: clients connect to a TCP port on localhost (or a Unix socket) and
+# exchange JSON objects, one per line.
+#
+# Requests: {"command": name, "id": anything, ...}, answered with {"id": id, "ok": true, ...}
+# or {"id": id, "ok": false, "error": message}:
+#   "status"                          what's loaded and scanned
+#   "upload", "config": {...}         replace the program and scanner settings, a config as saved by the GUI
+#   "load", "optimize": true          load the program into the boards
+#   "scan", "options": {...}          start a scan, see make_engine() for the options
+#   "stop"                            stop the scan
+#   "subscribe" / "unsubscribe"       start or stop receiving events
+# Events: {"event": name, ...}
+#   "scan started"   file, columns, points, settings (as saved in the sequence file header)
+#   "cycle"          cycle (index in executed order), position (in the sequence), values (in ns, one per
+#                    column), flags (see cycle_log.py), trigger, program start, program end (time.perf_counter()
+#                    seconds, the system's monotonic clock, null where there was none)
+#   "cycle flags"    cycle, flags: a cycle turned out to be late after it was sent
+#   "scan stopped"   file, cycles, late, missed, duplicates, gaps, requeued
+#   "program"        instructions, after a program was uploaded
+#   "dropped"        count: events a slow client missed
+default_address = "127.0.0.1:5006"
+max_line = 2**24 # longest request, in bytes
+queue_size = 65536 # events kept for a client that doesn't read them fast enough
+
+
+def parse_address(address):
+    # "host:port" or "unix:<path>", return (host, port) or the path
+    if address.startswith("unix:"):
+        return address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def make_engine(boards, program, scanner_settings, options, observers=()):
+    # options of a scan request, all optional: "file" (without extension), "datetime" (append date and
+    # time to it, default true), "overwrite", "sample number", "repetition", "scanned instructions"
+    # (override scanner settings), "seed", "guard" (in ms), "unroll", "optimize", "feed" (adaptive scan),
+    # "ini", "trigger" ("DAQ" or "Simulated"), "daq channel", "rate" (of simulated triggers, in Hz)
+    settings = dict(scanner_settings)
+    for key in ("sample number", "repetition", "scanned instructions"):
+        if key in options:
+            settings[key] = options[key]
+    if not settings.get("scanned instructions"):
+        raise ValueError("No instructions to scan.")
+    file_name = options.get("file", os.path.join("scan_sequence", "Scan_sequence"))
+    if options.get("datetime", True):
+        file_name += "_" + time.strftime("%Y%m%d_%H%M%S")
+    if os.path.exists(file_name+sequence_file_ext) and not options.get("overwrite"):
+        raise ValueError("Sequence file %s exists." % (file_name+sequence_file_ext))
+    seed = options.get("seed")
+    engine = ScanEngine(boards, program, settings, file_name, seed=None if seed is None else int(seed),
+                        guard=float(options.get("guard", 1.0))/1000.0, unroll=bool(options.get("unroll")),
+                        optimize=bool(options.get("optimize", True)), feed=options.get("feed"),
+                        legacy_ini=bool(options.get("ini")), observers=observers)
+    trigger_source = make_trigger_source(options.get("trigger", "DAQ"), options.get("daq channel", "Dev3/port0/line0"),
+                                         float(options.get("rate", 50.0)))
+    return engine, trigger_source
+
+
+class ScanController:
+    """Commands of the control server without GUI, e.g. for cli.py serve.
+
+    A controller provides status(), upload(config), load(optimize), scan(options) and stop(),
+    each returning a dict for the answer or raising ValueError. The GUI has its own, which
+    runs them in Tk's thread.
+    """
+
+    def __init__(self, boards, program, scanner_settings, observers=()):
+        self.boards = boards
+        self.program = program
+        self.scanner_settings = scanner_settings
+        self.observers = list(observers)
+        self.engine = None
+        self.scanning = False
+        self.lock = threading.Lock()
+
+    def status(self):
+        status = {"boards": self.boards.num_boards, "instructions": len(self.program), "scanning": self.scanning}
+        if self.engine is not None:
+            status.update(file=self.engine.file_name, points=self.engine.plan.num_points,
+                          cycles=len(self.engine.worker.positions))
+        return status
+
+    def upload(self, config):
+        if self.scanning:
+            raise ValueError("A scan is running.")
+        self.program, self.scanner_settings = config_from_dict(config)
+        return {"instructions": len(self.program)}
+
+    def load(self, optimize=True):
+        if self.scanning:
+            raise ValueError("A scan is running.")
+        before, after = load_program(self.boards, self.program, optimize)
+        return {"instructions": before, "loaded": after}
+
+    def scan(self, options):
+        with self.lock:
+            if self.scanning:
+                raise ValueError("A scan is running.")
+            engine, trigger_source = make_engine(self.boards, self.program, self.scanner_settings, options, self.observers)
+            engine.prepare()
+            try:
+                engine.start(trigger_source)
+            except BaseException:
+                # e.g. ImportError of DAQ triggers without NI-DAQmx, boards and worker may be running already
+                try:
+                    engine.stop()
+                except Exception as err:
+                    logging.warning("(ScanController) %s" % err)
+                engine.close_feed()
+                raise
+            self.engine = engine
+            self.scanning = True
+        threading.Thread(target=self.wait_for_scan, args=(engine,), daemon=True).start()
+        return {"file": engine.file_name, "points": engine.plan.num_points}
+
+    # stop the scan when its last point has run
+    def wait_for_scan(self, engine):
+        while self.engine is engine and self.scanning and not engine.finished:
+            time.sleep(0.1)
+        with self.lock:
+            if self.engine is engine and self.scanning:
+                self.stop_engine()
+
+    def stop(self):
+        with self.lock:
+            if not self.scanning:
+                raise ValueError("No scan is running.")
+            return self.stop_engine()
+
+    # call with lock held
+    def stop_engine(self):
+        self.engine.stop()
+        self.scanning = False
+        return {"cycles": len(self.engine.worker.positions)}
+
+
+class Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.queue = asyncio.Queue(queue_size)
+        self.subscribed = False
+        self.dropped = 0
+
+
+class ControlServer:
+    """Asyncio server for a controller (ScanController, or the GUI's), on its own thread.
+
+    Requests of all clients are run one at a time on a worker thread, so a slow command never
+    blocks events. It's also an observer of scan engines: events are built on the server's
+    thread and queued for every subscribed client, a client that falls behind by more than
+    queue_size events loses events instead of slowing the scan down.
+    """
+
+    def __init__(self, controller, address=default_address):
+        self.controller = controller
+        self.address = address
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.clients = set()
+        self.subscribers = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="control")
+
+    # start serving, raise OSError if the address can't be used
+    def start(self):
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.server = self.loop.run_until_complete(self.listen())
+            except (OSError, ValueError) as err:
+                errors.append(err)
+                started.set()
+                self.loop.close()
+                return
+            started.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        if errors:
+            raise OSError("Can't serve on %s: %s" % (self.address, errors[0]))
+
+    async def listen(self):
+        address = parse_address(self.address)
+        if isinstance(address, str):
+            # a socket left behind by a server that didn't stop cleanly, never any other file
+            if os.path.exists(address):
+                if not stat.S_ISSOCK(os.stat(address).st_mode):
+                    raise ValueError("%s exists and isn't a socket." % address)
+                os.remove(address)
+            return await asyncio.start_unix_server(self.handle, address, limit=max_line)
+        return await asyncio.start_server(self.handle, address[0], address[1], limit=max_line)
+
+    def stop(self):
+        if self.loop is None or self.loop.is_closed():
+            return
+
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+        self.thread.join(timeout=1)
+        self.executor.shutdown(wait=False)
+
+    async def shutdown(self):
+        self.server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    async def handle(self, reader, writer):
+        client = Client(writer)
+        self.clients.add(client)
+        sender = asyncio.ensure_future(self.send(client))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    await client.queue.put(await self.answer(client, line))
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as err:
+            logging.warning("(ControlServer) %s" % err)
+        finally:
+            if client.subscribed:
+                self.subscribers -= 1
+            self.clients.discard(client)
+            sender.cancel()
+            writer.close()
+
+    async def send(self, client):
+        try:
+            while True:
+                line = await client.queue.get()
+                if client.dropped and client.queue.qsize() < queue_size // 2:
+                    client.writer.write(self.encode({"event": "dropped", "count": client.dropped}))
+                    client.dropped = 0
+                client.writer.write(line)
+                await client.writer.drain()
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    def encode(message):
+        return (json.dumps(message) + "\n").encode("utf-8")
+
+    async def answer(self, client, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            command = request["command"]
+            if command in ("subscribe", "unsubscribe"):
+                subscribe = command == "subscribe"
+                if subscribe != client.subscribed:
+                    client.subscribed = subscribe
+                    self.subscribers += 1 if subscribe else -1
+                result = {}
+            elif command == "status":
+                result = await self.run(self.controller.status)
+            elif command == "upload":
+                result = await self.run(self.controller.upload, request["config"])
+                self.broadcast({"event": "program", "instructions": result["instructions"]})
+            elif command == "load":
+                result = await self.run(self.controller.load, bool(request.get("optimize", True)))
+            elif command == "scan":
+                result = await self.run(self.controller.scan, request.get("options", {}))
+            elif command == "stop":
+                result = await self.run(self.controller.stop)
+            else:
+                raise ValueError("Unknown command: %s" % command)
+        except Exception as err:
+            # every request is answered, whatever went wrong
+            return self.encode({"id": request_id, "ok": False, "error": str(err) or type(err).__name__})
+        answer = {"id": request_id, "ok": True}
+        answer.update(result)
+        return self.encode(answer)
+
+    def run(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    # queue an event for every subscriber, on the server's thread
+    def broadcast(self, event):
+        line = self.encode(event)
+        for client in self.clients:
+            if client.subscribed:
+                try:
+                    client.queue.put_nowait(line)
+                except asyncio.QueueFull:
+                    client.dropped += 1
+
+    # safe to call from any thread
+    def publish(self, event):
+        if self.subscribers > 0 and self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.broadcast, event)
+
+    # observer of scan engines, see scan_engine.py
+    def scan_started(self, engine):
+        columns = [f"SpinCore [instr no. {i}]" for i in engine.plan.instr_index]
+        self.publish({"event": "scan started", "file": engine.file_name, "columns": columns,
+                      "points": engine.plan.num_points, "settings": engine.scan_param.settings()})
+
+    def scan_cycle(self, engine, cycle, position, flags, times):
+        # called on the scan's worker thread, scan values are looked up on the server's thread
+        if self.subscribers > 0 and self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.cycle_event, engine, cycle, position, flags, times)
+
+    def cycle_event(self, engine, cycle, position, flags, times):
+        if times is None:
+            self.broadcast({"event": "cycle flags", "cycle": cycle, "flags": flags})
+            return
+        trigger, program_start, program_end = times
+        self.broadcast({"event": "cycle", "cycle": cycle, "position": position,
+                        "values": engine.plan.sequence.values(position).tolist(), "flags": flags,
+                        "trigger": trigger, "program start": program_start, "program end": program_end})
+
+    def scan_stopped(self, engine):
+        worker = engine.worker
+        self.publish({"event": "scan stopped", "file": engine.file_name, "cycles": len(worker.positions),
+                      "late": worker.late, "missed": worker.missed, "duplicates": worker.duplicates,
+                      "gaps": worker.gaps, "requeued": worker.requeued})
@@ -0,0 +1,83 @@
+import threading
+import numpy as np
+
+# one row per trigger of a scan (and per cycle whose trigger was missed), times in s from the
+# scan's pb_start (perf_counter clock), NaN if there was no trigger or nothing was loaded for it
+cycle_dtype = np.dtype([("position", np.int64),         # position in the scan sequence of the point run in the cycle
+                        ("trigger", np.float64),        # trigger arrived
+                        ("program_start", np.float64),  # board found safe, programming started
+                        ("program_end", np.float64),    # programming finished
+                        ("written", np.int64),          # instructions written
+                        ("flags", np.int64)])           # cycle_* bits below
+csv_ext = "_cycles.csv"
+
+# flags of a cycle
+cycle_late = 1       # the board went on before loading ended, scan values of the cycle are unknown
+cycle_repeat = 2     # the board ran the point of the cycle before again
+cycle_missed = 4     # no trigger arrived for the cycle, the trigger source counted its edge
+cycle_duplicate = 8  # trigger came too soon after the one before to be a new cycle, it's ignored
+cycle_gap = 16       # long time since the trigger before, cycles may have been missed but it couldn't be confirmed
+
+
+class CycleLog:
+    """Timestamps of every scan cycle, written by the scan worker and read by the GUI.
+
+    Rows are stored in a growing array, so recording a cycle costs next to nothing; the
+    worker only appends and readers only look at rows below count.
+    """
+
+    def __init__(self, start_time, capacity=4096):
+        self.start_time = start_time # perf_counter() at pb_start
+        self.rows = np.zeros(capacity, dtype=cycle_dtype)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    # return the row number
+    def record(self, position, trigger, program_start=None, program_end=None, written=0, flags=0):
+        with self.lock:
+            if self.count == len(self.rows):
+                rows = np.zeros(2*len(self.rows), dtype=cycle_dtype)
+                rows[:self.count] = self.rows
+                self.rows = rows
+            nan = float("nan")
+            self.rows[self.count] = (position,
+                                     nan if trigger is None else trigger - self.start_time,
+                                     nan if program_start is None else program_start - self.start_time,
+                                     nan if program_end is None else program_end - self.start_time,
+                                     written, flags)
+            self.count += 1
+            return self.count - 1
+
+    def add_flags(self, row, flags):
+        with self.lock:
+            self.rows["flags"][row] |= flags
+
+    def cycles(self):
+        with self.lock:
+            return self.rows[:self.count].copy()
+
+    # time from trigger to the end of programming, in s, of every cycle that loaded something
+    def latency(self):
+        rows = self.cycles()
+        latency = rows["program_end"] - rows["trigger"]
+        return latency[~np.isnan(latency)]
+
+    def summary(self):
+        # min, median and p99 of latency, in s, None if no cycle loaded anything yet
+        latency = self.latency()
+        if len(latency) == 0:
+            return None
+        return latency.min(), np.median(latency), np.percentile(latency, 99)
+
+    def histogram(self, bins=20):
+        latency = self.latency()
+        if len(latency) == 0:
+            return np.zeros(bins, dtype=np.int64), np.zeros(bins+1)
+        return np.histogram(latency, bins=bins)
+
+    def write_csv(self, file_name):
+        rows = self.cycles()
+        columns = ["position", "trigger (s)", "program start (s)", "program end (s)", "written", "flags"]
+        np.savetxt(file_name, np.column_stack([rows[name] for name in cycle_dtype.names]),
+                   delimiter=",", header=",".join(columns), comments="",
+                   fmt=["%d", "%.7f", "%.7f", "%.7f", "%d", "%d"])
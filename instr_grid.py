@@ -0,0 +1,257 @@
+import tkinter as tk
+from pulse_program import channel_num, duration_unit, opcodes, format_duration
+
+bgcolorlist = ['lavender', 'honeydew'] # TTL output channel background color
+on_color = 'royal blue' # color of a channel that's turned on
+row_height = 22
+col_width = 84
+unit_width = 30 # part of the duration cell used for its unit
+name_width = 150 # device name column in front of channel labels
+label_width = 240
+
+# rows of the grid, followed by one row per channel and rows of op code, op data and instruction number
+row_duration = 0
+row_note = 1
+row_channel = 2 # channel i is in row row_channel+i
+
+
+class InstrGrid(tk.Frame):
+    """Instruction columns of the GUI, drawn on a canvas from a PulseProgram.
+
+    Only visible columns are drawn, so programs with hundreds of instructions open and scroll
+    quickly. Click a channel cell to toggle it (drag to paint several), click a duration,
+    note or op data cell to edit it in place, click a unit or op code cell to choose from a
+    menu. Device names of channels are edited the same way in the label column.
+    """
+
+    def __init__(self, master, program, width=900):
+        super().__init__(master)
+        self.x0 = 0 # horizontal scroll position, in pixels
+        self.edit_target = None # (row, instruction number) being edited in entry
+        self.paint_state = None # state set to channel cells while mouse is dragged
+
+        self.labels = tk.Canvas(self, width=label_width, borderwidth=0, highlightthickness=0)
+        self.labels.grid(row=0, column=0, sticky='n')
+        self.cells = tk.Canvas(self, width=width, borderwidth=0, highlightthickness=0, bg='white')
+        self.cells.grid(row=0, column=1, sticky='nw')
+        self.hsb = tk.Scrollbar(self, orient="horizontal", command=self.xview)
+        self.hsb.grid(row=1, column=1, sticky='ew')
+
+        # one entry and one menu are shared by all cells
+        self.editor = tk.Entry(self.cells, justify='center')
+        self.editor.bind("<Return>", lambda event: self.commit_edit())
+        self.editor.bind("<FocusOut>", lambda event: self.commit_edit())
+        self.editor.bind("<Escape>", lambda event: self.cancel_edit())
+        self.label_editor = tk.Entry(self.labels)
+        self.label_editor.bind("<Return>", lambda event: self.commit_label())
+        self.label_editor.bind("<FocusOut>", lambda event: self.commit_label())
+        self.label_editor.bind("<Escape>", lambda event: self.label_editor.place_forget())
+        self.menu = tk.Menu(self, tearoff=0)
+
+        self.cells.bind("<Button-1>", self.on_click)
+        self.cells.bind("<B1-Motion>", self.on_drag)
+        self.cells.bind("<ButtonRelease-1>", lambda event: setattr(self, "paint_state", None))
+        self.cells.bind("<Shift-MouseWheel>", lambda event: self.xview("scroll", int(-1*(event.delta/120)), "units"))
+        self.cells.bind("<Configure>", lambda event: self.refresh())
+        self.labels.bind("<Button-1>", self.on_label_click)
+
+        self.set_program(program)
+
+    # show another program, its number of channels may differ
+    def set_program(self, program):
+        self.commit_edit()
+        self.program = program
+        self.num_channels = program.num_channels
+        self.row_opcode = row_channel + self.num_channels
+        self.row_opdata = self.row_opcode + 1
+        self.row_instrnum = self.row_opdata + 1
+        height = (self.row_instrnum+1)*row_height
+        self.labels.configure(height=height)
+        self.cells.configure(height=height)
+        self.draw_labels()
+        self.refresh()
+
+    def set_width(self, width):
+        width = max(width, col_width)
+        if int(self.cells["width"]) != width:
+            self.cells.configure(width=width)
+            self.refresh()
+
+    def draw_labels(self):
+        c = self.labels
+        c.delete("all")
+        texts = {row_duration: "Duration:", row_note: "Note:", self.row_opcode: "Op code:",
+                 self.row_opdata: "Op data:", self.row_instrnum: "Instruction #:"}
+        for row, text in texts.items():
+            c.create_text(label_width-8, (row+0.5)*row_height, text=text, anchor='e')
+        for ch in range(self.num_channels):
+            y = (row_channel+ch)*row_height
+            c.create_rectangle(4, y+2, name_width, y+row_height-2, fill='white', outline='gray60')
+            c.create_text(8, y+row_height/2, text=self.program.channel_labels[ch], anchor='w')
+            c.create_rectangle(name_width+8, y, label_width, y+row_height, fill=bgcolorlist[ch%2], outline='')
+            if self.program.num_boards > 1:
+                text = 'Board {} ch {}'.format(*divmod(ch, channel_num))
+            else:
+                text = 'Channel '+str(ch)
+            c.create_text((name_width+8+label_width)/2, y+row_height/2, text=text)
+
+    def visible_range(self):
+        width = int(self.cells["width"])
+        first = self.x0 // col_width
+        last = min(len(self.program), (self.x0+width) // col_width + 1)
+        return first, last
+
+    # redraw visible columns and scrollbar, call this whenever program is changed elsewhere
+    def refresh(self):
+        total = len(self.program)*col_width
+        width = int(self.cells["width"])
+        self.x0 = max(0, min(self.x0, total-width))
+        self.cells.delete("all")
+        first, last = self.visible_range()
+        for i in range(first, last):
+            self.draw_column(i)
+        if total > 0:
+            self.hsb.set(self.x0/total, min(1.0, (self.x0+width)/total))
+        else:
+            self.hsb.set(0.0, 1.0)
+
+    def draw_column(self, i):
+        c = self.cells
+        p = self.program
+        x = i*col_width - self.x0
+        mid = x + col_width/2
+        tag = f"col{i}"
+
+        def cell(row, text, x_left=x, x_right=x+col_width, fill='white'):
+            y = row*row_height
+            c.create_rectangle(x_left+1, y+1, x_right-1, y+row_height-1, fill=fill, outline='gray70', tags=tag)
+            c.create_text((x_left+x_right)/2, y+row_height/2, text=text, tags=tag)
+
+        cell(row_duration, format_duration(p.duration_value(i)), x_right=x+col_width-unit_width)
+        cell(row_duration, duration_unit[p.unit[i]], x_left=x+col_width-unit_width)
+        cell(row_note, p.notes[i])
+        outputs = p.outputs(i)
+        for ch in range(self.num_channels):
+            y = (row_channel+ch)*row_height
+            c.create_rectangle(x, y, x+col_width, y+row_height, fill=bgcolorlist[ch%2], outline='', tags=tag)
+            c.create_rectangle(mid-7, y+4, mid+7, y+row_height-4, outline='gray40',
+                               fill=on_color if outputs[ch] else 'white', tags=tag)
+        cell(self.row_opcode, opcodes[p.instr["opcode"][i]])
+        cell(self.row_opdata, str(p.instr["opdata"][i]))
+        c.create_text(mid, (self.row_instrnum+0.5)*row_height, text=str(i), tags=tag)
+
+    def redraw_column(self, i):
+        self.cells.delete(f"col{i}")
+        first, last = self.visible_range()
+        if first <= i < last:
+            self.draw_column(i)
+
+    def xview(self, *args):
+        self.commit_edit()
+        total = len(self.program)*col_width
+        width = int(self.cells["width"])
+        if args[0] == "moveto":
+            self.x0 = int(float(args[1])*total)
+        elif args[0] == "scroll":
+            step = col_width if args[2] == "units" else width
+            self.x0 += int(args[1])*step
+        self.refresh()
+
+    # instruction number and row of a mouse event
+    def locate(self, event):
+        return (event.x + self.x0) // col_width, event.y // row_height
+
+    def on_click(self, event):
+        self.commit_edit()
+        i, row = self.locate(event)
+        if not 0 <= i < len(self.program):
+            return
+        x = i*col_width - self.x0
+        if row_channel <= row < self.row_opcode:
+            ch = row - row_channel
+            self.paint_state = 1 - self.program.output(i, ch)
+            self.program.set_output(i, ch, self.paint_state)
+            self.redraw_column(i)
+        elif row == row_duration and event.x >= x+col_width-unit_width:
+            self.popup(duration_unit, lambda unit: self.set_unit(i, unit), event)
+        elif row == self.row_opcode:
+            self.popup(opcodes, lambda opcode: self.set_opcode(i, opcode), event)
+        elif row == row_duration:
+            self.start_edit(i, row, format_duration(self.program.duration_value(i)), x, col_width-unit_width)
+        elif row == row_note:
+            self.start_edit(i, row, self.program.notes[i], x, col_width)
+        elif row == self.row_opdata:
+            self.start_edit(i, row, str(self.program.instr["opdata"][i]), x, col_width)
+
+    def on_drag(self, event):
+        if self.paint_state is None:
+            return
+        i, row = self.locate(event)
+        if 0 <= i < len(self.program) and row_channel <= row < self.row_opcode:
+            ch = row - row_channel
+            if self.program.output(i, ch) != self.paint_state:
+                self.program.set_output(i, ch, self.paint_state)
+                self.redraw_column(i)
+
+    def popup(self, values, command, event):
+        self.menu.delete(0, 'end')
+        for j, value in enumerate(values):
+            self.menu.add_command(label=value, command=lambda j=j: command(j))
+        self.menu.tk_popup(event.x_root, event.y_root)
+
+    def set_unit(self, i, unit):
+        # keep the number shown, as changing the unit of a column used to do
+        self.program.set_duration(i, self.program.duration_value(i), unit)
+        self.redraw_column(i)
+
+    def set_opcode(self, i, opcode):
+        self.program.set_opcode(i, opcode)
+        self.redraw_column(i)
+
+    def start_edit(self, i, row, text, x, width):
+        self.edit_target = (row, i)
+        self.editor.delete(0, 'end')
+        self.editor.insert(0, text)
+        self.editor.place(x=x, y=row*row_height, width=width, height=row_height)
+        self.editor.select_range(0, 'end')
+        self.editor.focus_set()
+
+    def cancel_edit(self):
+        self.edit_target = None
+        self.editor.place_forget()
+
+    def commit_edit(self):
+        if self.edit_target is None:
+            return
+        row, i = self.edit_target
+        self.cancel_edit()
+        if i >= len(self.program):
+            return
+        text = self.editor.get()
+        try:
+            if row == row_duration:
+                self.program.set_duration(i, float(text), self.program.unit[i])
+            elif row == self.row_opdata:
+                self.program.set_opdata(i, int(text))
+            elif row == row_note:
+                self.program.set_note(i, text)
+        except ValueError:
+            self.bell()
+        self.redraw_column(i)
+
+    def on_label_click(self, event):
+        row = event.y // row_height
+        if row_channel <= row < self.row_opcode and event.x <= name_width:
+            ch = row - row_channel
+            self.label_target = ch
+            self.label_editor.delete(0, 'end')
+            self.label_editor.insert(0, self.program.channel_labels[ch])
+            self.label_editor.place(x=4, y=row*row_height+1, width=name_width-4, height=row_height-2)
+            self.label_editor.focus_set()
+
+    def commit_label(self):
+        if not self.label_editor.winfo_ismapped():
+            return
+        self.program.channel_labels[self.label_target] = self.label_editor.get()
+        self.label_editor.place_forget()
+        self.draw_labels()
@@ -5,133 +5,35 @@ import time
 import configparser
 import os
 import logging
-import numpy as np
-import nidaqmx
-import nidaqmx.constants as const
+import threading
+import queue
+import concurrent.futures
 from spinapi import *
+from pulse_program import PulseProgram, duration_unit, unit_scale, format_duration
+from board_set import BoardSet
+from scan_engine import ScanEngine, load_program, make_trigger_source
+from sequence_file import file_ext as sequence_file_ext
+from instr_grid import InstrGrid, label_width
+from program_config import read_config, write_config, config_from_dict, file_ext as config_file_ext
+from control_server import ControlServer, make_engine, default_address as default_server_address
+from scan_ring import ScanRing
 
-channel_num = 24 # number of TTL output channels of SpinCore PulseBlasterUSB
 button_color = 'white'
-bgcolorlist = ['lavender', 'honeydew'] # TTL output channel background color
-duration_unit = ["ms", "us", "ns"]
-opcodes = ["CONTINUE", "STOP", "LOOP", "END_LOOP", "JSR", "RTS", "BRANCH", "LONG_DELAY", "WAIT"]
+display_interval = 100 # in ms, how often scan progress is updated in GUI
+histogram_size = (200, 50) # in pixels, latency histogram in scanner
+histogram_bins = 25
+init_poll_interval = 50 # in ms, how often the GUI checks if boards are initialized
+server_poll_interval = 20 # in ms, how often commands of the control server are run
+server_call_timeout = 30 # in s, how long a command of the control server waits for Tk's thread
+# scanner entries until the scanner is first shown, in the format of config files
+default_scanner_settings = {"sample number": "10", "repetition": "20", "scanned instructions": [
+    {"instr no.": "0", "start duration": "1", "start unit": "ms", "end duration": "10", "end unit": "ms", "axis": "0"}]*2}
 
 class newCombobox(ttk.Combobox):
     def __init__(self, master, **kwargs):
         super().__init__(master, **kwargs)
         self.unbind_class("TCombobox", "<MouseWheel>")
 
-# the first column of this GUI, which are mainly descriptive labels
-class Descr(tk.LabelFrame):
-    def __init__(self, master=None):
-        super().__init__(master)
-        self.configure(relief='flat', borderwidth=0, highlightthickness=0)
-        self.place_duration()
-        self.place_note()
-        self.place_channels()
-        self.place_opcode()
-        self.place_opdata()
-        self.place_instrnum()
-
-    def place_duration(self):
-        self.du = tk.Label(self, text='Duration:')
-        self.du.grid(row=0, column=1, padx=0, ipady=1)
-
-    def place_note(self):
-        self.un = tk.Label(self, text='Note:')
-        self.un.grid(row=1, column=1, padx=0, ipady=1)
-
-    def place_channels(self):
-        self.ch_label_list = []
-        for i in range(channel_num):
-            bgcolor = bgcolorlist[i%2]
-            ch_label = tk.Entry(self, width=20)
-            ch_label.grid(row=2+i, column=0, padx=8, sticky='e')
-            self.ch_label_list.append(ch_label)
-            self.ch = tk.Label(self, text='Channel '+str(i), bg=bgcolor, anchor="center")
-            self.ch.grid(row=2+i, column=1, ipady=2, sticky='news')
-
-    def place_opcode(self):
-        self.opc = tk.Label(self, text='Op code:')
-        self.opc.grid(row=channel_num+2, column=1)
-
-    def place_opdata(self):
-        self.opd = tk.Label(self, text='Op data:')
-        self.opd.grid(row=channel_num+3, column=1)
-
-    def place_instrnum(self):
-        self.ins = tk.Label(self, text='Instruction #:')
-        self.ins.grid(row=channel_num+4, column=1)
-
-    def compile_ch_label_text(self):
-        self.ch_label_text = []
-        for i in reversed(range(channel_num)):
-            self.ch_label_text.append(self.ch_label_list[i].get())
-
-
-# the 2rd to nth column of this gui, which are instruction data that will be pased to PulseBlasterUSB
-class Instr(tk.LabelFrame):
-    def __init__(self, master, instr_num):
-        super().__init__(master)
-        self.configure(relief='flat', borderwidth=0, highlightthickness=0)
-        self.instr_num = instr_num
-        self.place_duration()
-        self.place_note()
-        self.place_checkboxes()
-        self.place_opcode()
-        self.place_opdata()
-        self.place_instrnum()
-
-    def place_duration(self):
-        label_frame = tk.LabelFrame(self, width=9, relief='flat')
-        label_frame.grid(row=0, column=0, padx=0)
-        self.du = tk.Entry(label_frame, width=6)
-        self.du.insert(0, "10")
-        self.du.grid(row=0, column=0, padx=0)
-        self.un = newCombobox(label_frame, values=duration_unit, width=3, state="readonly")
-        self.un.grid(row=0, column=1, padx=0)
-        self.un.current(0)
-
-    def place_note(self):
-        self.note = tk.Entry(self, width=12)
-        self.note.grid(row=1, column=0)
-
-    def place_checkboxes(self):
-        self.cbvarlist = []
-        self.cblist = []
-        for i in range(channel_num):
-            bgcolor = bgcolorlist[i%2]
-            self.cbvarlist.append(tk.IntVar())
-            self.cblist.append(tk.Checkbutton(self, bg=bgcolor, anchor="center", variable=self.cbvarlist[i]))
-            self.cblist[i].grid(row=i+2, column=0, padx=0, pady=0, sticky='news')
-
-    def place_opcode(self):
-        self.opc = newCombobox(self, values=opcodes, width=10, state="readonly")
-        self.opc.grid(row=channel_num+2, column=0, padx=8, sticky="news")
-        self.opc.current(0)
-
-    def place_opdata(self):
-        self.opd = tk.Entry(self, width=2)
-        self.opd.grid(row=channel_num+3, column=0)
-        self.opd.insert(0, "0")
-
-    def place_instrnum(self):
-        self.ins = tk.Label(self, text=str(self.instr_num))
-        self.ins.grid(row=channel_num+4, column=0)
-
-    def compile_instr(self):
-        # collect user defined values and compile tham as a list, it will later be passed to PulseBlaterUSB
-        self.values = [0, 0, 0, 0, 0] # instr note, channel output, opcode, opdata and duration with unit for each channel
-        self.values[0] = self.note.get()
-        self.values[1] = 0
-        for i in range(channel_num):
-            self.values[1] += self.cbvarlist[i].get() * (2**i)
-        self.values[2] = self.opc.current()
-        self.values[3] = int(self.opd.get())
-        self.values[4] = float(self.du.get()) * (1000**(2-self.un.current()))
-        # print(self.values[4])
-
-
 class Scanner(tk.LabelFrame):
     def __init__(self, MainWindow):
         super().__init__(MainWindow.frame)
@@ -139,14 +41,19 @@ class Scanner(tk.LabelFrame):
         self.main = MainWindow
         self.num_scan_instr = 2
         self.scan_instr_list = []
+        self.engine = None
+        self.scanning = False
 
         self.place_progress_bar()
         self.place_guides()
         self.place_add_del()
+        self.place_guard_time()
+        self.place_seed()
         self.place_scan_button()
         self.place_sample_num()
         self.place_repetition()
         self.place_DAQ_ch()
+        self.place_adaptive()
         self.place_file_name()
         self.place_scan_instr()
 
@@ -186,14 +93,29 @@ class Scanner(tk.LabelFrame):
             self.end_un.grid(row=0, column=1, padx=0)
             self.end_un.current(0)
 
-        def compile(self):
-            self.start = float(self.start_du.get()) * (1000**(2-self.start_un.current()))
-            self.end = float(self.end_du.get()) * (1000**(2-self.end_un.current()))
-            self.instr = int(self.instr_entry.get())
+            # instructions on the same axis are scanned synchronously, different axes form a grid
+            axis_label = tk.Label(self, text='Axis:')
+            axis_label.grid(row=3, column=0)
+            self.axis_entry = tk.Entry(self, width=5)
+            self.axis_entry.insert(0, '0')
+            self.axis_entry.grid(row=3, column=1, sticky='w')
 
     def place_progress_bar(self):
-        self.progbar = ttk.Progressbar(self, orient='horizontal', length=200, mode='determinate')
+        progress_frame = tk.LabelFrame(self, relief='flat')
+        progress_frame.grid(row=0, column=0)
+        self.progbar = ttk.Progressbar(progress_frame, orient='horizontal', length=200, mode='determinate')
         self.progbar.grid(row=0, column=0)
+        # spare time in a cycle, from the end of a load to the next trigger
+        self.margin_label = tk.Label(progress_frame, text='Margin: -')
+        self.margin_label.grid(row=1, column=0)
+        # scan values of the point that's currently loaded
+        self.current_label = tk.Label(progress_frame, text='Current: -')
+        self.current_label.grid(row=2, column=0)
+        # time from trigger to the end of programming, statistics and histogram of all cycles so far
+        self.latency_label = tk.Label(progress_frame, text='Latency: -')
+        self.latency_label.grid(row=3, column=0)
+        self.histogram = tk.Canvas(progress_frame, width=histogram_size[0], height=histogram_size[1], bg='white', highlightthickness=0)
+        self.histogram.grid(row=4, column=0)
 
     def place_guides(self):
         protocol = "Control Protocol:\n\n"
@@ -212,6 +134,28 @@ class Scanner(tk.LabelFrame):
         self.add_button = tk.Button(self, text="+", width=6, bg=button_color, command=self.add_scan_instr)
         self.add_button.grid(row=0, column=3)
 
+    def place_seed(self):
+        seed_frame = tk.LabelFrame(self, relief='flat')
+        seed_frame.grid(row=0, column=7)
+        seed_label = tk.Label(seed_frame, text='Seed:')
+        seed_label.grid(row=0, column=0)
+        # leave it empty for a new random order every scan
+        self.seed = tk.Entry(seed_frame, width=11)
+        self.seed.grid(row=0, column=1)
+
+    def place_guard_time(self):
+        guard_frame = tk.LabelFrame(self, relief='flat')
+        guard_frame.grid(row=0, column=4)
+        guard_label = tk.Label(guard_frame, text='Guard (ms):')
+        guard_label.grid(row=0, column=0)
+        self.guard_time = tk.Entry(guard_frame, width=5)
+        self.guard_time.insert(0, "1")
+        self.guard_time.grid(row=0, column=1)
+        # load many scan points at once, separated by their WAIT instructions
+        self.unroll_var = tk.IntVar()
+        self.unroll_cb = tk.Checkbutton(guard_frame, variable=self.unroll_var, text="Unroll")
+        self.unroll_cb.grid(row=0, column=2)
+
     def place_sample_num(self):
         sample_label = tk.Label(self, text='Sample number:')
         sample_label.grid(row=1, column=1, pady=3, sticky='e')
@@ -233,6 +177,32 @@ class Scanner(tk.LabelFrame):
         self.daq_ch.insert(0, "Dev3/port0/line0")
         self.daq_ch.grid(row=1, column=6, sticky='w')
 
+        # where triggers come from, simulated triggers are used to test scan speed without hardware
+        self.trigger_src = newCombobox(self, values=["DAQ", "Simulated"], width=9, state="readonly")
+        self.trigger_src.grid(row=1, column=7, padx=5)
+        self.trigger_src.current(0)
+        rate_frame = tk.LabelFrame(self, relief='flat')
+        rate_frame.grid(row=2, column=7)
+        rate_label = tk.Label(rate_frame, text='Rate (Hz):')
+        rate_label.grid(row=0, column=0)
+        self.sim_rate = tk.Entry(rate_frame, width=5)
+        self.sim_rate.insert(0, "50")
+        self.sim_rate.grid(row=0, column=1)
+
+    def place_adaptive(self):
+        # choose scan points from measurement results of the analysis program
+        self.adaptive_var = tk.IntVar()
+        self.adaptive_cb = tk.Checkbutton(self, variable=self.adaptive_var, text="Adaptive")
+        self.adaptive_cb.grid(row=1, column=8, sticky='w')
+        feed_frame = tk.LabelFrame(self, relief='flat')
+        feed_frame.grid(row=2, column=8)
+        feed_label = tk.Label(feed_frame, text='Feed:')
+        feed_label.grid(row=0, column=0)
+        # a file name, or udp:<port>
+        self.feed = tk.Entry(feed_frame, width=16)
+        self.feed.insert(0, "udp:5005")
+        self.feed.grid(row=0, column=1)
+
     def place_scan_button(self):
         self.scan_button = tk.Button(self, text="Scan", width=6, bg=button_color, command=self.scan)
         self.scan_button.grid(row=0, column=5)
@@ -249,8 +219,15 @@ class Scanner(tk.LabelFrame):
 
         self.datetime_var = tk.IntVar()
         self.datetime_var.set(1)
-        self.datetime_cb = tk.Checkbutton(self, variable=self.datetime_var, text=r"Auto append data & time")
-        self.datetime_cb.grid(row=2, column=5, columnspan=2)
+        file_option_frame = tk.LabelFrame(self, relief='flat')
+        file_option_frame.grid(row=2, column=5, columnspan=2)
+        self.datetime_cb = tk.Checkbutton(file_option_frame, variable=self.datetime_var, text=r"Auto append data & time")
+        self.datetime_cb.grid(row=0, column=0)
+
+        # sequence is saved in a binary format, INI files can be saved as well for programs that still read them
+        self.legacy_var = tk.IntVar()
+        self.legacy_cb = tk.Checkbutton(file_option_frame, variable=self.legacy_var, text=r"Also save INI")
+        self.legacy_cb.grid(row=0, column=1)
 
     def place_scan_instr(self):
         self.instr_frame = tk.LabelFrame(self, relief='flat')
@@ -274,87 +251,105 @@ class Scanner(tk.LabelFrame):
             self.del_button["state"] = "normal"
 
     def scan(self):
+        if not self.main.boards_ready():
+            return
         self.widgets_state_change("disabled")
         self.stop_button["state"] = "normal"
 
-        # generate randomized scan parameters
-        samp_num = int(self.sample_num.get())
-        rep = int(self.repetition.get())
-        self.scan_instr_list[0].compile()
-        self.scan_param = np.linspace(self.scan_instr_list[0].start, self.scan_instr_list[0].end, samp_num)
-        if self.num_scan_instr > 1:
-            for i in range(self.num_scan_instr-1):
-                self.scan_instr_list[i+1].compile()
-                s = np.linspace(self.scan_instr_list[i+1].start, self.scan_instr_list[i+1].end, samp_num)
-                self.scan_param = np.vstack((self.scan_param, s))
-
-        # instruction number sanity check
-        for i in range(self.num_scan_instr):
-            if self.scan_instr_list[i].instr > self.main.num_instr-1:
-                tk.messagebox.showerror("Error", "(Scanner) Insturction number doesn't exist.")
-                self.widgets_state_change("normal")
-                self.stop_button["state"] = "disabled"
-                return
-
-        self.scan_param = self.scan_param.T
-        self.scan_param = np.repeat(self.scan_param, rep, axis=0)
-        np.random.shuffle(self.scan_param)
-        # if scan_param is a 1-dim array, it will be turned into 2-dim
-        # if scan_param is a 2-dim array, it won't change
-        self.scan_param = np.reshape(self.scan_param, (len(self.scan_param), -1))
-
-        # save randomized scan sequence self.scan_param to a local file
-        saved = self.save_sequence()
-        if not saved:
+        # save randomized scan sequence to a local file
+        file_name = self.sequence_file_name()
+        if file_name is None:
             self.widgets_state_change("normal")
             self.stop_button["state"] = "disabled"
             return
 
-        # stop and reset spincore
-        pb_stop()
-        pb_reset()
+        # scan sequence, precompiled instructions and the hardware worker, see scan_engine.py
+        feed = self.feed.get() if self.adaptive_var.get() else None
+        try:
+            seed = int(self.seed.get()) if self.seed.get().strip() else None
+            guard = float(self.guard_time.get())/1000.0
+            rate = float(self.sim_rate.get())
+            engine = ScanEngine(self.main.boards, self.main.program, self.settings(), file_name, seed=seed,
+                                guard=guard, unroll=bool(self.unroll_var.get()),
+                                optimize=bool(self.main.optimize_var.get()), feed=feed,
+                                legacy_ini=bool(self.legacy_var.get()), observers=self.main.scan_observers())
+            engine.prepare()
+        except ValueError as err:
+            tk.messagebox.showerror("Error", "(Scanner) " + str(err))
+            self.widgets_state_change("normal")
+            self.stop_button["state"] = "disabled"
+            return
 
-        # set up a counter for number of points that have been scanned
-        self.counter = 0
+        self.engine = engine
 
-        # load spincore the first scan parameters
-        self.load_param()
+        # a DAQ is used to read Spincore "running" signal, a falling edge will be used to trigger loading
+        # or simulated triggers, to test scan speed without hardware
+        try:
+            self.start_engine(make_trigger_source(self.trigger_src.get(), self.daq_ch.get(), rate))
+        except Exception as err:
+            tk.messagebox.showerror("Error", "(Scanner) " + (str(err) or type(err).__name__))
 
-        # start spincore and make it ready to be triggered
-        pb_start()
+    # start the prepared self.engine, for the Scan button or a control server client
+    def start_engine(self, trigger_source):
+        self.widgets_state_change("disabled")
+        self.stop_button["state"] = "normal"
+        self.main.show_instr_count(*self.engine.num_instr)
+        try:
+            self.engine.start(trigger_source)
+        except BaseException:
+            # e.g. ImportError of DAQ triggers without NI-DAQmx, boards and worker may be running already
+            try:
+                self.engine.stop()
+            except Exception as err:
+                logging.warning(err)
+            self.engine.close_feed()
+            self.widgets_state_change("normal")
+            self.stop_button["state"] = "disabled"
+            raise
+        self.scanning = True
+        self.update_progress()
+
+    # GUI updates are coalesced and applied at a fixed display rate in Tk's thread
+    def update_progress(self):
+        worker = self.engine.worker
+        loader = self.engine.loader
+        if worker.finished:
+            self.stop_scan()
+            return
 
-        # a DAQ is used to read Spincore "running" signal, a falling edge will be used to trigger loading
-        self.task = nidaqmx.Task()
-        ch = self.daq_ch.get()
-        self.task.di_channels.add_di_chan(ch)
-        self.task.timing.cfg_change_detection_timing(rising_edge_chan=ch,
-                                                    sample_mode=const.AcquisitionType.CONTINUOUS
-                                                    )
-        # see https://nidaqmx-python.readthedocs.io/en/latest/task.html for the prototype of callback method
-        self.task.register_signal_event(const.Signal.CHANGE_DETECTION_EVENT, self.load_param)
-
-        self.task.start()
-
-    def load_param(self, task_handle=None, signal_type=None, callback_date=None):
-        time.sleep(0.02)
-        if self.counter < len(self.scan_param):
+        counter = worker.points
+        self.progbar['value'] = (counter-1)/(self.engine.plan.num_points+worker.requeued)*100.0
+        if loader.min_margin is not None:
+            self.margin_label["text"] = ("Margin: {:.1f} ms (min {:.1f} ms), late: {}, missed: {}, duplicate: {}, gaps: {}, requeued: {}, "
+                                         "unchanged: {}, cache hits/misses: {}/{}").format(
+                loader.last_margin*1000, loader.min_margin*1000, worker.late, worker.missed,
+                worker.duplicates, worker.gaps, worker.requeued, loader.skipped, loader.cache.hits, loader.cache.misses)
+        position = worker.position
+        if position is not None:
+            values = self.engine.plan.sequence.values(position)
+            text = []
             for i in range(self.num_scan_instr):
-                instr = self.scan_instr_list[i].instr
-                # every element in scan_instr_list is supposed to be compiled before
                 unit = self.scan_instr_list[i].start_un.current()
-                self.main.instrlist[instr].un.current(unit)
-                self.main.instrlist[instr].du.delete(0, 'end')
-                self.main.instrlist[instr].du.insert(0, str(self.scan_param[self.counter][i]/(1000.0**(2-unit))))
+                text.append("#{}: {} {}".format(self.engine.plan.instr_index[i], format_duration(values[i]/unit_scale(unit)), duration_unit[unit]))
+            self.current_label["text"] = "Current: " + ", ".join(text)
+        self.show_latency()
 
-            self.main.loadboard()
-            self.progbar['value'] = (self.counter)/len(self.scan_param)*100.0
-            self.counter += 1
-
-        elif self.counter == len(self.scan_param):
-            self.stop_scan()
+        self.progress_job = self.after(display_interval, self.update_progress)
 
-        # return an int is necessary for DAQ callback function
-        return 0
+    def show_latency(self):
+        summary = self.engine.cycle_log.summary()
+        if summary is None:
+            return
+        self.latency_label["text"] = "Latency: min {:.2f} ms, median {:.2f} ms, p99 {:.2f} ms".format(*[t*1000 for t in summary])
+        counts, edges = self.engine.cycle_log.histogram(histogram_bins)
+        width, height = histogram_size
+        bar_width = width / histogram_bins
+        self.histogram.delete("all")
+        for i, count in enumerate(counts.tolist()):
+            bar_height = (height-12) * count / counts.max()
+            self.histogram.create_rectangle(i*bar_width, height-12-bar_height, (i+1)*bar_width, height-12, fill='steel blue', outline='')
+        self.histogram.create_text(2, height, text="{:.2f} ms".format(edges[0]*1000), anchor='sw', font='Helvetica 7')
+        self.histogram.create_text(width-2, height, text="{:.2f} ms".format(edges[-1]*1000), anchor='se', font='Helvetica 7')
 
     def widgets_state_change(self, arg):
         self.del_button["state"] = arg
@@ -362,27 +357,42 @@ class Scanner(tk.LabelFrame):
         self.sample_num["state"] = arg
         self.repetition["state"] = arg
         self.daq_ch["state"] = arg
+        self.trigger_src["state"] = "readonly" if arg == "normal" else arg
+        self.sim_rate["state"] = arg
+        self.guard_time["state"] = arg
+        self.seed["state"] = arg
+        self.unroll_cb["state"] = arg
         self.scan_button["state"] = arg
         self.file_name["state"] = arg
         self.datetime_cb["state"] = arg
+        self.legacy_cb["state"] = arg
+        self.adaptive_cb["state"] = arg
+        self.feed["state"] = arg
         for i in range(self.num_scan_instr):
             self.scan_instr_list[i].instr_entry["state"] = arg
             self.scan_instr_list[i].start_du["state"] = arg
             self.scan_instr_list[i].start_un["state"] = arg
             self.scan_instr_list[i].end_du["state"] = arg
             self.scan_instr_list[i].end_un["state"] = arg
+            self.scan_instr_list[i].axis_entry["state"] = arg
 
     def stop_scan(self):
         try:
-            self.task.close()
+            self.after_cancel(self.progress_job)
         except Exception as err:
             logging.warning(err)
 
+        # writes timestamps of all cycles and the executed sequence
+        self.engine.stop()
+        self.scanning = False
+        self.show_latency()
+
         self.widgets_state_change("normal")
         self.stop_button["state"] = "disabled"
         self.progbar['value'] = 0
 
-    def save_sequence(self):
+    # sequence file name without extension, None if it exists and shouldn't be overwritten
+    def sequence_file_name(self):
         file_name = ""
         if self.file_name.get():
             file_name += self.file_name.get()
@@ -390,40 +400,12 @@ class Scanner(tk.LabelFrame):
             if file_name != "":
                 file_name += "_"
             file_name += time.strftime("%Y%m%d_%H%M%S")
-        file_name += ".ini"
         file_name = r"scan_sequence"+"\\"+file_name
-        if os.path.exists(file_name):
+        if os.path.exists(file_name+sequence_file_ext):
             overwrite = tk.messagebox.askyesno("Warning", "File name exits. Continue to overwrite it?", default='no')
             if not overwrite:
-                return False
-
-        config = configparser.ConfigParser()
-        config.optionxform = str
-
-        config["Settings"] = {}
-        samp_num = int(self.sample_num.get())
-        rep = int(self.repetition.get())
-        config["Settings"]["sample number"] = str(samp_num)
-        config["Settings"]["repetition"] = str(rep)
-        config["Settings"]["element number"] = str(samp_num*rep)
-        config["Settings"]["scan device"] = "SpinCore"
-        instr_init = self.scan_instr_list[0].instr
-        config["Settings"]["scan param"] = f"instr no. {instr_init}"
-        for i in range(len(self.scan_param)):
-            config[f"Sequence element {i}"] = {}
-            for j in range(self.num_scan_instr):
-                instr = self.scan_instr_list[j].instr
-                config[f"Sequence element {i}"][f"SpinCore [instr no. {instr}]"] = str(self.scan_param[i][j])
-        configfile = open(file_name, "w")
-        config.write(configfile)
-        configfile.close()
-
-        # save scan sequence to camera folder, so the camera program can read it
-        configfile = open(r"C:\Users\dur!p5\github\pixelfly-python-control\scan_sequence\latest_sequence.ini", "w")
-        config.write(configfile)
-        configfile.close()
-
-        return True
+                return None
+        return file_name
 
     def chop_scan_instr(self, new_num):
         while self.num_scan_instr > new_num:
@@ -431,6 +413,106 @@ class Scanner(tk.LabelFrame):
         while self.num_scan_instr < new_num:
             self.add_scan_instr()
 
+    # entries of scanner widgets, as saved in config files
+    def settings(self):
+        scanned = []
+        for scan_instr in self.scan_instr_list:
+            scanned.append({"instr no.": scan_instr.instr_entry.get(),
+                            "start duration": scan_instr.start_du.get(), "start unit": duration_unit[scan_instr.start_un.current()],
+                            "end duration": scan_instr.end_du.get(), "end unit": duration_unit[scan_instr.end_un.current()],
+                            "axis": scan_instr.axis_entry.get()})
+        return {"sample number": self.sample_num.get(), "repetition": self.repetition.get(),
+                "scanned instructions": scanned}
+
+    def apply_settings(self, settings):
+        self.sample_num.delete(0, 'end')
+        self.sample_num.insert(0, settings["sample number"])
+        self.repetition.delete(0, 'end')
+        self.repetition.insert(0, settings["repetition"])
+        self.chop_scan_instr(len(settings["scanned instructions"]))
+        for scan_instr, values in zip(self.scan_instr_list, settings["scanned instructions"]):
+            scan_instr.instr_entry.delete(0, 'end')
+            scan_instr.instr_entry.insert(0, values["instr no."])
+            scan_instr.start_du.delete(0, 'end')
+            scan_instr.start_du.insert(0, values["start duration"])
+            scan_instr.start_un.current(duration_unit.index(values["start unit"]))
+            scan_instr.end_du.delete(0, 'end')
+            scan_instr.end_du.insert(0, values["end duration"])
+            scan_instr.end_un.current(duration_unit.index(values["end unit"]))
+            scan_instr.axis_entry.delete(0, 'end')
+            scan_instr.axis_entry.insert(0, values.get("axis", "0"))
+
+
+class TkController:
+    """Commands of the control server (see control_server.py), run in Tk's thread.
+
+    The server's worker thread queues a call and waits for its result, MainWindow runs queued
+    calls every server_poll_interval. Calls wait at most server_call_timeout, and fail at once
+    while the controller is closed (the server is turned off or the window closes).
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.calls = queue.SimpleQueue()
+        self.closed = False
+
+    def call(self, func, *args):
+        if self.closed:
+            raise ValueError("The GUI doesn't take commands.")
+        future = concurrent.futures.Future()
+        self.calls.put((future, func, args))
+        try:
+            return future.result(timeout=server_call_timeout)
+        except concurrent.futures.TimeoutError:
+            # not run later either
+            future.cancel()
+            raise ValueError("The GUI didn't run the command in %g s." % server_call_timeout)
+        except concurrent.futures.CancelledError:
+            raise ValueError("The GUI doesn't take commands.")
+
+    def open(self):
+        self.closed = False
+
+    # cancel queued calls and refuse new ones, waiting server threads return at once
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                future, func, args = self.calls.get_nowait()
+            except queue.Empty:
+                return
+            future.cancel()
+
+    # in Tk's thread
+    def run_calls(self):
+        while True:
+            try:
+                future, func, args = self.calls.get_nowait()
+            except queue.Empty:
+                return
+            if not future.set_running_or_notify_cancel():
+                # timed out already
+                continue
+            try:
+                future.set_result(func(*args))
+            except Exception as err:
+                future.set_exception(err)
+
+    def status(self):
+        return self.call(self.window.remote_status)
+
+    def upload(self, config):
+        return self.call(self.window.remote_upload, config)
+
+    def load(self, optimize=True):
+        return self.call(self.window.remote_load, optimize)
+
+    def scan(self, options):
+        return self.call(self.window.remote_scan, options)
+
+    def stop(self):
+        return self.call(self.window.remote_stop)
+
 
 class MainWindow(tk.Frame):
     def __init__(self, master=None):
@@ -438,7 +520,15 @@ class MainWindow(tk.Frame):
         self.master.title("SpinCore PulseBlasterUSB")
         self.master.geometry('1200x800')
         self.num_instr = 6 # number of instructions (one instruction is one column in this GUI)
-        self.instrlist = [] # used to save all the instructions
+        # all boards in the system, their channels follow each other: channels of board 1 come after those of board 0, etc.
+        # None until they're initialized, see init_spincore()
+        self.boards = None
+        self.board_error = None
+        self.program = PulseProgram(self.num_instr) # pulse program shown and edited by instruction columns
+        self.scanner_settings = default_scanner_settings
+        self.controller = TkController(self)
+        self.server = None # control server while it's enabled
+        self.ring = None # shared-memory ring buffer of scan cycles, opened with the first scan
         self.pack()
         self.place_scrollbar()
         self.place_control_widgets()
@@ -494,6 +584,17 @@ class MainWindow(tk.Frame):
         softtrig_button = tk.Button(self.control_frame, text="Toggle scanner", width=13, bg=button_color, command=self.toggle_scanner)
         softtrig_button.grid(row=0, column=7)
 
+        # merge and drop redundant instructions before loading, see program_optimizer.py
+        self.optimize_var = tk.IntVar()
+        self.optimize_var.set(1)
+        optimize_cb = tk.Checkbutton(self.control_frame, variable=self.optimize_var, text="Optimize program")
+        optimize_cb.grid(row=1, column=5, sticky='w')
+        self.instr_count_label = tk.Label(self.control_frame, text="")
+        self.instr_count_label.grid(row=1, column=6, columnspan=2, sticky='w')
+        # found boards, or why they can't be used
+        self.board_status_label = tk.Label(self.control_frame, text="")
+        self.board_status_label.grid(row=1, column=0, columnspan=5, sticky='w')
+
         # file location label
         location_label = tk.Label(self.control_frame, text="File name to load: ")
         location_label.grid(row=2, rowspan=2, column=0, columnspan=2, sticky='e')
@@ -529,52 +630,99 @@ class MainWindow(tk.Frame):
         save_button = tk.Button(self.control_frame, text="Save configs", width=10, bg=button_color, command=self.save_config)
         save_button.grid(row=4, column=7, padx=5, pady=2, sticky='e')
 
+        # local control server, for programs that upload programs, run scans and follow them cycle by cycle
+        server_label = tk.Label(self.control_frame, text="Control server: ")
+        server_label.grid(row=5, column=0, columnspan=2, sticky='e')
+        self.server_address = tk.Entry(self.control_frame, width=32)
+        self.server_address.insert(0, default_server_address)
+        self.server_address.grid(row=5, column=2, columnspan=2, sticky='w')
+        self.server_var = tk.IntVar()
+        server_cb = tk.Checkbutton(self.control_frame, variable=self.server_var, text="Enabled", command=self.toggle_server)
+        server_cb.grid(row=5, column=4, columnspan=3, sticky='w')
+
         for i in range(4):
             bottom_empty_label = tk.Label(self.frame, text="")
             bottom_empty_label.grid(row=100+i, column=0)
 
     def place_scanner(self):
-        self.scanner = Scanner(self)
-        self.scanner.grid(row=1, column=0, ipadx=5, ipady=2, columnspan=100, sticky='nw')
-        # self.scanner.grid_remove()
+        # scanner widgets are built when they're first shown, see toggle_scanner()
+        self.scanner = None
 
     def place_main_cols(self):
-        # create main columns in this GUI
-        self.instr_frame = tk.LabelFrame(self.frame, relief='flat')
-        self.instr_frame.grid(row=2, column=0, columnspan=100, sticky='nw')
-        # add a sub frame here so when instruction columns are added/deleted,
-        # main frame column size doesn't change
-
-        # Create the first column: decriptive labels
-        self.descr_col = Descr(self.instr_frame)
-        self.descr_col.grid(row=0, column=0)
-
-        # Create 2nd to nth columns: Spincore instruction data
-        for i in range(self.num_instr):
-            self.instrlist.append(Instr(self.instr_frame, i))
-            self.instrlist[i].grid(row=0, column=i+1)
-
-    # initiate Spincore PulseBlaster USB
+        # create main columns in this GUI: descriptive labels, then one column per instruction,
+        # drawn on a canvas with its own horizontal scrollbar, so only visible columns cost anything
+        self.instr_grid = InstrGrid(self.frame, self.program)
+        self.instr_grid.grid(row=2, column=0, columnspan=100, sticky='nw')
+        # instruction columns fill the window width
+        self.master.bind("<Configure>", lambda event: self.on_window_resize(event))
+
+    # initiate Spincore PulseBlaster USB on a background thread, so a missing or slow driver doesn't block the window
     def init_spincore(self):
+        self.board_status_label["text"] = "Boards: initializing..."
+        self.init_result = None
+        threading.Thread(target=self.init_boards, daemon=True).start()
+        self.after(init_poll_interval, self.check_init)
+
+    # runs on the init thread, never touches Tk widgets
+    def init_boards(self):
         # downloaded form http://www.spincore.com/support/SpinAPI_Python_Wrapper/Python_Wrapper_Main.shtml
         # And modified by Qian W., July 24, 2020
-        # Enable the SpinCore log file
-        pb_set_debug(1)
-
-        print("Using SpinAPI Library version %s" % pb_get_version())
-        print("Found %d board(s) in the system.\n" % pb_count_boards())
-        print("This program maniputales the TTL outputs of the PulseBlasterUSB.\n\n")
-
-        pb_select_board(0)
-
-        # pb_init() function has to be called before any programming/start/stop instructions
-        if pb_init() != 0:
-        	print("Error initializing board: %s" % pb_get_error())
-        	input("Please press a key to continue.")
-        	exit(-1)
-
-        # Configure the core clock, in MHz
-        pb_core_clock(100.0)
+        try:
+            # Enable the SpinCore log file
+            pb_set_debug(1)
+            version = pb_get_version()
+            boards = BoardSet()
+            print("Using SpinAPI Library version %s" % version)
+            print("Found %d board(s) in the system.\n" % boards.num_boards)
+            print("This program maniputales the TTL outputs of the PulseBlasterUSB.\n\n")
+
+            # pb_init() and core clock (100 MHz) of every board
+            error = boards.init(100.0)
+        except OSError as err:
+            # e.g. the SpinAPI library can't be loaded
+            boards, version, error = None, None, str(err)
+        self.init_result = (boards, version, error)
+
+    def check_init(self):
+        if self.init_result is None:
+            self.after(init_poll_interval, self.check_init)
+            return
+        boards, version, error = self.init_result
+        if error is not None:
+            print(error)
+            self.board_error = error
+            self.board_status_label.configure(text="Boards: " + error, fg='red')
+            return
+        self.boards = boards
+        self.board_status_label["text"] = "Boards: {} found, SpinAPI {}".format(boards.num_boards, version)
+        # channels of all boards can be edited
+        if boards.num_boards > self.program.num_boards:
+            self.program.set_num_boards(boards.num_boards)
+            self.instr_grid.set_program(self.program)
+
+    # boards can be used, otherwise show why not
+    def boards_ready(self):
+        if self.boards is not None:
+            return True
+        if self.board_error is not None:
+            tk.messagebox.showerror("Error", "Boards aren't initialized: " + self.board_error)
+        else:
+            tk.messagebox.showinfo("Info", "Boards are still being initialized.")
+        return False
+
+    # the scan's worker programs the boards, show why they can't be used now
+    def scan_running(self):
+        if self.scanning():
+            tk.messagebox.showinfo("Info", "Boards are used by the running scan, stop it first.")
+            return True
+        return False
+
+    # raise ValueError if boards can't be used, for commands of the control server
+    def check_boards_ready(self):
+        if self.board_error is not None:
+            raise ValueError("Boards aren't initialized: " + self.board_error)
+        if self.boards is None:
+            raise ValueError("Boards are still being initialized.")
 
     # scrollbar funtion
     def onFrameConfigure(self):
@@ -585,38 +733,53 @@ class MainWindow(tk.Frame):
     def on_mousewheel(self, event):
         self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
 
+    def on_window_resize(self, event):
+        # <Configure> of the toplevel is also sent for each of its children
+        if event.widget is self.master:
+            self.instr_grid.set_width(event.width - label_width - 30)
+
     # delete the last instruction column
     def del_instr(self):
-        self.instrlist[-1].destroy()
-        del self.instrlist[-1]
         self.num_instr -= 1
+        self.program.resize(self.num_instr)
+        self.instr_grid.refresh()
         if self.num_instr == 1:
             self.del_button["state"] = "disabled"
 
     # add an instruction column after the last one
     def add_instr(self):
-        self.instrlist.append(Instr(self.instr_frame, self.num_instr))
         self.num_instr += 1
-        self.instrlist[-1].grid(row=0, column=self.num_instr)
-        # both 'num_instr' and 'instrlist' are lists, in this way, the list can be manipulated
+        self.program.resize(self.num_instr)
+        self.instr_grid.refresh()
         if (self.del_button["state"] == "disabled") and (self.num_instr > 1):
             self.del_button["state"] = "normal"
 
     # load instrctions into PulseBlasterUSB
     def loadboard(self):
-        pb_start_programming(PULSE_PROGRAM)
-        for i in range(self.num_instr):
-            self.instrlist[i].compile_instr()
-            pb_inst_pbonly(*self.instrlist[i].values[1:5])
-        pb_stop_programming()
+        if not self.boards_ready() or self.scan_running():
+            return
+        # one program per board, boards are programmed one after another under the board lock
+        try:
+            self.show_instr_count(*load_program(self.boards, self.program, self.optimize_var.get()))
+        except ValueError as err:
+            tk.messagebox.showerror("Error", str(err))
+
+    # number of instructions in GUI and loaded into board (of the longest board program)
+    def show_instr_count(self, before, after):
+        self.instr_count_label["text"] = "Instructions: {} -> {} loaded".format(before, after)
 
     # software trigger PulseBlasterUSB
     def software_trig(self):
-        pb_start()
+        if self.boards_ready() and not self.scan_running():
+            self.boards.start()
 
     # toggle scanner widgets
     def toggle_scanner(self):
-        if self.scanner.winfo_viewable():
+        if self.scanner is None:
+            self.scanner = Scanner(self)
+            self.scanner.grid(row=1, column=0, ipadx=5, ipady=2, columnspan=100, sticky='nw')
+            self.scanner.apply_settings(self.scanner_settings)
+        elif self.scanner.winfo_viewable():
             self.scanner.grid_remove()
         else:
             self.scanner.grid()
@@ -624,64 +787,37 @@ class MainWindow(tk.Frame):
     # browse and choose a .txt file
     def browse_file(self):
         file_loca = filedialog.askopenfilename(initialdir="saved_configs", title="Select a file",
-                                                filetypes=(("config files", "*.ini"), ("all files", "*.*")))
+                                                filetypes=(("config files", "*.json *.ini"), ("all files", "*.*")))
         if len(file_loca) > 0:
             self.location_text.delete(1.0, 'end')
             self.location_text.insert(1.0, file_loca)
 
-    # this function is used when a saved configuration is loaded to GUI, it's used to make the number of instruction correct
-    def chop_instr(self, new_num_instr):
-        while new_num_instr < self.num_instr:
-            self.del_instr()
-        while new_num_instr > self.num_instr:
-            self.add_instr()
+    # show a loaded program, the grid is refreshed once for the whole program
+    def set_program(self, program):
+        self.program = program
+        self.num_instr = len(program)
+        self.del_button["state"] = "disabled" if self.num_instr <= 1 else "normal"
+        self.instr_grid.set_program(program)
 
     def load_config(self):
-        file_loca = self.location_text.get(1.0, 'end')[:-1]
+        file_loca = self.location_text.get(1.0, 'end')[:-1] # remove '\n' at the end of location_text.get()
         if not os.path.exists(file_loca):
             tk.messagebox.showerror("Error", "File doesn't exist.")
             return
 
-        config = configparser.ConfigParser()
-        config.read(file_loca) # remove '\n' at the end of location_text.get()
-
-        dev_name = [dev.strip() for dev in config["General settings"].get("devices").split(',')]
-        for i in range(channel_num):
-            self.descr_col.ch_label_list[i].delete(0, 'end')
-            self.descr_col.ch_label_list[i].insert(0, dev_name[channel_num-1-i])
-        new_num_instr = int(config["General settings"].get("number of instructions"))
-        self.chop_instr(new_num_instr)
-
-        for i in range(self.num_instr):
-            self.instrlist[i].note.delete(0, 'end')
-            self.instrlist[i].note.insert(0, config[f"Instr {i}"].get("instr note"))
-            self.instrlist[i].du.delete(0, 'end')
-            self.instrlist[i].du.insert(0, config[f"Instr {i}"].get("duration time"))
-            self.instrlist[i].un.current(duration_unit.index(config[f"Instr {i}"].get("duration unit")))
-            self.instrlist[i].opd.delete(0, 'end')
-            self.instrlist[i].opd.insert(0, config[f"Instr {i}"].get("op data"))
-            self.instrlist[i].opc.current(opcodes.index(config[f"Instr {i}"].get("op code")))
-            for j in range(channel_num):
-                self.instrlist[i].cbvarlist[j].set(int(config[f"Instr {i}"]["ttl output pattern"][channel_num+1-j]))
-
-        self.scanner.sample_num.delete(0, 'end')
-        self.scanner.sample_num.insert(0, config["Scanner settings"].get("sample number"))
-        self.scanner.repetition.delete(0, 'end')
-        self.scanner.repetition.insert(0, config["Scanner settings"].get("repetition"))
-        new_num_scan_instr = int(config["Scanner settings"].get("number of scanned instr"))
-        self.scanner.chop_scan_instr(new_num_scan_instr)
-
-        for i in range(self.scanner.num_scan_instr):
-            scan_instr = self.scanner.scan_instr_list[i]
-            scan_instr.instr_entry.delete(0, 'end')
-            scan_instr.instr_entry.insert(0, config[f"Scanned Instr {i}"].get("instr no."))
-            scan_instr.start_du.delete(0, 'end')
-            scan_instr.start_du.insert(0, config[f"Scanned Instr {i}"].get("start duration"))
-            scan_instr.start_un.current(duration_unit.index(config[f"Scanned Instr {i}"].get("start unit")))
-            scan_instr.end_du.delete(0, 'end')
-            scan_instr.end_du.insert(0, config[f"Scanned Instr {i}"].get("end duration"))
-            scan_instr.end_un.current(duration_unit.index(config[f"Scanned Instr {i}"].get("end unit")))
+        # JSON configs, or INI configs saved by older versions
+        try:
+            program, scanner_settings = read_config(file_loca)
+        except (ValueError, KeyError, configparser.Error) as err:
+            tk.messagebox.showerror("Error", "Can't read config file: %s" % err)
+            return
+        self.apply_config(program, scanner_settings)
 
+    def apply_config(self, program, scanner_settings):
+        self.set_program(program)
+        self.scanner_settings = scanner_settings
+        if self.scanner is not None:
+            self.scanner.apply_settings(scanner_settings)
 
     def save_config(self):
         file_name = ""
@@ -691,51 +827,121 @@ class MainWindow(tk.Frame):
             if file_name != "":
                 file_name += "_"
             file_name += time.strftime("%Y%m%d_%H%M%S")
-        file_name += ".ini"
+        file_name += config_file_ext
         file_name = r"saved_configs"+"\\"+file_name
         if os.path.exists(file_name):
             overwrite = tk.messagebox.askyesno("Warning", "File name exits. Continue to overwrite it?", default='no')
             if not overwrite:
                 return
 
-        config = configparser.ConfigParser(allow_no_value=True)
-
-        self.descr_col.compile_ch_label_text()
-        config["General settings"] = {}
-        config["General settings"]["number of instructions"] = str(self.num_instr)
-        config["General settings"]["# form channel {:d} to channel 0".format(channel_num-1)] = None
-        config["General settings"]["devices"] = ", ".join(self.descr_col.ch_label_text)
-        for i in range(self.num_instr):
-            self.instrlist[i].compile_instr()
-            config[f"Instr {i}"] = {}
-            config[f"Instr {i}"]["instr note"] = self.instrlist[i].values[0]
-            config[f"Instr {i}"]["ttl output pattern"] = '0b' + str(bin(self.instrlist[i].values[1]))[2:].zfill(channel_num)
-            config[f"Instr {i}"]["op code"] = opcodes[self.instrlist[i].values[2]]
-            config[f"Instr {i}"]["op data"] = str(self.instrlist[i].values[3])
-            config[f"Instr {i}"]["duration time"] = self.instrlist[i].du.get()
-            config[f"Instr {i}"]["duration unit"] = duration_unit[self.instrlist[i].un.current()]
-
-        config["Scanner settings"] = {}
-        config["Scanner settings"]["sample number"] = self.scanner.sample_num.get()
-        config["Scanner settings"]["repetition"] = self.scanner.repetition.get()
-        config["Scanner settings"]["number of scanned instr"] = str(self.scanner.num_scan_instr)
-        for i in range(self.scanner.num_scan_instr):
-            config[f"Scanned Instr {i}"] = {}
-            config[f"Scanned Instr {i}"]["instr no."] = self.scanner.scan_instr_list[i].instr_entry.get()
-            config[f"Scanned Instr {i}"]["start duration"] = self.scanner.scan_instr_list[i].start_du.get()
-            config[f"Scanned Instr {i}"]["start unit"] = duration_unit[self.scanner.scan_instr_list[i].start_un.current()]
-            config[f"Scanned Instr {i}"]["end duration"] = self.scanner.scan_instr_list[i].end_du.get()
-            config[f"Scanned Instr {i}"]["end unit"] = duration_unit[self.scanner.scan_instr_list[i].end_un.current()]
-
-        configfile = open(file_name, "w")
-        config.write(configfile)
-        configfile.close()
-
-
-
-root = tk.Tk()
-mygui = MainWindow(root)
-mygui.mainloop()
-
-# pb_close function has to be called at the end of any programming/start/stop instructions
-pb_close()
+        self.instr_grid.commit_edit()
+        if self.scanner is not None:
+            self.scanner_settings = self.scanner.settings()
+        write_config(file_name, self.program, self.scanner_settings)
+
+    def toggle_server(self):
+        if self.server_var.get():
+            server = ControlServer(self.controller, self.server_address.get())
+            try:
+                server.start()
+            except OSError as err:
+                tk.messagebox.showerror("Error", str(err))
+                self.server_var.set(0)
+                return
+            self.server = server
+            self.server_address["state"] = "disabled"
+            self.controller.open()
+            self.poll_server()
+        else:
+            self.after_cancel(self.server_job)
+            self.controller.close()
+            self.server.stop()
+            self.server = None
+            self.server_address["state"] = "normal"
+
+    def poll_server(self):
+        self.controller.run_calls()
+        self.server_job = self.after(server_poll_interval, self.poll_server)
+
+    # observers of scans (see scan_engine.py): every cycle is published to the shared-memory ring (see scan_ring.py),
+    # clients of the control server follow scans started from the GUI as well
+    def scan_observers(self):
+        if self.ring is None:
+            try:
+                self.ring = ScanRing()
+            except OSError as err:
+                logging.warning("Can't open scan ring buffer: %s" % err)
+        observers = [] if self.ring is None else [self.ring]
+        if self.server is not None:
+            observers.append(self.server)
+        return observers
+
+    def scanning(self):
+        return self.scanner is not None and self.scanner.scanning
+
+    # commands of the control server, see TkController
+    def remote_status(self):
+        status = {"boards": 0 if self.boards is None else self.boards.num_boards, "instructions": len(self.program),
+                  "scanning": self.scanning()}
+        if self.scanner is not None and self.scanner.engine is not None:
+            engine = self.scanner.engine
+            status.update(file=engine.file_name, points=engine.plan.num_points, cycles=len(engine.worker.positions))
+        return status
+
+    def remote_upload(self, config):
+        if self.scanning():
+            raise ValueError("A scan is running.")
+        self.instr_grid.commit_edit()
+        self.apply_config(*config_from_dict(config))
+        return {"instructions": len(self.program)}
+
+    def remote_load(self, optimize):
+        self.check_boards_ready()
+        if self.scanning():
+            raise ValueError("A scan is running.")
+        before, after = load_program(self.boards, self.program, optimize)
+        self.show_instr_count(before, after)
+        return {"instructions": before, "loaded": after}
+
+    def remote_scan(self, options):
+        # scanner settings of the GUI, unless options replace them
+        self.check_boards_ready()
+        if self.scanning():
+            raise ValueError("A scan is running.")
+        self.instr_grid.commit_edit()
+        if self.scanner is None:
+            self.toggle_scanner()
+        settings = self.scanner.settings()
+        for key in ("sample number", "repetition", "scanned instructions"):
+            if key in options:
+                settings[key] = options[key]
+        self.scanner.apply_settings(settings)
+        options = dict(options)
+        options.setdefault("optimize", bool(self.optimize_var.get()))
+        engine, trigger_source = make_engine(self.boards, self.program, self.scanner.settings(), options, self.scan_observers())
+        engine.prepare()
+        self.scanner.engine = engine
+        self.scanner.start_engine(trigger_source)
+        return {"file": engine.file_name, "points": engine.plan.num_points}
+
+    def remote_stop(self):
+        if not self.scanning():
+            raise ValueError("No scan is running.")
+        self.scanner.stop_scan()
+        return {"cycles": len(self.scanner.engine.worker.positions)}
+
+
+
+if __name__ == "__main__":
+    root = tk.Tk()
+    mygui = MainWindow(root)
+    mygui.mainloop()
+    mygui.controller.close()
+    if mygui.server is not None:
+        mygui.server.stop()
+    if mygui.ring is not None:
+        mygui.ring.close()
+
+    # pb_close function has to be called at the end of any programming/start/stop instructions
+    if mygui.boards is not None:
+        mygui.boards.close()
@@ -0,0 +1,85 @@
+import os
+import socket
+
+# A measurement feed delivers results of the analysis program as text lines "<element index> <value>",
+# where element index is the position of a point in the scan sequence. poll() never blocks, also on a
+# named pipe without a writer, and returns the (index, value) pairs that arrived since the last call.
+
+
+def parse_lines(lines):
+    results = []
+    for line in lines:
+        fields = line.replace(',', ' ').split()
+        if len(fields) < 2:
+            continue
+        try:
+            results.append((int(fields[0]), float(fields[1])))
+        except ValueError:
+            continue
+    return results
+
+
+class FileFeed:
+    """Lines appended to a text file (or written to a named pipe).
+
+    The file is opened and read without blocking, so a pipe without a writer doesn't stop the scan.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.fd = None
+        self.partial = b""
+
+    def poll(self):
+        if self.fd is None:
+            if not os.path.exists(self.file_name):
+                return []
+            self.fd = os.open(self.file_name, os.O_RDONLY | getattr(os, "O_NONBLOCK", 0) | getattr(os, "O_BINARY", 0))
+        chunks = [self.partial]
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            if not data:
+                # end of the file for now, or a pipe without a writer
+                break
+            chunks.append(data)
+        lines = b"".join(chunks).split(b"\n")
+        # the last line may not be complete yet
+        self.partial = lines.pop()
+        return parse_lines(line.decode("utf-8", errors="ignore") for line in lines)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class UDPFeed:
+    """Datagrams sent to a localhost UDP port, each holding one or more lines."""
+
+    def __init__(self, port, host="127.0.0.1"):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+
+    def poll(self):
+        lines = []
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            lines.extend(data.decode("utf-8", errors="ignore").splitlines())
+        return parse_lines(lines)
+
+    def close(self):
+        self.sock.close()
+
+
+def open_feed(location):
+    # "udp:<port>" for a UDP port, anything else is a file name
+    if location.startswith("udp:"):
+        return UDPFeed(int(location[4:]))
+    return FileFeed(location)
@@ -0,0 +1,313 @@
+import time
+import threading
+import numpy as np
+from pulse_program import instr_dtype, opcodes, board_max_instr
+
+# same bits as returned by pb_read_status()
+STATUS_STOPPED = 1
+STATUS_RESET = 2
+STATUS_RUNNING = 4
+STATUS_WAITING = 8
+
+CONTINUE, STOP, LOOP, END_LOOP, JSR, RTS, BRANCH, LONG_DELAY, WAIT = range(len(opcodes))
+max_nesting = 8 # nested loops and subroutines supported by PulseBlasterUSB
+min_cycles = 5 # shortest instruction, in clock cycles
+
+# modeled time of host calls over USB, in s, rough estimates to be adjusted to a measured board
+default_latency = {
+    "pb_start_programming": 200e-6,
+    "pb_inst_pbonly": 60e-6,
+    "pb_stop_programming": 200e-6,
+    "pb_start": 100e-6,
+    "pb_stop": 100e-6,
+    "pb_reset": 100e-6,
+    "pb_read_status": 100e-6,
+}
+
+# one row per executed instruction: start time and duration (in ns) of its TTL output pattern
+timeline_dtype = np.dtype([("time", np.float64), ("duration", np.float64), ("flags", np.uint32), ("address", np.int32)])
+
+
+class EmulatedBoard:
+    def __init__(self, max_instr):
+        # unlike a list, memory keeps instructions beyond the last programmed one, as the real board does
+        self.memory = np.zeros(max_instr, dtype=instr_dtype)
+        self.memory["opcode"] = STOP
+        self.pending = None # instructions written since pb_start_programming
+        self.status = STATUS_STOPPED
+        self.pc = 0
+        self.loop_stack = [] # [LOOP address, remaining number of loops]
+        self.loop_reentry = False
+        self.call_stack = [] # return addresses
+        self.time = 0.0 # output time since start, in ns, time spent waiting for triggers isn't counted
+        self.flags = 0
+        self.timeline = []
+
+
+class PulseBlasterEmulator:
+    """Software PulseBlasterUSB providing the SpinAPI C functions used by spinapi.py.
+
+    Programs are executed with CONTINUE, STOP, LOOP, END_LOOP, JSR, RTS, BRANCH, LONG_DELAY and
+    WAIT semantics. With record_timeline, every output pattern is kept in a timeline; it grows
+    with every instruction run, so only short runs like simulate() keep one. Every call is
+    counted and charged with a modeled latency (accumulated in elapsed, or actually spent if
+    realtime is True), so the throughput of the scan loop can be profiled without hardware. Select it with
+    spinapi.use_backend("emulator") or environment variable SPINAPI_BACKEND=emulator.
+    """
+
+    def __init__(self, num_boards=1, max_instr=board_max_instr, latency=None, realtime=False, max_steps=100000,
+                 record_timeline=False):
+        self.boards = [EmulatedBoard(max_instr) for i in range(num_boards)]
+        self.board = self.boards[0]
+        self.max_instr = max_instr
+        self.max_steps = max_steps # instructions executed at most per start/trigger, a program may loop forever
+        self.clock = 100.0 # in MHz
+        self.error = b""
+        self.latency = dict(default_latency)
+        if latency is not None:
+            self.latency.update(latency)
+        self.realtime = realtime
+        self.record_timeline = record_timeline
+        self.calls = {} # number of calls per function
+        self.elapsed = 0.0 # modeled time spent in calls, in s
+        self.wait_callbacks = [] # called with board number whenever a board starts waiting for a trigger
+        self.lock = threading.RLock()
+
+    def account(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        latency = self.latency.get(name, 0.0)
+        self.elapsed += latency
+        if self.realtime and latency > 0:
+            end = time.perf_counter() + latency
+            while time.perf_counter() < end:
+                pass
+
+    def fail(self, message):
+        self.error = message.encode("utf-8")
+        return -1
+
+    def pb_get_version(self):
+        return b"SpinAPI emulator"
+
+    def pb_get_error(self):
+        return self.error
+
+    def pb_count_boards(self):
+        return len(self.boards)
+
+    def pb_init(self):
+        return 0
+
+    def pb_set_debug(self, debug):
+        return 0
+
+    def pb_select_board(self, board_number):
+        with self.lock:
+            if not 0 <= board_number < len(self.boards):
+                return self.fail("Board %d doesn't exist." % board_number)
+            self.board = self.boards[board_number]
+            return 0
+
+    def pb_set_defaults(self):
+        return 0
+
+    def pb_core_clock(self, clock):
+        self.clock = clock
+        return 0
+
+    def pb_write_register(self, address, value):
+        return 0
+
+    def pb_start_programming(self, target):
+        with self.lock:
+            self.account("pb_start_programming")
+            if target != 0:
+                return self.fail("Only PULSE_PROGRAM is emulated.")
+            if self.board.status & STATUS_RUNNING:
+                return self.fail("Board is running.")
+            self.board.pending = []
+            return 0
+
+    def pb_inst_pbonly(self, flags, inst, inst_data, length):
+        with self.lock:
+            self.account("pb_inst_pbonly")
+            board = self.board
+            if board.pending is None:
+                return self.fail("pb_start_programming() wasn't called.")
+            if len(board.pending) >= self.max_instr:
+                return self.fail("Instruction memory is full.")
+            if not 0 <= inst < len(opcodes):
+                return self.fail("Invalid instruction %d." % inst)
+            if length < min_cycles * 1000.0 / self.clock:
+                return self.fail("Instruction length %g ns is too short." % length)
+            if (inst == LONG_DELAY and inst_data < 2) or (inst == LOOP and inst_data < 1):
+                return self.fail("Invalid op data %d for %s." % (inst_data, opcodes[inst]))
+            board.pending.append((flags, inst, inst_data, length))
+            return len(board.pending) - 1
+
+    def pb_stop_programming(self):
+        with self.lock:
+            self.account("pb_stop_programming")
+            board = self.board
+            if board.pending is None:
+                return self.fail("pb_start_programming() wasn't called.")
+            if board.pending:
+                board.memory[:len(board.pending)] = np.array(board.pending, dtype=instr_dtype)
+            board.pending = None
+            return 0
+
+    def pb_start(self):
+        with self.lock:
+            self.account("pb_start")
+            return self.start(self.board)
+
+    # hardware trigger of a board, same as pb_start but without host latency
+    def trigger(self, board_number=0):
+        with self.lock:
+            return self.start(self.boards[board_number])
+
+    def pb_stop(self):
+        with self.lock:
+            self.account("pb_stop")
+            self.board.status = STATUS_STOPPED
+            return 0
+
+    def pb_reset(self):
+        with self.lock:
+            self.account("pb_reset")
+            self.board.status = STATUS_RESET
+            self.board.pc = 0
+            return 0
+
+    def pb_close(self):
+        return 0
+
+    def pb_read_status(self):
+        with self.lock:
+            self.account("pb_read_status")
+            return self.board.status
+
+    def pb_inst_dds2(self, *args):
+        return self.fail("The emulated board has no DDS.")
+
+    def start(self, board):
+        if board.status & STATUS_WAITING:
+            # continue after WAIT
+            return self.execute(board, resume=True)
+        if board.status & STATUS_RUNNING:
+            return 0
+        board.pc = 0
+        board.loop_stack = []
+        board.loop_reentry = False
+        board.call_stack = []
+        board.time = 0.0
+        return self.execute(board)
+
+    def emit(self, board, flags, duration):
+        if self.record_timeline:
+            board.timeline.append((board.time, duration, flags, board.pc))
+        board.time += duration
+        board.flags = flags
+
+    def execute(self, board, resume=False):
+        board.status = STATUS_RUNNING
+        memory = board.memory
+        for i in range(self.max_steps):
+            if not 0 <= board.pc < len(memory):
+                board.status = STATUS_STOPPED
+                return self.fail("Program counter %d is out of instruction memory." % board.pc)
+            flags, inst, inst_data, length = memory[board.pc].tolist()
+            if inst == WAIT and not resume:
+                board.status = STATUS_WAITING
+                board.flags = flags
+                for callback in self.wait_callbacks:
+                    callback(self.boards.index(board))
+                return 0
+            resume = False
+
+            if inst == STOP:
+                self.emit(board, flags, 0.0)
+                board.status = STATUS_STOPPED
+                return 0
+            elif inst == LONG_DELAY:
+                self.emit(board, flags, length*inst_data)
+                board.pc += 1
+            else:
+                self.emit(board, flags, length)
+                if inst == LOOP:
+                    if not (board.loop_reentry and board.loop_stack and board.loop_stack[-1][0] == board.pc):
+                        if len(board.loop_stack) >= max_nesting:
+                            board.status = STATUS_STOPPED
+                            return self.fail("Too many nested loops.")
+                        board.loop_stack.append([board.pc, inst_data])
+                    board.loop_reentry = False
+                    board.pc += 1
+                elif inst == END_LOOP:
+                    if not board.loop_stack or board.loop_stack[-1][0] != inst_data:
+                        board.status = STATUS_STOPPED
+                        return self.fail("END_LOOP at %d doesn't match a LOOP." % board.pc)
+                    board.loop_stack[-1][1] -= 1
+                    if board.loop_stack[-1][1] > 0:
+                        board.pc = inst_data
+                        board.loop_reentry = True
+                    else:
+                        board.loop_stack.pop()
+                        board.pc += 1
+                elif inst == JSR:
+                    if len(board.call_stack) >= max_nesting:
+                        board.status = STATUS_STOPPED
+                        return self.fail("Too many nested subroutines.")
+                    board.call_stack.append(board.pc + 1)
+                    board.pc = inst_data
+                elif inst == RTS:
+                    if not board.call_stack:
+                        board.status = STATUS_STOPPED
+                        return self.fail("RTS at %d without JSR." % board.pc)
+                    board.pc = board.call_stack.pop()
+                elif inst == BRANCH:
+                    board.pc = inst_data
+                else:
+                    board.pc += 1
+        # still running after max_steps, e.g. a BRANCH loop without WAIT
+        return 0
+
+    def timeline(self, board_number=0):
+        return np.array(self.boards[board_number].timeline, dtype=timeline_dtype)
+
+    def clear_timeline(self):
+        for board in self.boards:
+            board.timeline = []
+
+
+def merge_timeline(timeline):
+    # join consecutive rows with the same output pattern and drop empty ones,
+    # two programs generate the same output if their merged timelines are equal
+    timeline = timeline[timeline["duration"] > 0]
+    if len(timeline) == 0:
+        return np.zeros(0, dtype=[("time", np.float64), ("duration", np.float64), ("flags", np.uint32)])
+    new = np.ones(len(timeline), dtype=bool)
+    new[1:] = timeline["flags"][1:] != timeline["flags"][:-1]
+    start = np.flatnonzero(new)
+    merged = np.zeros(len(start), dtype=[("time", np.float64), ("duration", np.float64), ("flags", np.uint32)])
+    merged["time"] = timeline["time"][start]
+    merged["flags"] = timeline["flags"][start]
+    merged["duration"] = np.add.reduceat(timeline["duration"], start)
+    return merged
+
+
+def simulate(instr, triggers=0, max_steps=100000):
+    # run a compiled program on a fresh emulator, triggering it whenever it waits (at most triggers times),
+    # return its timeline and final status
+    emulator = PulseBlasterEmulator(max_instr=max(board_max_instr, len(instr)), latency={}, max_steps=max_steps,
+                                    record_timeline=True)
+    emulator.pb_start_programming(0)
+    for args in np.asarray(instr, dtype=instr_dtype).tolist():
+        if emulator.pb_inst_pbonly(*args) < 0:
+            raise ValueError(emulator.pb_get_error().decode("utf-8"))
+    emulator.pb_stop_programming()
+    emulator.pb_start()
+    for i in range(triggers):
+        if not emulator.board.status & STATUS_WAITING:
+            break
+        emulator.trigger()
+    return emulator.timeline(), emulator.board.status
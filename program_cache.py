@@ -0,0 +1,54 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+
+def program_key(instr):
+    # content hash of compiled instructions: an array, a list of argument tuples, or one such program per board
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(instr, np.ndarray):
+        h.update(np.ascontiguousarray(instr).tobytes())
+    else:
+        h.update(repr(instr).encode("utf-8"))
+    return h.digest()
+
+
+class ProgramCache:
+    """LRU cache of programs prepared for loading, keyed by content hash (see program_key()).
+
+    Scans with repetitions load the same programs again and again, this keeps the argument
+    lists that were prepared for them (see spinapi.pb_prepare_pbonly()) so they're converted
+    only once. hits and misses count lookups, evictions the entries dropped to stay within
+    max_size.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, instr, prepare):
+        # prepared program of key, prepare(instr) is called on a miss
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = prepare(instr)
+        self.entries[key] = entry
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
@@ -0,0 +1,115 @@
+import json
+import configparser
+import numpy as np
+from pulse_program import PulseProgram, duration_unit, opcodes, unit_scale
+
+# Saved configuration: a JSON object
+# {"format": config_format, "version": config_version, "boards": number of boards,
+#  "channel labels": [device name of logical channel 0, channel 1, ...],
+#  "instructions": {"flags": [TTL pattern of each instruction as int, bit i is logical channel i],
+#                   "opcode": [op code names], "opdata": [ints], "duration": [in ns],
+#                   "unit": [display unit names], "note": [strings]},
+#  "scanner": {"sample number": str, "repetition": str,
+#              "scanned instructions": [{"instr no.", "start duration", "start unit",
+#                                        "end duration", "end unit", "axis"}, ...]}}
+# Instructions are stored column-wise, so a program is read into arrays in one pass.
+config_format = "PulseBlasterUSB config"
+config_version = 1
+file_ext = ".json"
+
+
+def program_to_dict(program):
+    instr = program.instr
+    if program.num_boards == 1:
+        flags = instr["flags"].tolist()
+    else:
+        flags = [program.pattern(i) for i in range(len(program))]
+    return {"flags": flags,
+            "opcode": [opcodes[opcode] for opcode in instr["opcode"].tolist()],
+            "opdata": instr["opdata"].tolist(),
+            "duration": instr["duration"].tolist(),
+            "unit": [duration_unit[unit] for unit in program.unit.tolist()],
+            "note": list(program.notes)}
+
+
+def program_from_dict(data, channel_labels, num_boards=1):
+    num_instr = len(data["flags"])
+    program = PulseProgram(num_instr, num_boards)
+    if num_boards == 1:
+        program.instr["flags"] = np.array(data["flags"], dtype=np.int64)
+    else:
+        program.set_patterns(data["flags"])
+    program.instr["opcode"] = [opcodes.index(name) for name in data["opcode"]]
+    program.instr["opdata"] = data["opdata"]
+    program.instr["duration"] = data["duration"]
+    program.unit[:] = [duration_unit.index(name) for name in data["unit"]]
+    program.notes = list(data["note"])
+    program.channel_labels = (list(channel_labels) + [""]*program.num_channels)[:program.num_channels]
+    return program
+
+
+def config_to_dict(program, scanner_settings):
+    return {"format": config_format, "version": config_version, "boards": program.num_boards,
+            "channel labels": list(program.channel_labels),
+            "instructions": program_to_dict(program),
+            "scanner": scanner_settings}
+
+
+def config_from_dict(config):
+    # return program and scanner settings of a config, as read from JSON
+    if config.get("format") != config_format:
+        raise ValueError("Not a PulseBlasterUSB config.")
+    if config.get("version", 0) > config_version:
+        raise ValueError("Config file version {} is newer than supported version {}".format(config["version"], config_version))
+    program = program_from_dict(config["instructions"], config["channel labels"], config.get("boards", 1))
+    return program, config["scanner"]
+
+
+def write_config(file_name, program, scanner_settings):
+    with open(file_name, "w") as f:
+        json.dump(config_to_dict(program, scanner_settings), f, indent=1)
+
+
+def read_config(file_name):
+    # return program and scanner settings from a JSON config, or from a legacy INI config
+    with open(file_name, "r") as f:
+        text = f.read()
+    if not text.lstrip().startswith("{"):
+        return read_legacy_ini(text)
+    try:
+        return config_from_dict(json.loads(text))
+    except ValueError as err:
+        raise ValueError("{}: {}".format(file_name, err))
+
+
+# the old INI format, one section per instruction and scanned instruction
+def read_legacy_ini(text):
+    config = configparser.ConfigParser()
+    config.read_string(text)
+
+    general = config["General settings"]
+    num_instr = int(general.get("number of instructions"))
+    sections = [config[f"Instr {i}"] for i in range(num_instr)]
+    # devices are listed from the last channel to channel 0
+    dev_name = [dev.strip() for dev in general.get("devices").split(',')]
+    data = {"flags": [int(section["ttl output pattern"], 2) for section in sections],
+            "opcode": [section.get("op code") for section in sections],
+            "opdata": [int(section.get("op data")) for section in sections],
+            "duration": [float(section.get("duration time")) for section in sections],
+            "unit": [section.get("duration unit") for section in sections],
+            "note": [section.get("instr note") for section in sections]}
+    # durations are saved in their display unit
+    program = program_from_dict(data, dev_name[::-1])
+    program.instr["duration"] *= unit_scale(program.unit)
+
+    scanner = config["Scanner settings"]
+    scanned = []
+    for i in range(int(scanner.get("number of scanned instr"))):
+        section = config[f"Scanned Instr {i}"]
+        scanned.append({"instr no.": section.get("instr no."),
+                        "start duration": section.get("start duration"), "start unit": section.get("start unit"),
+                        "end duration": section.get("end duration"), "end unit": section.get("end unit"),
+                        "axis": section.get("axis", "0")})
+    scanner_settings = {"sample number": scanner.get("sample number"), "repetition": scanner.get("repetition"),
+                        "scanned instructions": scanned}
+    return program, scanner_settings
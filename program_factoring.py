@@ -0,0 +1,196 @@
+import logging
+import numpy as np
+from pulse_program import instr_dtype, opcodes, address_opcodes
+from pb_emulator import simulate, merge_timeline
+
+CONTINUE = opcodes.index("CONTINUE")
+STOP = opcodes.index("STOP")
+LOOP = opcodes.index("LOOP")
+END_LOOP = opcodes.index("END_LOOP")
+JSR = opcodes.index("JSR")
+RTS = opcodes.index("RTS")
+BRANCH = opcodes.index("BRANCH")
+
+max_block = 32 # longest repeated block looked for, in instructions
+max_loops = 2**20 # largest LOOP count
+verify_triggers = 100 # programs are compared over this many WAIT triggers...
+verify_steps = 20000 # ... or this many executed instructions
+
+
+class Rows:
+    """Instructions being rewritten: rows [flags, opcode, opdata, duration], the new address of
+    every old address, and which rows already hold new addresses in their op data."""
+
+    def __init__(self):
+        self.rows = []
+        self.fixed = set()
+
+    def append(self, row, fixed=False):
+        if fixed:
+            self.fixed.add(len(self.rows))
+        self.rows.append(list(row))
+
+    def relocate(self, address_map):
+        for j, row in enumerate(self.rows):
+            if row[1] in address_opcodes and j not in self.fixed and 0 <= row[2] < len(address_map):
+                row[2] = int(address_map[row[2]])
+
+
+# instructions that may become part of a factored block: CONTINUE, not kept, and
+# (except for the first one of a block) not the target of a jump
+def block_runs(rows, keep):
+    targets = set(row[2] for row in rows if row[1] in address_opcodes)
+    free = [row[1] == CONTINUE and j not in keep for j, row in enumerate(rows)]
+    # run[j]: number of instructions from j on that can form a block starting at j
+    run = [0]*(len(rows)+1)
+    for j in reversed(range(len(rows))):
+        if free[j]:
+            run[j] = 1 + (run[j+1] if j+1 < len(rows) and j+1 not in targets else 0)
+    return run
+
+
+def key(row):
+    # op data of CONTINUE has no effect
+    return (row[0], row[1], row[3])
+
+
+def factor_loops(rows, keep):
+    # replace m >= 2 consecutive copies of a block of k >= 2 instructions with one copy whose
+    # first instruction is a LOOP and last one an END_LOOP
+    keys = [key(row) for row in rows]
+    run = block_runs(rows, keep)
+    out = Rows()
+    address_map = np.zeros(len(rows)+1, dtype=np.int64)
+    i = 0
+    while i < len(rows):
+        best_k, best_m = 0, 0
+        for k in range(2, min(max_block, run[i]//2) + 1):
+            m = 1
+            while (m+1)*k <= run[i] and m < max_loops and keys[i+m*k:i+(m+1)*k] == keys[i:i+k]:
+                m += 1
+            if m >= 2 and k*(m-1) > best_k*(best_m-1):
+                best_k, best_m = k, m
+        if best_m == 0:
+            address_map[i] = len(out.rows)
+            out.append(rows[i])
+            i += 1
+            continue
+        start = len(out.rows)
+        for j in range(best_k*best_m):
+            address_map[i+j] = start + j % best_k
+        flags, opcode, opdata, duration = rows[i]
+        out.append([flags, LOOP, best_m, duration])
+        for j in range(1, best_k-1):
+            out.append(rows[i+j])
+        flags, opcode, opdata, duration = rows[i+best_k-1]
+        out.append([flags, END_LOOP, start, duration], fixed=True)
+        i += best_k*best_m
+    address_map[len(rows)] = len(out.rows)
+    out.relocate(address_map)
+    return out.rows, address_map
+
+
+def factor_subroutines(rows, keep):
+    # replace r >= 2 copies of a block of k >= 2 instructions anywhere in the program with a JSR
+    # (outputs of the first instruction) to a subroutine holding the others, ending with RTS;
+    # subroutines are placed after the end, so the program has to end with STOP or BRANCH
+    if not rows or rows[-1][1] not in (STOP, BRANCH):
+        return rows, np.arange(len(rows)+1)
+    keys = [key(row) for row in rows]
+    run = block_runs(rows, keep)
+    used = [False]*len(rows)
+    blocks = [] # (start of each copy, k)
+    for k in range(min(max_block, len(rows)), 1, -1):
+        copies = {}
+        for i in range(len(rows)-k+1):
+            if run[i] >= k:
+                copies.setdefault(tuple(keys[i:i+k]), []).append(i)
+        # blocks saving the most instructions first
+        for starts in sorted(copies.values(), key=len, reverse=True):
+            chosen = []
+            for i in starts:
+                if not any(used[i:i+k]):
+                    chosen.append(i)
+                    for j in range(i, i+k):
+                        used[j] = True
+            if len(chosen) >= 2:
+                blocks.append((chosen, k))
+            else:
+                for i in chosen:
+                    for j in range(i, i+k):
+                        used[j] = False
+    if not blocks:
+        return rows, np.arange(len(rows)+1)
+
+    block_at = {} # start of a copy: block number
+    for b, (starts, k) in enumerate(blocks):
+        for i in starts:
+            block_at[i] = b
+    out = Rows()
+    address_map = np.zeros(len(rows)+1, dtype=np.int64)
+    jsr_rows = [] # (row in out, block number)
+    i = 0
+    while i < len(rows):
+        if i in block_at:
+            b = block_at[i]
+            k = blocks[b][1]
+            address_map[i:i+k] = len(out.rows)
+            jsr_rows.append((len(out.rows), b))
+            out.append(rows[i], fixed=True)
+            i += k
+        else:
+            address_map[i] = len(out.rows)
+            out.append(rows[i])
+            i += 1
+    address_map[len(rows)] = len(out.rows)
+    out.relocate(address_map)
+
+    sub_address = []
+    for starts, k in blocks:
+        sub_address.append(len(out.rows))
+        first = starts[0]
+        for j in range(first+1, first+k-1):
+            out.append(rows[j])
+        flags, opcode, opdata, duration = rows[first+k-1]
+        out.append([flags, RTS, 0, duration])
+    for j, b in jsr_rows:
+        out.rows[j][1] = JSR
+        out.rows[j][2] = sub_address[b]
+    return out.rows, address_map
+
+
+def same_output(instr, new):
+    # compare the output of two programs on the emulator, over several WAIT triggers
+    try:
+        timeline, status = simulate(instr, verify_triggers, verify_steps)
+        new_timeline, new_status = simulate(new, verify_triggers, verify_steps)
+    except ValueError:
+        return False
+    a = merge_timeline(timeline)
+    b = merge_timeline(new_timeline)
+    return (status == new_status and len(a) == len(b) and (a["flags"] == b["flags"]).all()
+            and np.allclose(a["duration"], b["duration"]) and np.allclose(a["time"], b["time"]))
+
+
+def factor(instr, keep=(), verify=True):
+    """Compress repeated blocks of CONTINUE instructions into LOOP/END_LOOP and JSR/RTS.
+
+    Consecutive copies of a block become a loop, copies elsewhere in the program become calls
+    of a subroutine placed after the end of the program. Instructions in keep (e.g. scanned
+    ones) are never part of a block. If verify is True, the new program is run on the
+    emulator and it's only used if its output is the same as the original's. Return the new
+    instructions and an array mapping each old address to the new one.
+    """
+    instr = np.asarray(instr, dtype=instr_dtype)
+    keep = set(int(i) for i in keep)
+    rows, loop_map = factor_loops(instr.tolist(), keep)
+    keep = set(int(loop_map[i]) for i in keep)
+    rows, sub_map = factor_subroutines(rows, keep)
+    address_map = sub_map[loop_map]
+    new = np.array([tuple(row) for row in rows], dtype=instr_dtype)
+    if len(new) == len(instr):
+        return instr.copy(), np.arange(len(instr)+1)
+    if verify and not same_output(instr, new):
+        logging.warning("(factor) Factored program doesn't have the same output, it's not used.")
+        return instr.copy(), np.arange(len(instr)+1)
+    return new, address_map
@@ -0,0 +1,78 @@
+import math
+import numpy as np
+from pulse_program import instr_dtype, opcodes, address_opcodes
+from program_factoring import factor
+
+CONTINUE = opcodes.index("CONTINUE")
+LONG_DELAY = opcodes.index("LONG_DELAY")
+max_cycles = 2**32 - 1 # longest single instruction of PulseBlasterUSB, in clock cycles
+
+
+def long_delay(flags, duration, cycle):
+    # instructions of a CONTINUE that's too long for one instruction: a LONG_DELAY of n times q
+    # cycles, and a CONTINUE for the remainder (it can't be shorter than q, so it's long enough)
+    cycles = round(duration / cycle)
+    n = max(3, math.ceil(cycles / (max_cycles // 2)))
+    q, r = divmod(cycles, n)
+    if r == 0:
+        return [[flags, LONG_DELAY, n, q*cycle]]
+    return [[flags, LONG_DELAY, n-1, q*cycle], [flags, CONTINUE, 0, (q+r)*cycle]]
+
+
+def optimize(instr, keep=(), clock=100.0, factor_repeats=True):
+    """Shorten a compiled program without changing its output.
+
+    Drops CONTINUE instructions of zero length, merges adjacent CONTINUE instructions with the
+    same output pattern, and turns CONTINUE instructions longer than the board can time into a
+    LONG_DELAY (plus a CONTINUE for the remainder). With factor_repeats, repeated blocks are
+    then turned into loops and subroutines (see program_factoring.py). Addresses in op data
+    are relocated. Instructions in keep (e.g. scanned instructions, whose durations are replaced later) are
+    left as they are. Return the new instructions and an array mapping each old address to
+    the new one.
+    """
+    instr = np.asarray(instr, dtype=instr_dtype)
+    num_instr = len(instr)
+    keep = set(int(i) for i in keep)
+    targets = set(instr["opdata"][np.isin(instr["opcode"], address_opcodes)].tolist())
+    cycle = 1000.0 / clock # in ns
+
+    # drop and merge
+    rows = [] # new instructions as [flags, opcode, opdata, duration]
+    mergeable = [] # whether the following CONTINUE can be merged into a row
+    address_map = np.zeros(num_instr+1, dtype=np.int64) # address_map[num_instr] is the end of the program
+    target = False # True if a jump goes to this instruction or to dropped ones right before it
+    for i, (flags, opcode, opdata, duration) in enumerate(instr.tolist()):
+        address_map[i] = len(rows)
+        target = target or i in targets
+        free = opcode == CONTINUE and i not in keep
+        if free and duration <= 0:
+            # jumps to it go on to the next instruction
+            continue
+        if free and not target and rows and mergeable[-1] and rows[-1][0] == flags:
+            rows[-1][3] += duration
+            address_map[i] = len(rows) - 1
+            continue
+        rows.append([flags, opcode, opdata, duration])
+        mergeable.append(free)
+        target = False
+    address_map[num_instr] = len(rows)
+
+    # split instructions that are too long
+    new_rows = []
+    row_map = np.zeros(len(rows)+1, dtype=np.int64)
+    for j, row in enumerate(rows):
+        row_map[j] = len(new_rows)
+        if mergeable[j] and row[3] > max_cycles*cycle:
+            new_rows.extend(long_delay(row[0], row[3], cycle))
+        else:
+            new_rows.append(row)
+    row_map[len(rows)] = len(new_rows)
+    address_map = row_map[address_map]
+
+    new = np.array([tuple(row) for row in new_rows], dtype=instr_dtype)
+    is_address = np.isin(new["opcode"], address_opcodes) & (new["opdata"] >= 0) & (new["opdata"] <= num_instr)
+    new["opdata"][is_address] = address_map[new["opdata"][is_address]]
+    if factor_repeats:
+        new, factor_map = factor(new, keep=address_map[sorted(keep)])
+        address_map = factor_map[address_map]
+    return new, address_map
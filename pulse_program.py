@@ -0,0 +1,157 @@
+import numpy as np
+
+channel_num = 24 # number of TTL output channels of SpinCore PulseBlasterUSB, per board
+board_max_instr = 4096 # instruction memory of PulseBlasterUSB
+duration_unit = ["ms", "us", "ns"]
+opcodes = ["CONTINUE", "STOP", "LOOP", "END_LOOP", "JSR", "RTS", "BRANCH", "LONG_DELAY", "WAIT"]
+# op data of these instructions is an instruction address
+address_opcodes = [opcodes.index("END_LOOP"), opcodes.index("JSR"), opcodes.index("BRANCH")]
+
+# one record per instruction, fields in the same order as the arguments of pb_inst_pbonly
+instr_dtype = np.dtype([("flags", np.uint32),       # TTL output pattern, bit i is channel i
+                        ("opcode", np.int32),       # index into opcodes
+                        ("opdata", np.int32),
+                        ("duration", np.float64)])  # in ns
+
+default_duration = 10.0 # in units of duration_unit[default_unit]
+default_unit = 0
+
+
+def unit_scale(unit):
+    # convert a duration in duration_unit[unit] to ns
+    return 1000.0**(2-unit)
+
+def format_duration(value):
+    # shortest text that reads back to exactly the same float, e.g. "10" instead of "10.0"
+    return np.format_float_positional(value, trim='-')
+
+
+class PulseProgram:
+    """GUI-independent pulse program: an array of instructions plus notes and display units.
+
+    The instruction columns of the GUI only view and edit this object, so compiling, saving
+    and loading a program never has to touch Tk widgets. With several boards, logical channel
+    ch is channel ch % channel_num of board ch // channel_num; all boards run the same
+    instructions and only differ in their TTL outputs.
+    """
+
+    def __init__(self, num_instr=0, num_boards=1):
+        self.num_boards = num_boards
+        self.num_channels = channel_num*num_boards
+        self.instr = np.zeros(0, dtype=instr_dtype) # outputs of board 0 are in its flags
+        self.board_flags = np.zeros((0, num_boards-1), dtype=np.uint32) # outputs of boards 1, 2, ...
+        self.unit = np.zeros(0, dtype=np.int8) # duration unit shown in GUI, index into duration_unit
+        self.notes = []
+        self.channel_labels = [""]*self.num_channels # name of the device connected to each channel
+        self.resize(num_instr)
+
+    def __len__(self):
+        return len(self.instr)
+
+    def copy(self):
+        new = PulseProgram(0, self.num_boards)
+        new.instr = self.instr.copy()
+        new.board_flags = self.board_flags.copy()
+        new.unit = self.unit.copy()
+        new.notes = list(self.notes)
+        new.channel_labels = list(self.channel_labels)
+        return new
+
+    # add default instructions at the end or remove the last ones
+    def resize(self, num_instr):
+        old_num = len(self.instr)
+        if num_instr <= old_num:
+            self.instr = self.instr[:num_instr].copy()
+            self.board_flags = self.board_flags[:num_instr].copy()
+            self.unit = self.unit[:num_instr].copy()
+            del self.notes[num_instr:]
+            return
+
+        instr = np.zeros(num_instr, dtype=instr_dtype)
+        instr[:old_num] = self.instr
+        instr["duration"][old_num:] = default_duration * unit_scale(default_unit)
+        board_flags = np.zeros((num_instr, self.num_boards-1), dtype=np.uint32)
+        board_flags[:old_num] = self.board_flags
+        unit = np.full(num_instr, default_unit, dtype=np.int8)
+        unit[:old_num] = self.unit
+        self.instr = instr
+        self.board_flags = board_flags
+        self.unit = unit
+        self.notes.extend([""]*(num_instr-old_num))
+
+    # add boards with all outputs off, or remove the last ones
+    def set_num_boards(self, num_boards):
+        board_flags = np.zeros((len(self.instr), num_boards-1), dtype=np.uint32)
+        keep = min(num_boards, self.num_boards) - 1
+        board_flags[:, :keep] = self.board_flags[:, :keep]
+        self.board_flags = board_flags
+        self.num_boards = num_boards
+        self.num_channels = channel_num*num_boards
+        self.channel_labels = (self.channel_labels + [""]*self.num_channels)[:self.num_channels]
+
+    # TTL output patterns of a board, one per instruction
+    def flags(self, board):
+        if board == 0:
+            return self.instr["flags"]
+        return self.board_flags[:, board-1]
+
+    def set_output(self, i, ch, state):
+        board, ch = divmod(ch, channel_num)
+        flags = self.flags(board)
+        if state:
+            flags[i] |= np.uint32(1 << ch)
+        else:
+            flags[i] &= np.uint32(~(1 << ch) & 0xFFFFFFFF)
+
+    def output(self, i, ch):
+        board, ch = divmod(ch, channel_num)
+        return (int(self.flags(board)[i]) >> ch) & 1
+
+    # TTL output of all logical channels of instruction i, channel 0 first
+    def outputs(self, i):
+        bits = np.arange(channel_num)
+        return np.concatenate([(int(self.flags(board)[i]) >> bits) & 1 for board in range(self.num_boards)])
+
+    # TTL outputs of all boards of instruction i as one int, bit ch is logical channel ch
+    def pattern(self, i):
+        value = 0
+        for board in range(self.num_boards):
+            value |= int(self.flags(board)[i]) << (board*channel_num)
+        return value
+
+    def set_patterns(self, patterns):
+        # patterns: one int per instruction, as returned by pattern()
+        mask = (1 << channel_num) - 1
+        for board in range(self.num_boards):
+            self.flags(board)[:] = [(pattern >> (board*channel_num)) & mask for pattern in patterns]
+
+    def set_opcode(self, i, opcode):
+        self.instr["opcode"][i] = opcode
+
+    def set_opdata(self, i, opdata):
+        self.instr["opdata"][i] = opdata
+
+    def set_note(self, i, note):
+        self.notes[i] = note
+
+    # value is in units of duration_unit[unit]
+    def set_duration(self, i, value, unit):
+        self.unit[i] = unit
+        self.instr["duration"][i] = value * unit_scale(unit)
+
+    # duration of instruction i in its display unit
+    def duration_value(self, i):
+        return self.instr["duration"][i] / unit_scale(self.unit[i])
+
+    def compile(self, board=0):
+        # a snapshot of the instruction array of a board, ready to be passed to PulseBlasterUSB
+        instr = self.instr.copy()
+        if board > 0:
+            instr["flags"] = self.flags(board) if board < self.num_boards else 0
+        return instr
+
+    def compile_with_durations(self, instr_index, durations, board=0):
+        # compile with durations (in ns) of some instructions replaced, as used by the scanner
+        instr = self.compile(board)
+        instr["duration"][instr_index] = durations
+        return instr
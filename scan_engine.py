@@ -0,0 +1,245 @@
+import time
+import shutil
+import logging
+import numpy as np
+import spinapi
+from pulse_program import duration_unit, unit_scale
+from scan_plan import ScanPlan, UnrolledScanPlan
+from scan_order import GridScan
+from adaptive_scan import AdaptiveScan
+from measurement_feed import open_feed
+from board_loader import BoardLoader
+from board_set import BoardSetPlan
+from program_optimizer import optimize as optimize_program
+from scan_worker import ScanWorker
+from cycle_log import CycleLog, csv_ext as cycle_csv_ext
+from triggers import DAQTrigger, SimulatedTrigger, EmulatorTrigger
+from pb_emulator import PulseBlasterEmulator
+from sequence_file import write_sequence, write_legacy_ini, file_ext as sequence_file_ext
+
+
+# a program of more boards than there are can't be loaded, channels of missing boards would be lost
+def check_boards(boards, program):
+    if program.num_boards > boards.num_boards:
+        raise ValueError("Program uses {} boards, but only {} found.".format(program.num_boards, boards.num_boards))
+
+
+def load_program(boards, program, optimize=True, clock=None):
+    # program every board once, return the number of instructions before and after optimizing
+    # (of the longest board program); raise ValueError if a board can't be programmed
+    # clock: core clock in MHz for the optimizer, that of boards if None
+    check_boards(boards, program)
+    clock = boards.clock if clock is None else clock
+    programs = [program.compile(board) for board in range(boards.num_boards)]
+    if optimize:
+        programs = [optimize_program(instr, clock=clock)[0] for instr in programs]
+    if boards.program(programs) < 0:
+        raise ValueError("Error programming PulseBlasterUSB: %s" % spinapi.pb_get_error())
+    return len(program), max(len(instr) for instr in programs)
+
+
+def make_trigger_source(source, daq_channel="Dev3/port0/line0", rate=50.0):
+    # source: "DAQ" for the WAITING signal read by a DAQ, "Simulated" for a timer at rate (in Hz),
+    # or the emulated board's own WAIT state if the emulator is used
+    if source == "DAQ":
+        return DAQTrigger(daq_channel)
+    backend = spinapi.get_backend()
+    if isinstance(backend, PulseBlasterEmulator):
+        return EmulatorTrigger(backend, 1.0/rate)
+    return SimulatedTrigger(rate)
+
+
+class ScanEngine:
+    """A scan without GUI, set up from scanner settings as saved in config files.
+
+    prepare() builds the scan sequence and plans and writes the sequence file, start() loads
+    the first point, starts the boards and hands triggers to a ScanWorker; stop() writes the
+    cycle timestamps and the executed sequence. Settings that can't be scanned raise
+    ValueError. The Scanner panel of the GUI and cli.py both run scans with it.
+
+    Observers follow a scan as it runs (e.g. control_server.ControlServer): scan_started(engine)
+    is called before the first point is loaded, scan_cycle(engine, cycle, position, flags,
+    times) for every cycle on the worker thread (see ScanWorker), and scan_stopped(engine)
+    once the sequence files are written.
+    """
+
+    def __init__(self, boards, program, settings, file_name, seed=None, guard=0.001, unroll=False,
+                 optimize=True, feed=None, legacy_ini=False, camera_file=None, loader=None, observers=(), clock=None):
+        # settings: scanner settings dict (see program_config.py); file_name: sequence file, without extension;
+        # feed: measurement feed of an adaptive scan (see measurement_feed.py), None for a grid scan;
+        # camera_file: copy of the sequence file for programs that read it from a fixed place, None for no copy
+        # clock: core clock in MHz for the optimizer, that of boards if None
+        self.boards = boards
+        self.program = program
+        self.settings = settings
+        self.file_name = file_name
+        self.seed = seed
+        self.guard = guard
+        self.unroll = unroll
+        self.optimize = optimize
+        self.feed = feed
+        self.legacy_ini = legacy_ini
+        self.camera_file = camera_file
+        self.loader = loader if loader is not None else BoardLoader(boards=boards)
+        self.observers = list(observers)
+        self.clock = boards.clock if clock is None else clock
+        self.scan_param = None
+        self.plan = None
+        self.worker = None
+        self.cycle_log = None
+        self.trigger_source = None
+        self.num_instr = (0, 0) # instructions of the program before and after optimizing
+
+    # instruction numbers, start and end durations (in ns) and axes of scanned instructions
+    def scanned(self):
+        scanned = self.settings["scanned instructions"]
+        instr = [int(values["instr no."]) for values in scanned]
+        start = [float(values["start duration"])*unit_scale(duration_unit.index(values["start unit"])) for values in scanned]
+        end = [float(values["end duration"])*unit_scale(duration_unit.index(values["end unit"])) for values in scanned]
+        axis = [int(values.get("axis", "0")) for values in scanned]
+        return instr, start, end, axis
+
+    def prepare(self):
+        instr_index, start, end, axis = self.scanned()
+        rep = int(self.settings["repetition"])
+
+        # axes are numbered in increasing order of their axis numbers,
+        # sample number is either one number for all axes or one number per axis separated by commas
+        axis_num = sorted(set(axis))
+        column_axis = [axis_num.index(a) for a in axis]
+        samp_num = [int(n) for n in str(self.settings["sample number"]).split(',')]
+        if len(samp_num) == 1:
+            samp_num = samp_num*len(axis_num)
+        if len(samp_num) != len(axis_num):
+            raise ValueError("Give one sample number, or one for each axis.")
+        if min(samp_num) < 1 or rep < 1:
+            raise ValueError("Sample number and repetition have to be at least 1.")
+
+        check_boards(self.boards, self.program)
+
+        # instruction number sanity check
+        for i in instr_index:
+            if not 0 <= i < len(self.program):
+                raise ValueError("Insturction number doesn't exist.")
+
+        # randomized scan parameters, generated on demand from a seed, see scan_order.py
+        # a random seed is used if none is given, it's saved in sequence file to regenerate the sequence
+        if self.feed is not None:
+            # points after the first samp_num ones are chosen from measurement results, see adaptive_scan.py
+            if len(axis_num) > 1:
+                raise ValueError("Adaptive scan supports only one axis.")
+            self.scan_param = AdaptiveScan(start, end, samp_num[0], rep, open_feed(self.feed), seed=self.seed)
+        else:
+            self.scan_param = GridScan(start, end, column_axis, samp_num, rep, self.seed)
+
+        try:
+            self.build_plan(instr_index)
+        except BaseException:
+            # the feed's socket or file isn't left open by a scan that never starts
+            self.close_feed()
+            raise
+
+    def build_plan(self, instr_index):
+        # precompile instructions of every sample, so loading a point is only a few calls to PulseBlasterUSB
+        # with several boards, each board has its own plan and all of them are loaded for every point
+        plans = [ScanPlan(self.program, instr_index, self.scan_param, board, self.optimize, self.clock) for board in range(self.boards.num_boards)]
+        self.num_instr = (plans[0].num_instr_before, max(len(plan.base) for plan in plans))
+        if self.unroll:
+            # load as many scan points as instruction memory allows at once
+            plans = [UnrolledScanPlan(plan) for plan in plans]
+            # boards are optimized separately, but all of them have to load the same points at once
+            chunk_size = min(plan.chunk_size for plan in plans)
+            for plan in plans:
+                plan.chunk_size = chunk_size
+        self.plan = plans[0] if len(plans) == 1 else BoardSetPlan(plans)
+
+        # adaptive scans are saved when they stop
+        if self.feed is None:
+            self.write_sequence_files()
+
+    def start(self, trigger_source):
+        # minimal time between a trigger and loading, the loader also waits until the board is stopped or waiting
+        self.loader.min_guard = self.guard
+        self.loader.reset()
+
+        # stop and reset spincore
+        self.boards.stop()
+        self.boards.reset()
+
+        # the worker thread counts scanned points and loads spincore whenever a trigger arrives
+        self.worker = ScanWorker(self.loader, self.plan)
+        self.worker.listeners.append(self.scan_cycle)
+        for observer in self.observers:
+            observer.scan_started(self)
+
+        # load spincore the first scan parameters
+        self.worker.load_next()
+
+        # start spincore and make it ready to be triggered
+        self.boards.start()
+        # timestamps of every cycle, relative to pb_start
+        self.cycle_log = CycleLog(time.perf_counter())
+        self.worker.log = self.cycle_log
+
+        # triggers are only handed over to the worker thread
+        self.trigger_source = trigger_source
+        self.worker.start()
+        self.trigger_source.start(self.worker.trigger)
+
+    @property
+    def finished(self):
+        return self.worker is not None and self.worker.finished
+
+    def stop(self):
+        try:
+            self.trigger_source.stop()
+        except Exception as err:
+            logging.warning(err)
+
+        self.worker.stop()
+        self.worker.join(timeout=1)
+
+        # timestamps of all cycles, next to the sequence file
+        self.cycle_log.write_csv(self.file_name + cycle_csv_ext)
+
+        self.close_feed()
+        # replace the planned sequence with the points that were actually run, one row per cycle
+        self.write_sequence_files(self.worker.executed())
+        for observer in self.observers:
+            observer.scan_stopped(self)
+
+    def scan_cycle(self, cycle, position, flags, times):
+        for observer in self.observers:
+            observer.scan_cycle(self, cycle, position, flags, times)
+
+    def close_feed(self):
+        if isinstance(self.scan_param, AdaptiveScan):
+            self.scan_param.feed.close()
+
+    def write_sequence_files(self, executed=None):
+        # executed: positions in the sequence and cycle flags of every cycle run,
+        # the executed order is written instead of the whole sequence
+        scan_param = self.scan_param
+        instr_index = self.plan.instr_index
+        # sample number, repetition and what's needed to regenerate the sequence
+        settings = scan_param.settings()
+        settings["scan device"] = "SpinCore"
+        settings["scan param"] = f"instr no. {instr_index[0]}"
+        columns = [f"SpinCore [instr no. {i}]" for i in instr_index]
+        if executed is not None:
+            positions, flags = executed
+            scan_param = np.column_stack([scan_param.rows_at(positions), positions, flags])
+            columns += ["sequence position", "cycle flags"]
+            settings["executed order"] = True
+        settings["element number"] = len(scan_param)
+
+        # the whole sequence is written once as a binary file, see sequence_file.py
+        write_sequence(self.file_name+sequence_file_ext, scan_param, columns, settings)
+
+        if self.camera_file:
+            shutil.copyfile(self.file_name+sequence_file_ext, self.camera_file+sequence_file_ext)
+
+        if self.legacy_ini:
+            write_legacy_ini(self.file_name+".ini", scan_param, columns, settings)
+            if self.camera_file:
+                write_legacy_ini(self.camera_file+".ini", scan_param, columns, settings)
@@ -0,0 +1,150 @@
+import random
+import numpy as np
+
+feistel_rounds = 4
+mask64 = (1 << 64) - 1
+
+
+class ScanOrder:
+    """Seeded random permutation of range(length), computed on demand.
+
+    A Feistel network over the next even power of two (with cycle walking) maps a position in
+    the scan to an element, so no shuffled array has to be stored and the same seed always
+    gives the same order.
+    """
+
+    def __init__(self, length, seed):
+        # an empty order would never find an element
+        assert length > 0
+        self.length = length
+        self.seed = seed
+        bits = max(1, (length-1).bit_length())
+        self.half_bits = np.uint64((bits+1) // 2)
+        self.half_mask = np.uint64((1 << int(self.half_bits)) - 1)
+        self.keys = np.random.SeedSequence(seed).generate_state(feistel_rounds, dtype=np.uint64)
+        # plain int copies, for looking up a single position without numpy overhead
+        self.int_keys = [int(key) for key in self.keys]
+        self.int_half_bits = int(self.half_bits)
+        self.int_half_mask = int(self.half_mask)
+
+    def __len__(self):
+        return self.length
+
+    def round_function(self, x, key):
+        # splitmix64 finalizer, uint64 arithmetic wraps around
+        with np.errstate(over='ignore'):
+            x = (x ^ key) * np.uint64(0x9E3779B97F4A7C15)
+            x ^= x >> np.uint64(30)
+            x *= np.uint64(0xBF58476D1CE4E5B9)
+            x ^= x >> np.uint64(27)
+            x *= np.uint64(0x94D049BB133111EB)
+            x ^= x >> np.uint64(31)
+        return x
+
+    def feistel(self, x):
+        left = x >> self.half_bits
+        right = x & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ (self.round_function(right, key) & self.half_mask)
+        return (left << self.half_bits) | right
+
+    def permute(self, positions):
+        # element at each of positions (array)
+        x = self.feistel(np.asarray(positions, dtype=np.uint64))
+        outside = x >= self.length
+        while outside.any():
+            x[outside] = self.feistel(x[outside])
+            outside = x >= self.length
+        return x.astype(np.int64)
+
+    # same as round_function() and feistel(), with plain ints
+    def int_feistel(self, x):
+        left = x >> self.int_half_bits
+        right = x & self.int_half_mask
+        for key in self.int_keys:
+            y = ((right ^ key) * 0x9E3779B97F4A7C15) & mask64
+            y ^= y >> 30
+            y = (y * 0xBF58476D1CE4E5B9) & mask64
+            y ^= y >> 27
+            y = (y * 0x94D049BB133111EB) & mask64
+            y ^= y >> 31
+            left, right = right, left ^ (y & self.int_half_mask)
+        return (left << self.int_half_bits) | right
+
+    def __getitem__(self, k):
+        x = self.int_feistel(k)
+        while x >= self.length:
+            x = self.int_feistel(x)
+        return x
+
+
+class GridScan:
+    """Randomized scan over a grid of independent axes, generated lazily.
+
+    Each scanned instruction (column) belongs to an axis and goes from its start to its end
+    value in the number of steps of that axis (like np.linspace). Instructions on the same
+    axis move synchronously, different axes form a Cartesian product. A sample index is
+    converted to one index per axis on the fly, so the grid is never materialized. Each sample
+    appears rep times in a random order given by a ScanOrder, so the whole sequence can be
+    regenerated from seed, axis sample numbers and rep.
+    """
+
+    def __init__(self, start, end, column_axis, axis_samp_num, rep, seed=None):
+        # start, end: one value (in ns) per column; column_axis: axis number of each column
+        # axis_samp_num: number of samples on each axis
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.column_axis = np.asarray(column_axis, dtype=np.int64)
+        self.axis_samp_num = tuple(int(n) for n in axis_samp_num)
+        self.column_samp_num = np.asarray(self.axis_samp_num)[self.column_axis]
+        self.rep = rep
+        self.num_samples = int(np.prod(self.axis_samp_num))
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.order = ScanOrder(self.num_samples*rep, seed)
+        self.seed = seed
+        self.shape = (self.num_samples*rep, len(self.start))
+
+    def __len__(self):
+        return self.shape[0]
+
+    # scan values of samples (array of sample indices), one row per sample
+    def sample_values(self, samples):
+        axis_index = np.unravel_index(np.asarray(samples, dtype=np.int64), self.axis_samp_num)
+        index = np.stack(axis_index, axis=-1)[:, self.column_axis]
+        # same values as np.linspace
+        num = self.column_samp_num
+        step = (self.end-self.start) / np.maximum(num-1, 1)
+        values = index*step + self.start
+        return np.where((index == num-1) & (num > 1), self.end, values)
+
+    # sample index of each position in the scan
+    def samples(self, start, stop):
+        return self.order.permute(np.arange(start, stop)) // self.rep
+
+    def sample(self, k):
+        return self.order[k] // self.rep
+
+    # scan values of positions start to stop-1, one row per position
+    def rows(self, start, stop):
+        return self.sample_values(self.samples(start, stop))
+
+    # scan values of one position, looked up with plain ints, e.g. for every cycle of a running scan
+    def values(self, k):
+        return self.sample_values([self.sample(k)])[0]
+
+    # scan values at positions (array), one row per position
+    def rows_at(self, positions):
+        return self.sample_values(self.order.permute(positions) // self.rep)
+
+    # what's needed to regenerate this sequence, saved in sequence file header
+    def settings(self):
+        return {"seed": self.seed, "sample number": self.num_samples, "repetition": self.rep,
+                "axis sample numbers": list(self.axis_samp_num), "column axes": self.column_axis.tolist()}
+
+
+class LinearScan(GridScan):
+    """Randomized synchronous linear scan: a grid with a single axis."""
+
+    def __init__(self, start, end, samp_num, rep, seed=None):
+        super().__init__(start, end, [0]*len(start), [samp_num], rep, seed)
@@ -0,0 +1,127 @@
+import numpy as np
+from pulse_program import opcodes, board_max_instr, address_opcodes
+from program_optimizer import optimize as optimize_program
+
+
+precompile_limit = 100000 # instructions of at most this many samples are precompiled, others are compiled on demand
+
+
+class ScanPlan:
+    """Precompiled instructions for every point of a scan.
+
+    Element k is the list of (flags, opcode, opdata, duration) tuples to pass to pb_inst_pbonly
+    for the k-th scan point, so loading a point needs no compiling or parsing at all. The plan
+    follows a lazily generated scan sequence (see scan_order.py): instructions are precompiled
+    once per distinct sample, not per scan point, so memory doesn't grow with repetitions.
+    """
+
+    def __init__(self, program, instr_index, sequence, board=0, optimize=False, clock=100.0):
+        # instr_index: instruction numbers that are scanned, one per column of sequence values
+        # board: board of a multi-board program whose instructions are compiled
+        # optimize: shorten the program with program_optimizer.optimize(), scanned instructions are kept
+        # clock: core clock in MHz, long instructions are split by the optimizer in whole clock cycles
+        self.instr_index = list(instr_index)
+        self.sequence = sequence
+        self.base = program.compile(board)
+        self.num_instr_before = len(self.base) # number of instructions before optimizing
+        self.scan_index = self.instr_index # addresses of scanned instructions in base
+        self.end_index = len(self.base) - 1 # address of the last instruction of the program, subroutines may follow
+        if optimize:
+            self.base, address_map = optimize_program(self.base, keep=self.instr_index+[self.end_index], clock=clock)
+            self.scan_index = address_map[self.instr_index].tolist()
+            self.end_index = int(address_map[self.end_index])
+        self.num_points = len(sequence)
+        if sequence.num_samples <= precompile_limit:
+            self.sample_args = self.compile_samples(np.arange(sequence.num_samples)).tolist()
+        else:
+            self.sample_args = None
+            self.base_args = self.base.tolist()
+
+    # instructions of samples (array of sample indices), one row per sample
+    def compile_samples(self, samples):
+        instr = np.repeat(self.base[np.newaxis, :], len(samples), axis=0)
+        instr["duration"][:, self.scan_index] = self.sequence.sample_values(samples)
+        return instr
+
+    # instructions of scan points start to stop-1, one row per point
+    def compile_points(self, start, stop):
+        return self.compile_samples(self.sequence.samples(start, stop))
+
+    def __len__(self):
+        return self.num_points
+
+    def __getitem__(self, k):
+        sample = self.sequence.sample(k)
+        if self.sample_args is not None:
+            return self.sample_args[sample]
+        args = list(self.base_args)
+        for i, value in zip(self.scan_index, self.sequence.sample_values([sample])[0].tolist()):
+            flags, opcode, opdata, duration = args[i]
+            args[i] = (flags, opcode, opdata, value)
+        return args
+
+    # number of scan points covered by the k-th load
+    def load_size(self, k):
+        return 1
+
+    # position in the scan sequence of the first point of the k-th load
+    def position(self, k):
+        return k
+
+
+class UnrolledScanPlan:
+    """Several consecutive scan points compiled into one long program per load.
+
+    The program of a single point has to end with a BRANCH back to the start of the cycle (the
+    WAIT ... BRANCH structure used for scanning). Copies of it, one per scan point, are placed
+    one after another with addresses relocated, and the BRANCH of every copy jumps into the
+    next copy, the last one jumps back to the first. Each copy still stops at its own WAIT, so
+    the board triggers the host once per scan point but only needs to be reprogrammed once
+    per chunk. Instructions between WAIT and BRANCH run with the values of the point before
+    the WAIT, while they run with the next point's values when scanning point by point, so
+    scanned instructions can't be there.
+    """
+
+    def __init__(self, plan, max_instr=board_max_instr):
+        self.plan = plan
+        self.instr_index = plan.instr_index
+        self.sequence = plan.sequence
+        self.num_points = plan.num_points
+        num_instr = len(plan.base)
+        self.end_index = plan.end_index
+        if plan.base["opcode"][self.end_index] != opcodes.index("BRANCH"):
+            raise ValueError("The last instruction has to be BRANCH to unroll a scan.")
+        if num_instr > max_instr:
+            raise ValueError("The program doesn't fit in instruction memory.")
+        waits = np.flatnonzero(plan.base["opcode"][:self.end_index] == opcodes.index("WAIT"))
+        if len(waits) > 0 and any(waits[-1] < i <= self.end_index for i in plan.scan_index):
+            # the cycle's position in the sequence would be labeled with the wrong point
+            raise ValueError("Scanned instructions between the last WAIT and BRANCH can't be unrolled.")
+
+        self.chunk_size = max_instr // num_instr # number of scan points per load
+
+    def unroll(self, instr):
+        # instr: 2-dim array, one row per scan point
+        num_copies, num_instr = instr.shape
+        instr = instr.copy()
+        offset = (np.arange(num_copies) * num_instr)[:, np.newaxis]
+        is_address = np.isin(instr["opcode"], address_opcodes)
+        instr["opdata"] += np.where(is_address, offset, 0).astype(np.int32)
+        # BRANCH at the end of each copy goes to the next copy, the last copy goes back to the first
+        instr["opdata"][:, self.end_index] += num_instr
+        instr["opdata"][-1, self.end_index] -= num_copies * num_instr
+        return instr.reshape(-1)
+
+    def __len__(self):
+        return -(-self.num_points // self.chunk_size)
+
+    # chunks are compiled when they're loaded, which is much faster than loading them
+    def __getitem__(self, k):
+        start = k*self.chunk_size
+        return self.unroll(self.plan.compile_points(start, min(start+self.chunk_size, self.num_points))).tolist()
+
+    def load_size(self, k):
+        return min(self.chunk_size, self.num_points - k*self.chunk_size)
+
+    def position(self, k):
+        return k*self.chunk_size
@@ -0,0 +1,190 @@
+import os
+import mmap
+import logging
+import tempfile
+import numpy as np
+
+# Ring buffer of scan cycles in a memory-mapped file, for processes (e.g. the camera program) that
+# tag their data with the scan values of every cycle as it runs, without a connection or a file
+# read per cycle. Layout, all little endian:
+#   header (header_size bytes): see header_dtype; "count" is the number of records published so far,
+#     it only grows, also across scans and when the ring is opened again with the same layout
+#   capacity records of record_dtype(max_columns): record n is in slot n % capacity
+# A record is written as: seq = 2n+1, fields, seq = 2n+2, then header count = n+1. A reader copies a
+# record and accepts it if seq is 2n+2 in the copy and also when it's read again after copying
+# (RingReader does this). Flags of a cycle that turns out to be late afterwards are updated in place.
+magic = b"SCRING" # padded with zeros to 8 bytes
+version = 1
+header_size = 512
+default_capacity = 4096
+default_max_columns = 16
+# /dev/shm keeps the file in memory on Linux
+default_path = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "pulseblaster_scan.ring")
+
+header_dtype = np.dtype([("magic", "S8"), ("version", "<u4"), ("header_size", "<u4"), ("capacity", "<u4"),
+                         ("max_columns", "<u4"), ("record_size", "<u4"), ("columns", "<u4"), # columns of the current scan
+                         ("scan", "<u8"), # scans started
+                         ("count", "<u8"), # records published
+                         ("first", "<u8"), # record of the first cycle of the current scan
+                         ("scanning", "<u4"), ("reserved", "<u4"),
+                         ("file", "S256")]) # sequence file of the current scan, without extension
+
+
+def record_dtype(max_columns):
+    # times are time.perf_counter() seconds, NaN where there was none; values in ns, NaN after the scan's columns
+    return np.dtype([("seq", "<u8"), ("cycle", "<i8"), ("position", "<i8"), ("flags", "<u4"), ("reserved", "<u4"),
+                     ("trigger", "<f8"), ("program_start", "<f8"), ("program_end", "<f8"),
+                     ("values", "<f8", (max_columns,))])
+
+
+def map_header(buffer):
+    return np.ndarray((), header_dtype, buffer=buffer)
+
+
+def map_records(buffer, capacity, max_columns):
+    return np.ndarray((capacity,), record_dtype(max_columns), buffer=buffer, offset=header_size)
+
+
+class ScanRing:
+    """Writer of the ring buffer, an observer of scan engines (see scan_engine.py).
+
+    Records are written on the scan's worker thread, right after the cycle's load. A scan with
+    more than max_columns scanned instructions publishes its first max_columns values.
+    """
+
+    def __init__(self, path=default_path, capacity=default_capacity, max_columns=default_max_columns):
+        self.path = path
+        self.capacity = capacity
+        self.max_columns = max_columns
+        size = header_size + capacity*record_dtype(max_columns).itemsize
+        # an existing ring of the same layout is reused, so readers that have it mapped keep working
+        mode = "r+b" if os.path.exists(path) else "w+b"
+        with open(path, mode) as f:
+            if os.fstat(f.fileno()).st_size != size:
+                f.truncate(size)
+            self.mmap = mmap.mmap(f.fileno(), size)
+        self.header = map_header(self.mmap)
+        self.records = map_records(self.mmap, capacity, max_columns)
+        if not self.same_layout():
+            self.records[...] = np.zeros((), self.records.dtype)
+            self.header[...] = np.zeros((), header_dtype)
+            self.header["capacity"] = capacity
+            self.header["max_columns"] = max_columns
+            self.header["record_size"] = self.records.dtype.itemsize
+            self.header["header_size"] = header_size
+            self.header["version"] = version
+            self.header["magic"] = magic
+        self.header["scanning"] = 0
+        # fields written for every cycle
+        self.seq = self.records["seq"]
+        self.cycle = self.records["cycle"]
+        self.position = self.records["position"]
+        self.flags = self.records["flags"]
+        self.trigger = self.records["trigger"]
+        self.program_start = self.records["program_start"]
+        self.program_end = self.records["program_end"]
+        self.values = self.records["values"]
+        self.count = int(self.header["count"])
+        self.first = self.count
+        self.columns = 0
+
+    def same_layout(self):
+        header = self.header
+        return (header["magic"] == magic and header["version"] == version and header["header_size"] == header_size
+                and header["capacity"] == self.capacity and header["max_columns"] == self.max_columns
+                and header["record_size"] == self.records.dtype.itemsize)
+
+    def close(self):
+        # views have to go before the map is closed
+        for name in ("header", "records", "seq", "cycle", "position", "flags", "trigger", "program_start",
+                     "program_end", "values"):
+            setattr(self, name, None)
+        self.mmap.close()
+
+    def scan_started(self, engine):
+        columns = len(engine.plan.instr_index)
+        if columns > self.max_columns:
+            logging.warning("(ScanRing) %d scanned instructions, only the first %d are published." % (columns, self.max_columns))
+        self.columns = min(columns, self.max_columns)
+        self.first = self.count
+        self.header["file"] = engine.file_name.encode("utf-8")[:header_dtype["file"].itemsize]
+        self.header["columns"] = self.columns
+        self.header["first"] = self.first
+        self.header["scan"] += 1
+        self.header["scanning"] = 1
+
+    def scan_cycle(self, engine, cycle, position, flags, times):
+        n = self.first + cycle
+        slot = n % self.capacity
+        if times is None:
+            # a late cycle, if it hasn't been overwritten yet
+            if self.count - n <= self.capacity and self.cycle[slot] == cycle:
+                self.flags[slot] = flags
+            return
+        values = engine.plan.sequence.values(position)
+        self.seq[slot] = 2*n + 1
+        self.cycle[slot] = cycle
+        self.position[slot] = position
+        self.flags[slot] = flags
+        self.trigger[slot] = np.nan if times[0] is None else times[0]
+        self.program_start[slot] = np.nan if times[1] is None else times[1]
+        self.program_end[slot] = np.nan if times[2] is None else times[2]
+        row = self.values[slot]
+        row[:self.columns] = values[:self.columns]
+        row[self.columns:] = np.nan
+        self.seq[slot] = 2*n + 2
+        self.count = n + 1
+        self.header["count"] = self.count
+
+    def scan_stopped(self, engine):
+        self.header["scanning"] = 0
+
+
+class RingReader:
+    """Reader of a ring buffer written by ScanRing, e.g. in another process.
+
+    header and records are read-only views of the shared memory; read() copies records that
+    were completely written.
+    """
+
+    def __init__(self, path=default_path):
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = map_header(self.mmap)
+        if self.header["magic"] != magic or self.header["version"] != version:
+            raise ValueError("Not a scan ring buffer: " + path)
+        self.capacity = int(self.header["capacity"])
+        self.records = map_records(self.mmap, self.capacity, int(self.header["max_columns"]))
+
+    @property
+    def count(self):
+        return int(self.header["count"])
+
+    def read(self, start):
+        # records from number start on, return them and the number to start the next read with;
+        # records that have been overwritten already are left out
+        count = self.count
+        start = max(start, count - self.capacity)
+        numbers = np.arange(start, count, dtype=np.uint64)
+        slots = numbers % self.capacity
+        records = self.records[slots]
+        # seq is copied first, a record overwritten while it was copied only shows in seq read again afterwards
+        seq = self.records["seq"][slots]
+        expected = 2*numbers + 2
+        return records[(records["seq"] == expected) & (seq == expected)], count
+
+    def latest(self):
+        # the last record published, None if there's none
+        while True:
+            count = self.count
+            if count == 0:
+                return None
+            slot = (count-1) % self.capacity
+            record = self.records[slot].copy()
+            if record["seq"] == 2*count and self.records["seq"][slot] == 2*count:
+                return record
+
+    def close(self):
+        self.header = None
+        self.records = None
+        self.mmap.close()
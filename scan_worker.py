@@ -0,0 +1,225 @@
+import time
+import array
+import queue
+import statistics
+import threading
+import collections
+import numpy as np
+from cycle_log import cycle_late, cycle_repeat, cycle_missed, cycle_duplicate, cycle_gap
+
+period_window = 32 # the expected cycle period is the median of this many intervals between triggers
+min_intervals = 8 # triggers aren't checked before this many intervals are known
+missed_factor = 1.5 # an interval this many periods long may have missed a trigger
+duplicate_factor = 0.5 # a trigger within this many periods of the one before is a duplicate edge
+
+
+class ScanWorker(threading.Thread):
+    """Hardware worker thread of a scan.
+
+    Triggers (e.g. from the DAQ driver's callback thread) only put a timestamp into a queue;
+    this thread takes them in order and loads the next element of a ScanPlan (or
+    UnrolledScanPlan) with a BoardLoader. When one load covers several scan points, triggers
+    in between only advance the point counter. It never touches Tk widgets, the GUI reads
+    points and finished at its own display rate. Timestamps of every triggered load go to
+    log, a CycleLog (see cycle_log.py), if one is set.
+
+    Triggers are checked against the expected cycle period: a trigger that comes much too
+    soon is a duplicate edge and is ignored. A long gap may mean triggers were missed and the
+    board ran its program again without being loaded, but host scheduling alone can delay a
+    trigger that much; missed cycles are only added if the trigger source counted their edges
+    (see triggers.py), otherwise the cycle after the gap is flagged. A load that ended after the board went
+    on (board status, or the next trigger came before the load ended) leaves a cycle with
+    unknown scan values; its point is loaded again after the last one, at most max_requeue
+    times. The point run in every cycle and what happened to it are kept in executed order.
+
+    Functions in listeners are called on this thread for every cycle, as listener(cycle,
+    position, flags, times) with times (trigger, program start, program end) in
+    time.perf_counter() seconds (None where there was none); a cycle that's found to be late
+    afterwards is passed again with its new flags and times None.
+    """
+
+    def __init__(self, loader, plan, log=None, max_requeue=3, missed_factor=missed_factor,
+                 duplicate_factor=duplicate_factor):
+        super().__init__(daemon=True)
+        self.loader = loader
+        self.plan = plan
+        self.log = log
+        self.max_requeue = max_requeue
+        self.missed_factor = missed_factor
+        self.duplicate_factor = duplicate_factor
+        self.counter = 0 # number of plan elements that have been loaded
+        self.points = 0 # number of scan points that have been reached, the last one is loaded and about to run
+        self.skip = 0 # number of triggers before the next load
+        self.finished = False # True when the last loaded point has been run
+        self.late = 0 # triggers that arrived while the previous one was still handled, i.e. dropped cycles
+        self.missed = 0 # cycles without a trigger
+        self.duplicates = 0 # ignored triggers
+        self.gaps = 0 # long intervals between triggers without missed edges counted, or no count
+        self.busy_until = 0.0 # when programming of the last load ended, a trigger before it means the load was late
+        self.triggers = queue.SimpleQueue()
+
+        self.element = None # plan element loaded last
+        self.position = None # position in the scan sequence of the point about to run
+        self.positions = array.array("q") # position of the point run in every cycle, in executed order
+        self.flags = bytearray() # cycle_* flags of every cycle
+        self.loaded_cycle = None # cycle whose point was written by the last load, with its log row
+        self.loaded_row = None
+        self.requeue = collections.deque() # plan elements to load again after the last one
+        self.requeued = 0
+        self.retries = collections.Counter()
+        self.intervals = collections.deque(maxlen=period_window)
+        self.last_trigger = None
+        self.last_edges = 0 # edges counted by the trigger source up to the last trigger
+        self.listeners = []
+
+    # load the next scan point, also used to load the first point before board starts
+    def load_next(self, trigger_time=None, flags=0):
+        if self.skip > 0:
+            # board goes on to the next scan point already in its memory
+            self.skip -= 1
+            self.points += 1
+            self.position += 1
+            self.add_cycle(trigger_time, flags)
+            return
+        k = self.next_element()
+        if k is None:
+            # this trigger comes from the last scan point
+            self.finished = True
+            return
+        written = self.loader.written
+        if not self.loader.load(self.plan[k], trigger_time):
+            # the board runs the program it holds again, the point is loaded with the next trigger
+            self.add_cycle(trigger_time, flags | cycle_repeat)
+            return
+        if k == self.counter:
+            self.counter += 1
+        else:
+            self.requeue.popleft()
+        self.element = k
+        self.skip = self.plan.load_size(k) - 1
+        self.points += 1
+        self.position = self.plan.position(k)
+        if self.loader.last_program_start is None:
+            self.loaded_cycle = None
+            self.add_cycle(trigger_time, flags)
+            return
+        # listeners run after this, they don't delay the board
+        self.busy_until = self.loader.last_load_end
+        self.loaded_cycle = len(self.flags)
+        self.loaded_row = self.add_cycle(trigger_time, flags, self.loader.last_program_start,
+                                         self.loader.last_load_end, self.loader.written-written)
+        if self.loader.last_late:
+            self.mark_late()
+
+    # plan element to load next, None if all are done
+    def next_element(self):
+        if self.counter < len(self.plan):
+            return self.counter
+        if self.requeue:
+            return self.requeue[0]
+        return None
+
+    # add a cycle running the point at self.position, return its log row (None if not logged)
+    def add_cycle(self, trigger_time, flags, program_start=None, program_end=None, written=0):
+        if self.position is None:
+            return None
+        self.positions.append(self.position)
+        self.flags.append(flags)
+        for listener in self.listeners:
+            listener(len(self.flags)-1, self.position, flags, (trigger_time, program_start, program_end))
+        return self.record(trigger_time, flags, program_start, program_end, written)
+
+    def record(self, trigger_time, flags=0, program_start=None, program_end=None, written=0):
+        if self.log is not None and (trigger_time is not None or flags & cycle_missed):
+            return self.log.record(self.position, trigger_time, program_start, program_end, written, flags)
+        return None
+
+    # the point of the last load didn't run as loaded, scan it again at the end
+    def mark_late(self):
+        if self.loaded_cycle is None or self.flags[self.loaded_cycle] & cycle_late:
+            return
+        self.flags[self.loaded_cycle] |= cycle_late
+        if self.log is not None and self.loaded_row is not None:
+            self.log.add_flags(self.loaded_row, cycle_late)
+        for listener in self.listeners:
+            listener(self.loaded_cycle, self.positions[self.loaded_cycle], self.flags[self.loaded_cycle], None)
+        # a load of several points can't be repeated for one of them
+        k = self.element
+        if self.plan.load_size(k) == 1 and self.retries[k] < self.max_requeue:
+            self.retries[k] += 1
+            self.requeue.append(k)
+            self.requeued += 1
+
+    # cycles the board ran without triggering the host
+    def add_missed(self, num_cycles):
+        for i in range(num_cycles):
+            self.missed += 1
+            if self.skip > 0:
+                # the board went on to the next point in its memory
+                self.skip -= 1
+                self.points += 1
+                self.position += 1
+                self.add_cycle(None, cycle_missed)
+            elif self.element is not None:
+                # and back to the first point it holds
+                self.position = self.plan.position(self.element)
+                self.add_cycle(None, cycle_missed | cycle_repeat)
+
+    def expected_period(self):
+        if len(self.intervals) < min_intervals:
+            return None
+        return statistics.median(self.intervals)
+
+    # compare a trigger with the expected period and the edges counted by the trigger source
+    # (None if it can't count them), return flags of the new cycle, None if it isn't one
+    def check_trigger(self, trigger_time, edges=None):
+        interval = None if self.last_trigger is None else trigger_time - self.last_trigger
+        period = self.expected_period()
+        # edges between this trigger and the one before whose triggers never arrived
+        missed = None if edges is None else edges - self.last_edges - 1
+        if edges is not None:
+            # a count read late may include the next edge already, it's never counted twice
+            self.last_edges = max(self.last_edges, edges)
+        if period is not None and interval < self.duplicate_factor*period:
+            self.duplicates += 1
+            self.record(trigger_time, cycle_duplicate)
+            return None
+        if trigger_time < self.busy_until:
+            # the board finished a cycle before the last load ended
+            self.late += 1
+            if self.loaded_cycle == len(self.flags) - 1:
+                self.mark_late()
+        flags = 0
+        if period is not None and interval > self.missed_factor*period:
+            # the board only ran cycles in between if their edges were counted
+            if missed is not None and missed > 0:
+                self.add_missed(min(missed, round(interval/period) - 1))
+            else:
+                self.gaps += 1
+                flags = cycle_gap
+        if interval is not None:
+            # every interval counts, so the period follows a change of the cycle rate
+            self.intervals.append(interval)
+        self.last_trigger = trigger_time
+        return flags
+
+    # positions and flags of every cycle, in executed order
+    def executed(self):
+        return np.array(self.positions, dtype=np.int64), np.frombuffer(bytes(self.flags), dtype=np.uint8)
+
+    # safe to call from any thread; edges: number of edges the trigger source counted, this one included
+    def trigger(self, edges=None):
+        self.triggers.put((time.perf_counter(), edges))
+
+    def stop(self):
+        self.triggers.put(None)
+
+    def run(self):
+        while not self.finished:
+            trigger = self.triggers.get()
+            if trigger is None:
+                break
+            trigger_time, edges = trigger
+            flags = self.check_trigger(trigger_time, edges)
+            if flags is not None:
+                self.load_next(trigger_time, flags)
@@ -0,0 +1,83 @@
+import json
+import struct
+import configparser
+import numpy as np
+
+# Scan sequence file: magic, data offset (uint32, little endian), JSON header, zero padding, then
+# all scan values as little endian float64, one row per sequence element and one column per
+# scanned instruction (C order). Data starts at a multiple of 64 bytes, so consumers can
+# memory-map it, e.g. np.memmap(file, dtype='<f8', mode='r', offset=offset, shape=header["shape"]).
+magic = b"SCSEQ\x00"
+data_alignment = 64
+file_ext = ".seq"
+chunk_size = 65536 # rows generated and written at a time
+
+
+# rows of scan values, in chunks, from an array or a lazily generated sequence (see scan_order.py)
+def iter_rows(scan_param):
+    if isinstance(scan_param, np.ndarray):
+        yield scan_param
+        return
+    for start in range(0, len(scan_param), chunk_size):
+        yield scan_param.rows(start, min(start+chunk_size, len(scan_param)))
+
+
+def write_sequence(file_name, scan_param, columns, settings):
+    # scan_param: 2-dim array or sequence, in ns; columns: name of each column; settings: dict saved in header
+    header = dict(settings)
+    header["columns"] = list(columns)
+    header["dtype"] = "<f8"
+    header["shape"] = list(scan_param.shape)
+    text = json.dumps(header).encode("utf-8")
+    offset = len(magic) + 4 + len(text)
+    offset += -offset % data_alignment
+
+    with open(file_name, "wb") as f:
+        f.write(magic)
+        f.write(struct.pack("<I", offset))
+        f.write(text)
+        f.write(b"\x00" * (offset - len(magic) - 4 - len(text)))
+        for rows in iter_rows(scan_param):
+            np.ascontiguousarray(rows, dtype='<f8').tofile(f)
+
+
+def read_header(file_name):
+    with open(file_name, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("Not a scan sequence file: " + file_name)
+        offset = struct.unpack("<I", f.read(4))[0]
+        text = f.read(offset - len(magic) - 4).rstrip(b"\x00")
+    header = json.loads(text.decode("utf-8"))
+    header["data offset"] = offset
+    return header
+
+
+def read_sequence(file_name, mmap=True):
+    # return header and scan values, memory-mapped (read only) unless mmap is False
+    header = read_header(file_name)
+    shape = tuple(header["shape"])
+    if mmap:
+        data = np.memmap(file_name, dtype=header["dtype"], mode='r', offset=header["data offset"], shape=shape)
+    else:
+        data = np.fromfile(file_name, dtype=header["dtype"], offset=header["data offset"]).reshape(shape)
+    return header, data
+
+
+def write_legacy_ini(file_name, scan_param, columns, settings):
+    # the old format, one section per sequence element
+    config = configparser.ConfigParser()
+    config.optionxform = str
+
+    config["Settings"] = {}
+    for key, value in settings.items():
+        config["Settings"][key] = str(value)
+    i = 0
+    for rows in iter_rows(scan_param):
+        for row in rows.tolist():
+            config[f"Sequence element {i}"] = {}
+            for j in range(len(columns)):
+                config[f"Sequence element {i}"][columns[j]] = str(row[j])
+            i += 1
+    configfile = open(file_name, "w")
+    config.write(configfile)
+    configfile.close()
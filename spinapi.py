@@ -20,20 +20,12 @@
 # misrepresented as being the original software.
 # 3. This notice may not be removed or altered from any source distribution.
 
+import os
 import ctypes
 
 PULSE_PROGRAM = 0
 FREQ_REGS = 1
 
-try:
-	spinapi = ctypes.CDLL("spinapi64")
-except:
-	try:
-		spinapi = ctypes.CDLL("spinapi")
-	except:
-		print("Failed to load spinapi library.")
-		pass
-
 
 
 def f(x):
@@ -63,54 +55,123 @@ Inst = enum(
 	WAIT = 8,
 	RTI = 9
 )
-spinapi.pb_get_version.restype = (ctypes.c_char_p)
-spinapi.pb_get_error.restype = (ctypes.c_char_p)
-
-spinapi.pb_count_boards.restype = (ctypes.c_int)
-
-spinapi.pb_init.restype = (ctypes.c_int)
-
-spinapi.pb_select_board.argtype = (ctypes.c_int)
-spinapi.pb_select_board.restype = (ctypes.c_int)
-
-spinapi.pb_set_debug.argtype = (ctypes.c_int)
-spinapi.pb_set_debug.restype = (ctypes.c_int)
-
-spinapi.pb_set_defaults.restype = (ctypes.c_int)
-
-spinapi.pb_core_clock.argtype = (ctypes.c_double)
-spinapi.pb_core_clock.restype = (ctypes.c_int)
 
-spinapi.pb_write_register.argtype = (ctypes.c_int, ctypes.c_int)
-spinapi.pb_write_register.restype = (ctypes.c_int)
-
-spinapi.pb_start_programming.argtype = (ctypes.c_int)
-spinapi.pb_start_programming.restype = (ctypes.c_int)
-
-spinapi.pb_stop_programming.restype = (ctypes.c_int)
-
-spinapi.pb_start.restype = (ctypes.c_int)
-spinapi.pb_stop.restype = (ctypes.c_int)
-spinapi.pb_reset.restype = (ctypes.c_int)
-spinapi.pb_close.restype = (ctypes.c_int)
-
-spinapi.pb_inst_dds2.argtype = (
-	ctypes.c_int, #Frequency register DDS0
-	ctypes.c_int, #Phase register DDS0
-	ctypes.c_int, #Amplitude register DDS0
-	ctypes.c_int, #Output enable DDS0
-	ctypes.c_int, #Phase reset DDS0
-	ctypes.c_int, #Frequency register DDS1
-	ctypes.c_int, #Phase register DDS1
-	ctypes.c_int, #Amplitude register DDS1
-	ctypes.c_int, #Output enable DDS1,
-	ctypes.c_int, #Phase reset DDS1,
-	ctypes.c_int, #Flags
-	ctypes.c_int, #inst
-	ctypes.c_int, #inst data
-	ctypes.c_double, #timing value (double)
-)
-spinapi.pb_inst_dds2.restype = (ctypes.c_int)
+def load_library():
+	"""Load SpinAPI library, return None if it can't be found."""
+	try:
+		return ctypes.CDLL("spinapi64")
+	except:
+		try:
+			return ctypes.CDLL("spinapi")
+		except:
+			print("Failed to load spinapi library.")
+			return None
+
+def declare_types(lib):
+	lib.pb_get_version.restype = (ctypes.c_char_p)
+	lib.pb_get_error.restype = (ctypes.c_char_p)
+
+	lib.pb_count_boards.restype = (ctypes.c_int)
+
+	lib.pb_init.restype = (ctypes.c_int)
+
+	lib.pb_select_board.argtypes = (ctypes.c_int,)
+	lib.pb_select_board.restype = (ctypes.c_int)
+
+	lib.pb_set_debug.argtypes = (ctypes.c_int,)
+	lib.pb_set_debug.restype = (ctypes.c_int)
+
+	lib.pb_set_defaults.restype = (ctypes.c_int)
+
+	lib.pb_core_clock.argtypes = (ctypes.c_double,)
+	lib.pb_core_clock.restype = (ctypes.c_int)
+
+	lib.pb_write_register.argtypes = (ctypes.c_int, ctypes.c_int)
+	lib.pb_write_register.restype = (ctypes.c_int)
+
+	lib.pb_start_programming.argtypes = (ctypes.c_int,)
+	lib.pb_start_programming.restype = (ctypes.c_int)
+
+	lib.pb_stop_programming.restype = (ctypes.c_int)
+
+	lib.pb_start.restype = (ctypes.c_int)
+	lib.pb_stop.restype = (ctypes.c_int)
+	lib.pb_reset.restype = (ctypes.c_int)
+	lib.pb_close.restype = (ctypes.c_int)
+
+	lib.pb_inst_dds2.argtypes = (
+		ctypes.c_int, #Frequency register DDS0
+		ctypes.c_int, #Phase register DDS0
+		ctypes.c_int, #Amplitude register DDS0
+		ctypes.c_int, #Output enable DDS0
+		ctypes.c_int, #Phase reset DDS0
+		ctypes.c_int, #Frequency register DDS1
+		ctypes.c_int, #Phase register DDS1
+		ctypes.c_int, #Amplitude register DDS1
+		ctypes.c_int, #Output enable DDS1,
+		ctypes.c_int, #Phase reset DDS1,
+		ctypes.c_int, #Flags
+		ctypes.c_int, #inst
+		ctypes.c_int, #inst data
+		ctypes.c_double, #timing value (double)
+	)
+	lib.pb_inst_dds2.restype = (ctypes.c_int)
+
+	lib.pb_inst_pbonly.argtypes = (
+		ctypes.c_ulong, #Output Pattern for each channel
+		ctypes.c_long, #Inst code
+		ctypes.c_long, #Inst data
+		ctypes.c_double, #timing value (double)
+	)
+	lib.pb_inst_pbonly.restype = (ctypes.c_int)
+
+	lib.pb_read_status.restype = (ctypes.c_int)
+
+class LazyBackend:
+	"""Stand-in for a backend that's only loaded when a pb_* function is first called, so
+	importing this module doesn't load the SpinAPI library. If it can't be loaded, every call
+	raises OSError and loading is tried again next time."""
+
+	def __init__(self, backend):
+		self.backend = backend
+
+	def __getattr__(self, name):
+		loaded = use_backend(self.backend)
+		if loaded is None:
+			use_backend(self)
+			raise OSError("Failed to load spinapi library.")
+		return getattr(loaded, name)
+
+def use_backend(backend, lazy=False):
+	"""Select what the pb_* functions below talk to.
+
+	backend is "dll" for the SpinAPI library, "emulator" for a software PulseBlasterUSB (see
+	pb_emulator.py), or any object that provides the SpinAPI C functions. With lazy=True, the
+	library or emulator is only loaded when it's first used. Return the backend object.
+	"""
+	global spinapi
+	if lazy:
+		spinapi = LazyBackend(backend)
+	elif backend == "dll":
+		spinapi = load_library()
+		if spinapi is not None:
+			declare_types(spinapi)
+	elif backend == "emulator":
+		from pb_emulator import PulseBlasterEmulator
+		# number of emulated boards can be set with environment variable SPINAPI_EMULATED_BOARDS
+		spinapi = PulseBlasterEmulator(int(os.environ.get("SPINAPI_EMULATED_BOARDS", "1")))
+	else:
+		spinapi = backend
+	return spinapi
+
+def get_backend():
+	"""Return the backend object, loading it if it hasn't been used yet."""
+	if isinstance(spinapi, LazyBackend):
+		return use_backend(spinapi.backend)
+	return spinapi
+
+# the backend can be chosen with environment variable SPINAPI_BACKEND, e.g. to run without a board
+use_backend(os.environ.get("SPINAPI_BACKEND", "dll"), lazy=True)
 
 def pb_get_version():
 	"""Return library version as UTF-8 encoded string."""
@@ -142,7 +203,7 @@ def pb_set_defaults():
 	return spinapi.pb_set_defaults()
 
 def pb_core_clock(clock):
-	return spinapi.pb_core_clock(ctypes.c_double(clock))
+	return spinapi.pb_core_clock(clock)
 
 def pb_write_register(address, value):
 	return spinapi.pb_write_register(address, value)
@@ -154,10 +215,7 @@ def pb_stop_programming():
 	return spinapi.pb_stop_programming()
 
 def pb_inst_dds2(*args):
-	t = list(args)
-	#Argument 13 must be a double
-	t[13] = ctypes.c_double(t[13])
-	args = tuple(t)
+	#Argument 13 is converted to a double by argtypes
 	return spinapi.pb_inst_dds2(*args)
 
 def pb_start():
@@ -174,16 +232,49 @@ def pb_close():
 
 
 # Following codes are added by Qian on July 24, 2020, to program SpinCore PulseBlasterUSB
-def pb_inst_pbonly(*args):
-    t = list(args)
-    t[3] = ctypes.c_double(t[3])
-    args = tuple(t)
-    return spinapi.pb_inst_pbonly(*args)
-
-spinapi.pb_inst_pbonly.argtype = (
-	ctypes.c_ulong, #Output Pattern for each channel
-	ctypes.c_long, #Inst code
-	ctypes.c_long, #Inst data
-	ctypes.c_double, #timing value (double)
-)
-spinapi.pb_inst_pbonly.restype = (ctypes.c_int)
+# argtypes are declared in declare_types(), so arguments are converted to C types by ctypes itself
+def pb_inst_pbonly(flags, inst, inst_data, length):
+	return spinapi.pb_inst_pbonly(flags, inst, inst_data, length)
+
+# Bits of the value returned by pb_read_status()
+STATUS_STOPPED = 1
+STATUS_RESET = 2
+STATUS_RUNNING = 4
+STATUS_WAITING = 8
+
+def pb_read_status():
+	"""Return board status, see STATUS_* bits."""
+	return spinapi.pb_read_status()
+
+def pb_prepare_pbonly(instr):
+	"""Convert an instruction list (or array) to the arguments pb_program_pbonly() passes to the backend.
+
+	For the SpinAPI library these are ctypes values, which ctypes passes on without converting
+	them again, so a prepared list can be reused for every load of the same program.
+	"""
+	if hasattr(instr, "tolist"):
+		instr = instr.tolist()
+	if isinstance(get_backend(), ctypes.CDLL):
+		return [(ctypes.c_ulong(flags), ctypes.c_long(inst), ctypes.c_long(inst_data), ctypes.c_double(length))
+			for flags, inst, inst_data, length in instr]
+	return [tuple(args) for args in instr]
+
+def pb_program_pbonly(instr, target=PULSE_PROGRAM):
+	"""Program a whole instruction list in one go.
+
+	instr is a list of (flags, inst, inst data, length) tuples or an array with these fields,
+	e.g. a compiled PulseProgram, or a list prepared by pb_prepare_pbonly(). Return 0 on
+	success, or the negative error code of the first call that failed (see pb_get_error()).
+	"""
+	if hasattr(instr, "tolist"):
+		instr = instr.tolist()
+	inst_pbonly = spinapi.pb_inst_pbonly
+	ret = spinapi.pb_start_programming(target)
+	if ret < 0:
+		return ret
+	for flags, inst, inst_data, length in instr:
+		ret = inst_pbonly(flags, inst, inst_data, length)
+		if ret < 0:
+			spinapi.pb_stop_programming()
+			return ret
+	return spinapi.pb_stop_programming()
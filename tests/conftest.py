@@ -0,0 +1,6 @@
+import os
+import sys
+
+# modules are at the top of the repository, tests run on the emulated board
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SPINAPI_BACKEND", "emulator")
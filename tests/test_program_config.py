@@ -0,0 +1,60 @@
+import json
+import random
+import numpy as np
+import pytest
+from pulse_program import PulseProgram, channel_num, duration_unit, opcodes
+from program_config import write_config, read_config, config_to_dict, config_from_dict, config_version
+
+scanner_settings = {"sample number": "10,3", "repetition": "20", "scanned instructions": [
+    {"instr no.": "0", "start duration": "1", "start unit": "ms", "end duration": "10", "end unit": "ms", "axis": "0"},
+    {"instr no.": "2", "start duration": "5", "start unit": "us", "end duration": "50", "end unit": "ns", "axis": "1"}]}
+
+
+def random_program(num_instr, num_boards, seed=0):
+    rng = random.Random(seed)
+    program = PulseProgram(num_instr, num_boards)
+    for i in range(num_instr):
+        for ch in rng.sample(range(program.num_channels), 5):
+            program.set_output(i, ch, 1)
+        program.set_opcode(i, rng.randrange(len(opcodes)))
+        program.set_opdata(i, rng.randrange(num_instr))
+        program.set_duration(i, rng.choice([0.5, 1.0, 12.25, 999.0]), rng.randrange(len(duration_unit)))
+        program.set_note(i, rng.choice(["", "cooling", "détection, \"quoted\""]))
+    program.channel_labels = ["device %d" % ch for ch in range(program.num_channels)]
+    return program
+
+
+def assert_same_program(a, b):
+    assert a.num_boards == b.num_boards
+    assert a.instr.tolist() == b.instr.tolist()
+    assert np.array_equal(a.board_flags, b.board_flags)
+    assert np.array_equal(a.unit, b.unit)
+    assert a.notes == b.notes
+    assert a.channel_labels == b.channel_labels
+
+
+@pytest.mark.parametrize("num_boards", [1, 2, 3])
+def test_round_trip(tmp_path, num_boards):
+    program = random_program(300, num_boards)
+    file_name = str(tmp_path / "config.json")
+    write_config(file_name, program, scanner_settings)
+    new, settings = read_config(file_name)
+    assert_same_program(program, new)
+    assert settings == scanner_settings
+
+
+def test_channels_of_other_boards_are_kept():
+    program = PulseProgram(2, 2)
+    program.set_output(1, channel_num + 3, 1)
+    config = json.loads(json.dumps(config_to_dict(program, scanner_settings)))
+    new, settings = config_from_dict(config)
+    assert new.output(1, channel_num + 3) == 1
+    assert new.pattern(1) == 1 << (channel_num + 3)
+
+
+def test_other_files_and_newer_versions_are_refused():
+    config = config_to_dict(PulseProgram(1), scanner_settings)
+    with pytest.raises(ValueError):
+        config_from_dict(dict(config, format="something else"))
+    with pytest.raises(ValueError):
+        config_from_dict(dict(config, version=config_version + 1))
@@ -0,0 +1,83 @@
+import random
+import numpy as np
+import pytest
+from pulse_program import instr_dtype, opcodes
+from pb_emulator import simulate, merge_timeline
+from program_factoring import factor
+
+CONTINUE = opcodes.index("CONTINUE")
+LOOP = opcodes.index("LOOP")
+JSR = opcodes.index("JSR")
+WAIT = opcodes.index("WAIT")
+BRANCH = opcodes.index("BRANCH")
+triggers = 5
+
+
+def program(rows):
+    return np.array(rows + [(0, WAIT, 0, 100.0), (0, BRANCH, 0, 100.0)], dtype=instr_dtype)
+
+
+def block(flags, length):
+    return [(flags + j, CONTINUE, 0, 100.0*(j+1)) for j in range(length)]
+
+
+def random_program(rng):
+    # copies of a few random blocks, consecutive and apart, with single instructions in between
+    blocks = [block(rng.randrange(8), rng.randint(2, 5)) for i in range(3)]
+    rows = []
+    for i in range(rng.randint(3, 12)):
+        if rng.random() < 0.3:
+            rows.append((rng.randrange(8), CONTINUE, 0, float(rng.randrange(50, 1000))))
+        else:
+            rows.extend(rng.choice(blocks) * rng.randint(1, 4))
+    return program(rows)
+
+
+def assert_same_output(instr, new):
+    timeline, status = simulate(instr, triggers)
+    new_timeline, new_status = simulate(new, triggers)
+    a, b = merge_timeline(timeline), merge_timeline(new_timeline)
+    assert status == new_status
+    assert len(a) == len(b)
+    assert (a["flags"] == b["flags"]).all()
+    assert np.allclose(a["duration"], b["duration"])
+    assert np.allclose(a["time"], b["time"])
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_factored_program_has_the_same_output(seed):
+    # without the emulator check in factor(), so a wrong rewrite isn't hidden by falling back
+    rng = random.Random(seed)
+    instr = random_program(rng)
+    keep = rng.sample(range(len(instr)-2), 2)
+    new, address_map = factor(instr, keep=keep, verify=False)
+    assert len(new) <= len(instr)
+    assert_same_output(instr, new)
+    # kept instructions are left as they are, and scanning them changes both programs alike
+    for k in keep:
+        assert new[address_map[k]].tolist() == instr[k].tolist()
+        instr["duration"][k] = new["duration"][address_map[k]] = 7777.0
+    assert_same_output(instr, new)
+
+
+def test_consecutive_copies_become_a_loop():
+    instr = program(block(1, 3)*4)
+    new, address_map = factor(instr)
+    assert len(new) == 3 + 2
+    assert new["opcode"][0] == LOOP and new["opdata"][0] == 4
+    assert_same_output(instr, new)
+
+
+def test_copies_apart_become_subroutine_calls():
+    instr = program(block(1, 4) + block(10, 1) + block(1, 4) + block(20, 1) + block(1, 4))
+    new, address_map = factor(instr)
+    assert (new["opcode"] == JSR).sum() == 3
+    assert len(new) < len(instr)
+    assert_same_output(instr, new)
+
+
+def test_kept_instruction_isnt_factored():
+    rows = block(1, 3)*4
+    instr = program(rows)
+    new, address_map = factor(instr, keep=range(len(rows)))
+    assert new.tolist() == instr.tolist()
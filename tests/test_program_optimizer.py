@@ -0,0 +1,85 @@
+import random
+import numpy as np
+import pytest
+from pulse_program import instr_dtype, opcodes
+from pb_emulator import simulate, merge_timeline
+from program_optimizer import optimize, max_cycles
+
+CONTINUE = opcodes.index("CONTINUE")
+LONG_DELAY = opcodes.index("LONG_DELAY")
+WAIT = opcodes.index("WAIT")
+BRANCH = opcodes.index("BRANCH")
+triggers = 5
+
+
+def random_program(rng):
+    # CONTINUE instructions with few output patterns, repeated blocks and very long durations, ending
+    # with WAIT and BRANCH 0 like a scanned program; return it and a scanned CONTINUE
+    # (zero durations are left out, the emulator doesn't take them, see test_merges_and_drops)
+    rows = []
+    while len(rows) < rng.randint(5, 60):
+        if rows and rng.random() < 0.2:
+            start = rng.randrange(len(rows))
+            rows.extend(rows[start:start+rng.randint(1, 6)] * rng.randint(1, 4))
+            continue
+        duration = rng.choice([50.0, 100.0, 1000.0, float(rng.randrange(50, 100000)), 2.0*max_cycles*10.0])
+        rows.append((rng.randrange(4), CONTINUE, 0, duration))
+    scanned = rng.randrange(len(rows))
+    rows[scanned] = (rows[scanned][0], CONTINUE, 0, 1000.0)
+    rows += [(0, WAIT, 0, 100.0), (0, BRANCH, 0, 100.0)]
+    return np.array(rows, dtype=instr_dtype), scanned
+
+
+def output(instr):
+    timeline, status = simulate(instr, triggers)
+    return merge_timeline(timeline), status
+
+
+def assert_same_output(instr, new):
+    (a, status), (b, new_status) = output(instr), output(new)
+    assert status == new_status
+    assert len(a) == len(b)
+    assert (a["flags"] == b["flags"]).all()
+    assert np.allclose(a["duration"], b["duration"])
+    assert np.allclose(a["time"], b["time"])
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_same_output_with_scanned_duration_changed(seed):
+    # the scanned duration is replaced in the optimized program, as a scan does, after optimizing
+    rng = random.Random(seed)
+    instr, scanned = random_program(rng)
+    new, address_map = optimize(instr, keep=[scanned])
+    assert len(new) <= len(instr)
+    assert_same_output(instr, new)
+    for duration in (50.0, 12345.0, 1e7):
+        instr["duration"][scanned] = duration
+        new["duration"][address_map[scanned]] = duration
+        assert_same_output(instr, new)
+
+
+def test_merges_and_drops():
+    instr = np.array([(1, CONTINUE, 0, 100.0), (1, CONTINUE, 0, 200.0), (2, CONTINUE, 0, 0.0),
+                      (2, CONTINUE, 0, 300.0), (0, WAIT, 0, 100.0), (0, BRANCH, 0, 100.0)], dtype=instr_dtype)
+    new, address_map = optimize(instr, factor_repeats=False)
+    assert new.tolist() == [(1, CONTINUE, 0, 300.0), (2, CONTINUE, 0, 300.0), (0, WAIT, 0, 100.0), (0, BRANCH, 0, 100.0)]
+    assert address_map.tolist() == [0, 0, 1, 1, 2, 3, 4]
+
+
+def test_kept_instructions_are_not_merged():
+    instr = np.array([(1, CONTINUE, 0, 100.0), (1, CONTINUE, 0, 200.0), (1, CONTINUE, 0, 0.0),
+                      (0, WAIT, 0, 100.0), (0, BRANCH, 0, 100.0)], dtype=instr_dtype)
+    new, address_map = optimize(instr, keep=[1, 2], factor_repeats=False)
+    assert new.tolist() == instr.tolist()
+
+
+def test_long_continue_becomes_long_delay():
+    # longer than max_cycles cycles at 100 MHz, but not at 50 MHz
+    duration = 1.5*max_cycles*10.0
+    instr = np.array([(1, CONTINUE, 0, duration), (0, WAIT, 0, 100.0), (0, BRANCH, 0, 100.0)], dtype=instr_dtype)
+    new, address_map = optimize(instr, clock=100.0)
+    assert new["opcode"][0] == LONG_DELAY
+    assert (new["duration"] <= max_cycles*10.0).all()
+    assert_same_output(instr, new)
+    new, address_map = optimize(instr, clock=50.0)
+    assert LONG_DELAY not in new["opcode"]
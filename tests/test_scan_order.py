@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import spinapi
+from scan_order import ScanOrder, GridScan, LinearScan
+from board_set import BoardSet
+from scan_engine import ScanEngine
+from benchmark_scan import make_program
+
+
+@pytest.mark.parametrize("length", [1, 2, 3, 7, 64, 65, 1000, 4099])
+def test_order_is_a_permutation(length):
+    order = ScanOrder(length, 1234)
+    elements = order.permute(np.arange(length))
+    assert sorted(elements.tolist()) == list(range(length))
+    # single lookups give the same elements as arrays
+    assert [order[k] for k in range(length)] == elements.tolist()
+
+
+def test_same_seed_same_order():
+    a = ScanOrder(500, 42).permute(np.arange(500))
+    b = ScanOrder(500, 42).permute(np.arange(500))
+    c = ScanOrder(500, 43).permute(np.arange(500))
+    assert (a == b).all()
+    assert (a != c).any()
+
+
+def test_empty_order_is_refused():
+    with pytest.raises(AssertionError):
+        ScanOrder(0, 1)
+
+
+def test_grid_scan_regenerated_from_settings():
+    scan = GridScan([0.0, 10.0, 100.0], [1.0, 20.0, 200.0], [0, 1, 1], [3, 4], 2)
+    settings = scan.settings()
+    again = GridScan([0.0, 10.0, 100.0], [1.0, 20.0, 200.0], settings["column axes"],
+                     settings["axis sample numbers"], settings["repetition"], settings["seed"])
+    assert np.array_equal(scan.rows(0, len(scan)), again.rows(0, len(again)))
+
+
+def test_grid_scan_visits_every_sample_rep_times():
+    scan = GridScan([0.0, 10.0], [1.0, 20.0], [0, 1], [3, 4], 5, seed=7)
+    rows = scan.rows(0, len(scan))
+    assert len(rows) == 3*4*5
+    values, counts = np.unique(rows, axis=0, return_counts=True)
+    assert len(values) == 3*4 and (counts == 5).all()
+    # same values as np.linspace on each axis
+    assert np.allclose(np.unique(rows[:, 0]), np.linspace(0.0, 1.0, 3))
+    assert np.allclose(np.unique(rows[:, 1]), np.linspace(10.0, 20.0, 4))
+    # rows of any positions, one by one or in blocks, agree
+    positions = np.array([5, 0, 59, 17])
+    assert np.array_equal(scan.rows_at(positions), rows[positions])
+    assert all(np.array_equal(scan.values(k), rows[k]) for k in range(len(scan)))
+
+
+def test_linear_scan_moves_columns_together():
+    scan = LinearScan([0.0, 100.0], [10.0, 200.0], 11, 1, seed=3)
+    rows = scan.rows(0, len(scan))
+    assert np.allclose(rows[:, 1], 100.0 + 10.0*rows[:, 0])
+
+
+@pytest.mark.parametrize("sample_number, repetition", [("0", "1"), ("3", "0"), ("2,0", "1")])
+def test_engine_refuses_empty_scans(tmp_path, sample_number, repetition):
+    spinapi.use_backend("emulator")
+    scanned = [{"instr no.": "0", "start duration": "1", "start unit": "us", "end duration": "10", "end unit": "us", "axis": "0"},
+               {"instr no.": "1", "start duration": "1", "start unit": "us", "end duration": "10", "end unit": "us", "axis": "1"}]
+    settings = {"sample number": sample_number, "repetition": repetition, "scanned instructions": scanned}
+    engine = ScanEngine(BoardSet(), make_program(10), settings, str(tmp_path / "scan"))
+    with pytest.raises(ValueError):
+        engine.prepare()
@@ -0,0 +1,95 @@
+import time
+import pytest
+import spinapi
+from benchmark_scan import make_program
+from scan_plan import ScanPlan, UnrolledScanPlan
+from scan_order import LinearScan
+from board_loader import BoardLoader
+from scan_worker import ScanWorker
+from cycle_log import cycle_missed, cycle_gap
+from triggers import EmulatorTrigger
+
+
+def run_scan(rate, num_points, unroll):
+    # scan on the emulated board, return the worker and the number of cycles the board ran
+    emulator = spinapi.use_backend("emulator")
+    cycles = []
+    emulator.wait_callbacks.append(cycles.append)
+    plan = ScanPlan(make_program(20), [0], LinearScan([1000], [100000], num_points, 1))
+    if unroll:
+        plan = UnrolledScanPlan(plan)
+    worker = ScanWorker(BoardLoader(min_guard=0.001), plan)
+    trigger = EmulatorTrigger(emulator, 1.0/rate)
+    spinapi.pb_stop()
+    spinapi.pb_reset()
+    worker.load_next()
+    spinapi.pb_start()
+    worker.start()
+    trigger.start(worker.trigger)
+    deadline = time.perf_counter() + 10*num_points/rate
+    while not worker.finished and time.perf_counter() < deadline:
+        time.sleep(0.0005)
+    # the board is triggered again a period after the last WAIT, stop before that
+    board_cycles = len(cycles)
+    trigger.stop()
+    worker.stop()
+    worker.join(timeout=1)
+    return worker, board_cycles
+
+
+@pytest.mark.parametrize("rate, num_points, unroll", [(50, 200, False), (200, 400, True)])
+def test_executed_rows_match_board_cycles(rate, num_points, unroll):
+    # the emulated board never misses a trigger, host jitter mustn't add or skip cycles
+    worker, board_cycles = run_scan(rate, num_points, unroll)
+    assert worker.finished
+    positions, flags = worker.executed()
+    assert len(positions) == board_cycles
+    assert worker.missed == 0
+    assert not (flags & cycle_missed).any()
+
+
+def check_triggers(worker, times, edges):
+    return [worker.check_trigger(t, e) for t, e in zip(times, edges)]
+
+
+def make_worker():
+    plan = ScanPlan(make_program(20), [0], LinearScan([1000], [100000], 10, 1))
+    return ScanWorker(BoardLoader(), plan)
+
+
+def test_gap_without_edge_count_is_only_flagged():
+    worker = make_worker()
+    times = [0.01*i for i in range(10)] + [0.125]
+    flags = check_triggers(worker, times, [None]*len(times))
+    assert flags[-1] == cycle_gap
+    assert worker.missed == 0 and worker.gaps == 1
+
+
+def test_counted_edges_confirm_missed_cycles():
+    worker = make_worker()
+    worker.load_next()
+    times = [0.01*i for i in range(10)] + [0.12]
+    # two edges between the last two triggers had no callback
+    edges = list(range(1, 11)) + [13]
+    flags = check_triggers(worker, times, edges)
+    assert flags[-1] == 0
+    assert worker.missed == 2 and worker.gaps == 0
+    assert len(worker.positions) == 3
+
+
+def test_gap_with_edges_counted_is_not_a_miss():
+    worker = make_worker()
+    times = [0.01*i for i in range(10)] + [0.125]
+    flags = check_triggers(worker, times, range(1, 12))
+    assert flags[-1] == cycle_gap
+    assert worker.missed == 0
+
+
+def test_cutoffs_are_parameters():
+    plan = ScanPlan(make_program(20), [0], LinearScan([1000], [100000], 10, 1))
+    worker = ScanWorker(BoardLoader(), plan, missed_factor=3.0, duplicate_factor=0.2)
+    times = [0.01*i for i in range(10)] + [0.115, 0.116]
+    flags = check_triggers(worker, times, [None]*len(times))
+    # 2.5 periods isn't a gap, 0.1 periods is a duplicate
+    assert flags[-2] == 0 and flags[-1] is None
+    assert worker.gaps == 0 and worker.duplicates == 1
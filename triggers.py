@@ -0,0 +1,125 @@
+import time
+import random
+import threading
+from pb_emulator import STATUS_WAITING
+
+# A trigger source calls callback(edges) once per experimental cycle, from its own thread, after start(callback)
+# until stop(). edges is the number of trigger edges counted so far, this one included, also those whose
+# callback was lost; None if the source can't count them. emitted counts the triggers it has sent.
+
+
+class DAQTrigger:
+    """Rising edges of a DAQ DIO line, e.g. the WAITING signal of PulseBlasterUSB.
+
+    Every edge is a change detection sample of the task, so the samples acquired count edges
+    even if callbacks of some of them were lost.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.emitted = 0
+        self.task = None
+
+    def start(self, callback):
+        # imported here, so simulated triggers work on computers without NI-DAQmx
+        import nidaqmx
+        import nidaqmx.constants as const
+
+        def on_change(task_handle=None, signal_type=None, callback_data=None):
+            self.emitted += 1
+            callback(self.task.in_stream.total_samp_per_chan_acquired)
+            # return an int is necessary for DAQ callback function
+            return 0
+
+        self.task = nidaqmx.Task()
+        self.task.di_channels.add_di_chan(self.channel)
+        self.task.timing.cfg_change_detection_timing(rising_edge_chan=self.channel,
+                                                    sample_mode=const.AcquisitionType.CONTINUOUS
+                                                    )
+        # samples are never read, only counted
+        self.task.in_stream.over_write = const.OverwriteMode.OVERWRITE_UNREAD_SAMPLES
+        # see https://nidaqmx-python.readthedocs.io/en/latest/task.html for the prototype of callback method
+        self.task.register_signal_event(const.Signal.CHANGE_DETECTION_EVENT, on_change)
+        self.task.start()
+
+    def stop(self):
+        if self.task is not None:
+            self.task.close()
+            self.task = None
+
+
+class SimulatedTrigger:
+    """Timer thread emitting triggers at a fixed rate (in Hz) with Gaussian jitter (in s)."""
+
+    def __init__(self, rate, jitter=0.0, count=None):
+        self.period = 1.0/rate
+        self.jitter = jitter
+        self.count = count # stop after this many triggers, None for no limit
+        self.emitted = 0
+        self.stopped = threading.Event()
+
+    def start(self, callback):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, args=(callback,), daemon=True)
+        self.thread.start()
+
+    def run(self, callback):
+        next_time = time.perf_counter()
+        while not self.stopped.is_set():
+            if (self.count is not None) and (self.emitted >= self.count):
+                break
+            next_time += max(self.period + random.gauss(0.0, self.jitter), 0.0)
+            delay = next_time - time.perf_counter()
+            if delay > 0 and self.stopped.wait(delay):
+                break
+            self.emitted += 1
+            callback(self.emitted)
+
+    def stop(self):
+        self.stopped.set()
+
+
+class EmulatorTrigger:
+    """Triggers driven by the WAIT state of an emulated PulseBlasterUSB (see pb_emulator.py).
+
+    Whenever the board starts waiting, the host is triggered at once, like by the WAITING
+    signal; the board itself is triggered again period seconds later, like by the experiment.
+    """
+
+    def __init__(self, emulator, period, jitter=0.0, board_number=0):
+        self.emulator = emulator
+        self.period = period
+        self.jitter = jitter
+        self.board_number = board_number
+        self.emitted = 0
+        self.waiting = threading.Event()
+        self.stopped = threading.Event()
+
+    def on_wait(self, board_number):
+        if board_number == self.board_number:
+            self.waiting.set()
+
+    def start(self, callback):
+        self.stopped.clear()
+        self.emulator.wait_callbacks.append(self.on_wait)
+        # the board may have reached its first WAIT already
+        if self.emulator.boards[self.board_number].status & STATUS_WAITING:
+            self.waiting.set()
+        self.thread = threading.Thread(target=self.run, args=(callback,), daemon=True)
+        self.thread.start()
+
+    def run(self, callback):
+        while not self.stopped.is_set():
+            if not self.waiting.wait(0.1):
+                continue
+            self.waiting.clear()
+            self.emitted += 1
+            callback(self.emitted)
+            if self.stopped.wait(max(self.period + random.gauss(0.0, self.jitter), 0.0)):
+                break
+            self.emulator.trigger(self.board_number)
+
+    def stop(self):
+        self.stopped.set()
+        if self.on_wait in self.emulator.wait_callbacks:
+            self.emulator.wait_callbacks.remove(self.on_wait)